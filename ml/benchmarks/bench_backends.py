@@ -0,0 +1,128 @@
+"""
+Latency, throughput and prediction deviation of the model backends
+
+Every backend (MODEL_BACKEND values: xgboost, compiled, onnx, treelite)
+serves the same requests, built from rows of solar_panel_combined_dataset.csv,
+through the path /predict uses: encode the reading, predict efficiency,
+predict suitability from the site features. Single requests and batches are
+timed separately. Deviations are measured against the first backend run
+(xgboost by default). Backends whose package or exported files are missing
+are skipped. Usage (from
+the ml folder, after src/runtimes.py):
+
+    python benchmarks/bench_backends.py
+    python benchmarks/bench_backends.py --backends xgboost onnx --requests 5000 --batch-size 512
+"""
+
+import argparse
+import importlib.util
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from dataio import read_table
+from features import SITE_FEATURE_SPEC
+from model_registry import MODEL_BACKENDS, MODEL_DIR, ModelBundle
+from runtimes import RUNTIME_PACKAGES
+
+DATASET = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'solar_panel_combined_dataset.csv')
+
+def make_requests(path, n, seed=42):
+    """
+    n /predict readings drawn from dataset rows
+
+    Readings carry every numeric column the encoder knows plus irradiance,
+    which the dataset only has as GHI (see features.SITE_FEATURE_SPEC).
+    """
+    df = read_table(path)
+    scale = SITE_FEATURE_SPEC['GHI (kWh/m²/day)'][1]
+    df['irradiance'] = df['GHI (kWh/m²/day)'] / scale
+    columns = [c for c in df.columns if c not in ('panel_id', 'timestamp', 'efficiency', 'Label (Yes/No)')
+               and df[c].dtype.kind in 'if']
+    rows = np.random.default_rng(seed).integers(0, len(df), n)
+    return df.iloc[rows][columns].to_dict('records')
+
+def predict(bundle, readings):
+    """The model part of /predict for a list of readings"""
+    batch = bundle.encoder.encode_batch(readings)
+    efficiency = bundle.model_eff.predict(batch.X)
+    site = bundle.encoder.site_features(batch.base)
+    probability = bundle.model_site.predict_proba(site)[:, 1]
+    return efficiency, probability
+
+def percentile_us(seconds, q):
+    return float(np.percentile(seconds, q) * 1e6)
+
+def bench(bundle, requests, batch_size, warmup=20):
+    """Per-call latencies of single requests and batches, plus all outputs"""
+    for reading in requests[:warmup]:
+        predict(bundle, [reading])
+    single = []
+    for reading in requests:
+        start = time.perf_counter()
+        predict(bundle, [reading])
+        single.append(time.perf_counter() - start)
+    batches = [requests[i:i + batch_size] for i in range(0, len(requests), batch_size)]
+    batch_seconds, outputs = [], []
+    for chunk in batches:
+        start = time.perf_counter()
+        outputs.append(predict(bundle, chunk))
+        batch_seconds.append(time.perf_counter() - start)
+    efficiency = np.concatenate([o[0] for o in outputs])
+    probability = np.concatenate([o[1] for o in outputs])
+    return {
+        "single_p50_us": percentile_us(single, 50),
+        "single_p99_us": percentile_us(single, 99),
+        "single_rps": len(single) / sum(single),
+        "batch_p50_us": percentile_us(batch_seconds, 50),
+        "batch_p99_us": percentile_us(batch_seconds, 99),
+        "batch_rows_per_s": len(requests) / sum(batch_seconds),
+    }, efficiency, probability
+
+def load_backend(backend, model_dir):
+    """(warmed ModelBundle, None), or (None, reason the backend cannot run here)"""
+    package = RUNTIME_PACKAGES.get(backend, 'xgboost' if backend == 'xgboost' else None)
+    if package and importlib.util.find_spec(package) is None:
+        return None, f"{package} is not installed"
+    try:
+        return ModelBundle(model_dir, backend).warm(), None
+    except FileNotFoundError as e:
+        return None, str(e)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--backends', nargs='+', choices=MODEL_BACKENDS, default=list(MODEL_BACKENDS))
+    parser.add_argument('--requests', type=int, default=2000, help="Requests per backend")
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--dataset', default=DATASET)
+    parser.add_argument('--model-dir', default=MODEL_DIR)
+    args = parser.parse_args()
+
+    requests = make_requests(args.dataset, args.requests)
+    print(f"{len(requests):,} requests from {os.path.basename(args.dataset)}, batches of {args.batch_size}")
+    print(f"{'backend':<10}{'1-req p50 us':>13}{'p99 us':>9}{'req/s':>9}{'batch p50 ms':>14}{'p99 ms':>9}"
+          f"{'rows/s':>11}{'max |d eff|':>13}{'max |d prob|':>14}{'labels':>8}")
+    reference = None
+    for backend in args.backends:
+        bundle, reason = load_backend(backend, args.model_dir)
+        if bundle is None:
+            print(f"{backend:<10}skipped: {reason}")
+            continue
+        report, efficiency, probability = bench(bundle, requests, args.batch_size)
+        if reference is None:
+            reference = (backend, efficiency, probability)
+        d_eff = np.max(np.abs(efficiency - reference[1]))
+        d_prob = np.max(np.abs(probability - reference[2]))
+        labels = int(np.sum((probability > 0.5) != (reference[2] > 0.5)))
+        print(f"{backend:<10}{report['single_p50_us']:>13.1f}{report['single_p99_us']:>9.1f}"
+              f"{report['single_rps']:>9,.0f}{report['batch_p50_us'] / 1e3:>14.2f}{report['batch_p99_us'] / 1e3:>9.2f}"
+              f"{report['batch_rows_per_s']:>11,.0f}{d_eff:>13.2e}{d_prob:>14.2e}{labels:>8}")
+    if reference is not None:
+        print(f"Deviations are against the {reference[0]} backend")
+
+if __name__ == "__main__":
+    main()
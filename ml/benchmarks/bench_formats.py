@@ -0,0 +1,76 @@
+"""
+Disk size and load time of the combined dataset as CSV, Parquet and Feather
+
+Larger sizes are built by resampling rows of solar_panel_combined_dataset.csv,
+so the value distributions match the real dataset. Usage (from the ml folder):
+
+    python benchmarks/bench_formats.py
+    python benchmarks/bench_formats.py --sizes 5000 1000000 10000000
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from dataio import FORMATS, read_columns, read_table, write_table
+
+# Columns read by the projected load
+PROJECTED_COLUMNS = 10
+
+DATASET = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'solar_panel_combined_dataset.csv')
+
+def make_dataset(source, n, seed=42):
+    """n rows drawn with replacement from source"""
+    rng = np.random.default_rng(seed)
+    return source.iloc[rng.integers(0, len(source), n)].reset_index(drop=True)
+
+def timed(fn, repeat):
+    """Best wall time of fn() over repeat runs, in seconds"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[5_000, 1_000_000, 10_000_000])
+    parser.add_argument('--dataset', default=DATASET)
+    parser.add_argument('--repeat', type=int, default=3, help="Loads per measurement (best is reported)")
+    args = parser.parse_args()
+
+    source = read_table(args.dataset)
+    # Column projection: the first PROJECTED_COLUMNS columns after the panel id
+    projected = [c for c in read_columns(args.dataset) if c != 'panel_id'][:PROJECTED_COLUMNS]
+    workdir = tempfile.mkdtemp(prefix="bench_formats_")
+    try:
+        print(f"{'rows':>10}  {'format':<9}{'size MB':>10}{'write s':>10}{'load s':>10}"
+              f"{f'{len(projected)} cols s':>11}")
+        for n in args.sizes:
+            df = make_dataset(source, n)
+            csv_load = None
+            for fmt, ext in FORMATS.items():
+                path = os.path.join(workdir, f"data_{n}{ext}")
+                # Bind the frame and path now; df is deleted after each size
+                write_s = timed(lambda df=df, path=path: write_table(df, path), 1)
+                size_mb = os.path.getsize(path) / 1e6
+                load_s = timed(lambda path=path: read_table(path), args.repeat)
+                cols_s = timed(lambda path=path: read_table(path, columns=projected), args.repeat)
+                csv_load = csv_load or load_s
+                print(f"{n:>10,}  {fmt:<9}{size_mb:>10.2f}{write_s:>10.3f}{load_s:>10.3f}{cols_s:>11.3f}"
+                      f"   x{csv_load / load_s:.1f}")
+                os.remove(path)
+            del df
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Latency benchmark for /predict: full response vs. the lightweight path
+
+Runs the Flask app in-process through its test client, so no server is
+needed. Usage (from the ml folder):
+
+    python benchmarks/bench_predict.py --requests 500
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from app import app
+
+VARIANTS = {
+    "full": "/predict",
+    "no_explain": "/predict?explain=false",
+    "efficiency_only": "/predict?fields=none",
+}
+
+def make_readings(n, seed=42):
+    """Random but reproducible readings in realistic ranges"""
+    rng = random.Random(seed)
+    return [{
+        'temperature': round(rng.uniform(5, 45), 1),
+        'humidity': round(rng.uniform(10, 95), 1),
+        'irradiance': round(rng.uniform(100, 1100), 1),
+        'dust_index': round(rng.uniform(0, 1), 3),
+        'cloudcover': rng.randint(0, 100)
+    } for _ in range(n)]
+
+def percentile(values, q):
+    """q-th percentile of a list of numbers"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+def bench(client, url, readings):
+    """Per-request latencies in milliseconds"""
+    latencies = []
+    for reading in readings:
+        start = time.perf_counter()
+        response = client.post(url, json=reading)
+        latencies.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == 200, response.get_json()
+    return latencies
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--requests', type=int, default=500, help="Requests per variant")
+    parser.add_argument('--warmup', type=int, default=20, help="Untimed requests per variant")
+    args = parser.parse_args()
+
+    client = app.test_client()
+    # Distinct readings so the explanation cache does not hide the SHAP cost
+    readings = make_readings(args.requests * len(VARIANTS) + args.warmup)
+
+    print(f"{'variant':<18}{'p50 ms':>10}{'p99 ms':>10}{'mean ms':>10}")
+    baseline = None
+    for i, (name, url) in enumerate(VARIANTS.items()):
+        bench(client, url, readings[:args.warmup])
+        chunk = readings[args.warmup + i * args.requests:args.warmup + (i + 1) * args.requests]
+        latencies = bench(client, url, chunk)
+        p50 = percentile(latencies, 50)
+        baseline = baseline or p50
+        print(f"{name:<18}{p50:>10.3f}{percentile(latencies, 99):>10.3f}"
+              f"{sum(latencies) / len(latencies):>10.3f}   x{baseline / p50:.2f}")
+
+if __name__ == "__main__":
+    main()
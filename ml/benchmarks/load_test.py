@@ -0,0 +1,152 @@
+"""
+Throughput of the production server (gunicorn.conf.py) by worker count
+
+For every worker count, starts gunicorn from ml/src on a local port, waits
+until /health answers, then lets client processes send /predict requests
+over keep-alive connections for a fixed time. Reports requests per second,
+latency percentiles and errors, and the speedup over the first worker count.
+Throughput only scales up to the number of cores shared by the server and
+the clients, so run it on a multi-core machine. Usage (from the ml folder):
+
+    python benchmarks/load_test.py
+    python benchmarks/load_test.py --workers 1 2 4 8 --clients 32 --duration 20 --path "/predict?explain=false"
+"""
+
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def start_server(workers, threads, port, backend=None, startup_timeout=120):
+    """Start gunicorn with gunicorn.conf.py and wait until /health answers"""
+    env = dict(os.environ, PORT=str(port), WEB_CONCURRENCY=str(workers), GUNICORN_THREADS=str(threads))
+    if backend:
+        env['MODEL_BACKEND'] = backend
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:app'],
+                              cwd=SRC, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    deadline = time.monotonic() + startup_timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"gunicorn exited: {server.stderr.read().decode()[-2000:]}")
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            connection.request('GET', '/health')
+            if connection.getresponse().status == 200:
+                return server
+        except OSError:
+            pass
+        time.sleep(0.5)
+    stop_server(server)
+    raise RuntimeError("gunicorn did not become healthy in time")
+
+def stop_server(server):
+    server.send_signal(signal.SIGTERM)
+    try:
+        server.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        server.kill()
+
+def make_reading(rng):
+    """Random but realistic reading, distinct per request so caches don't hide the work"""
+    return {
+        'temperature': round(rng.uniform(5, 45), 2),
+        'humidity': round(rng.uniform(10, 95), 2),
+        'irradiance': round(rng.uniform(100, 1100), 2),
+        'dust_index': round(rng.uniform(0, 1), 3),
+        'cloudcover': rng.randint(0, 100)
+    }
+
+def client(port, path, duration, seed):
+    """
+    Send requests over one keep-alive connection until duration has passed
+
+    Returns:
+        (latencies in seconds, error count)
+    """
+    rng = random.Random(seed)
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    headers = {'Content-Type': 'application/json'}
+    latencies, errors = [], 0
+    end = time.perf_counter() + duration
+    while time.perf_counter() < end:
+        body = json.dumps(make_reading(rng))
+        start = time.perf_counter()
+        try:
+            connection.request('POST', path, body, headers)
+            response = connection.getresponse()
+            response.read()
+            if response.status != 200:
+                errors += 1
+                continue
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            connection.close()
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+            continue
+        latencies.append(time.perf_counter() - start)
+    connection.close()
+    return latencies, errors
+
+def percentile_ms(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))] * 1000 if ordered else 0.0
+
+def run_load(port, path, clients, duration, warmup):
+    """Requests per second, latencies and errors of clients processes hitting the server"""
+    with multiprocessing.Pool(clients) as pool:
+        pool.starmap(client, [(port, path, warmup, 1000 + i) for i in range(clients)])
+        start = time.perf_counter()
+        results = pool.starmap(client, [(port, path, duration, i) for i in range(clients)])
+        elapsed = time.perf_counter() - start
+    latencies = [latency for result in results for latency in result[0]]
+    return {
+        "requests": len(latencies),
+        "errors": sum(result[1] for result in results),
+        "rps": len(latencies) / elapsed,
+        "p50_ms": percentile_ms(latencies, 50),
+        "p99_ms": percentile_ms(latencies, 99)
+    }
+
+def main():
+    cpus = os.cpu_count()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--workers', type=int, nargs='+',
+                        default=sorted({1, 2, 4, max(1, cpus // 2), cpus}), help="Worker counts to compare")
+    parser.add_argument('--threads', type=int, default=4, help="Threads per worker")
+    parser.add_argument('--clients', type=int, default=max(4, 2 * cpus), help="Concurrent client processes")
+    parser.add_argument('--duration', type=float, default=10, help="Seconds of load per worker count")
+    parser.add_argument('--warmup', type=float, default=2, help="Untimed seconds of load first")
+    parser.add_argument('--path', default='/predict', help="Request path, e.g. /predict?explain=false")
+    parser.add_argument('--backend', help="MODEL_BACKEND for the server")
+    args = parser.parse_args()
+
+    print(f"{cpus} CPUs, {args.clients} clients, {args.threads} threads per worker, POST {args.path}")
+    print(f"{'workers':>8}{'requests':>10}{'req/s':>10}{'p50 ms':>9}{'p99 ms':>9}{'errors':>8}")
+    baseline = None
+    for workers in args.workers:
+        port = free_port()
+        server = start_server(workers, args.threads, port, args.backend)
+        try:
+            result = run_load(port, args.path, args.clients, args.duration, args.warmup)
+        finally:
+            stop_server(server)
+        baseline = baseline or result["rps"]
+        print(f"{workers:>8}{result['requests']:>10,}{result['rps']:>10,.0f}{result['p50_ms']:>9.2f}"
+              f"{result['p99_ms']:>9.2f}{result['errors']:>8}   x{result['rps'] / baseline:.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+"""
+Benchmark suite for the serving and training paths, with regression checks
+
+Runs every case below, writes the results to a JSON file and, with
+--compare, checks them against a stored baseline:
+
+    predict        Single /predict latency with and without the SHAP explanation
+    batch          /predict/batch throughput at several batch sizes
+    cold_start     Importing app.py (models included) in a fresh interpreter
+    merge          combined.py merge, enrichment and cleaning at several sizes
+    train          Fitting the efficiency and suitability models at several sizes
+
+The app runs in-process through the Flask test client. Inputs are generated
+from fixed seeds and larger sizes are resampled from the shipped datasets,
+so two runs on the same machine measure the same work. Metrics ending in
+_per_s are better when higher, all others (seconds, milliseconds) when
+lower. Usage (from the ml folder):
+
+    python benchmarks/run_benchmarks.py --output baseline.json
+    python benchmarks/run_benchmarks.py --compare baseline.json
+    python benchmarks/run_benchmarks.py --cases predict batch --quick --compare baseline.json --threshold 0.2
+
+With --compare the exit status is 1 if any metric regressed by more than the
+threshold, so the suite can gate CI.
+"""
+
+import argparse
+import importlib.metadata
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+ML = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+SRC = os.path.join(ML, 'src')
+ROOT = os.path.join(ML, '..')
+sys.path.insert(0, SRC)
+sys.path.insert(0, ML)
+
+# Keep runs comparable: no LLM calls, no profiling, no model watcher, no response cache
+BENCH_ENV = {'USE_OPENAI': 'false', 'PROFILE_RATE': '0', 'MODEL_WATCH_INTERVAL': '0', 'RESPONSE_CACHE': 'none'}
+os.environ.update(BENCH_ENV)
+
+DATASET = os.path.join(SRC, 'solar_panel_combined_dataset.csv')
+PACKAGES = ('numpy', 'pandas', 'xgboost', 'scikit-learn', 'flask')
+
+SIZES = {
+    'batch': ([100, 1000], [100]),  # (full, --quick)
+    'merge': ([5_000, 50_000, 200_000], [5_000]),
+    'train': ([1_000, 5_000, 20_000], [1_000]),
+}
+
+def make_readings(n, seed=42):
+    """Random but reproducible readings in realistic ranges, distinct so caches don't hide the work"""
+    rng = random.Random(seed)
+    return [{
+        'temperature': round(rng.uniform(5, 45), 2),
+        'humidity': round(rng.uniform(10, 95), 2),
+        'irradiance': round(rng.uniform(100, 1100), 2),
+        'dust_index': round(rng.uniform(0, 1), 3),
+        'cloudcover': rng.randint(0, 100)
+    } for _ in range(n)]
+
+def resample(df, n, seed=42):
+    """n rows drawn with replacement from df"""
+    return df.iloc[np.random.default_rng(seed).integers(0, len(df), n)].reset_index(drop=True)
+
+def latency_stats(seconds, prefix=''):
+    ms = np.array(seconds) * 1000
+    return {f"{prefix}p50_ms": float(np.percentile(ms, 50)), f"{prefix}p99_ms": float(np.percentile(ms, 99)),
+            f"{prefix}mean_ms": float(ms.mean())}
+
+def timed_posts(client, url, payloads, **kwargs):
+    """Seconds per request"""
+    seconds = []
+    for payload in payloads:
+        start = time.perf_counter()
+        response = client.post(url, json=payload, **kwargs)
+        seconds.append(time.perf_counter() - start)
+        assert response.status_code == 200, response.get_json()
+    return seconds
+
+def test_client():
+    from app import app
+    return app.test_client()
+
+def bench_predict(args):
+    """Single /predict latency, full response and without the explanation"""
+    client = test_client()
+    variants = {"explain": "/predict", "no_explain": "/predict?explain=false"}
+    readings = make_readings(len(variants) * (args.requests + args.warmup))
+    results = {}
+    for i, (name, url) in enumerate(variants.items()):
+        chunk = readings[i * (args.requests + args.warmup):(i + 1) * (args.requests + args.warmup)]
+        timed_posts(client, url, chunk[:args.warmup])
+        seconds = timed_posts(client, url, chunk[args.warmup:])
+        results.update(latency_stats(seconds, f"{name}_"))
+        results[f"{name}_requests_per_s"] = len(seconds) / sum(seconds)
+    return results
+
+def bench_batch(args):
+    """/predict/batch time per batch and rows per second"""
+    client = test_client()
+    results = {}
+    for size in args.sizes['batch']:
+        repeats = max(3, args.requests // size)
+        batches = [make_readings(size, seed=1000 + i) for i in range(repeats + 1)]
+        timed_posts(client, '/predict/batch', batches[:1])
+        seconds = timed_posts(client, '/predict/batch', batches[1:])
+        results[f"batch_{size}_p50_ms"] = float(np.percentile(seconds, 50) * 1000)
+        results[f"batch_{size}_rows_per_s"] = size * len(seconds) / sum(seconds)
+    return results
+
+def bench_cold_start(args):
+    """Import time of app.py (models loaded and warmed) in fresh interpreters"""
+    code = "import time; start = time.perf_counter(); import app; print(time.perf_counter() - start)"
+    imports, totals = [], []
+    for _ in range(args.cold_starts):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, '-c', code], cwd=SRC, env={**os.environ, **BENCH_ENV},
+                                capture_output=True, text=True, check=True).stdout
+        totals.append(time.perf_counter() - start)
+        imports.append(float(output.strip().splitlines()[-1]))
+    return {"import_s": statistics.median(imports), "process_s": statistics.median(totals)}
+
+def bench_merge(args):
+    """combined.py merge_datasets + add_synthetic_features + clean_dataset on resampled sensor data"""
+    import combined
+
+    sensor = pd.read_csv(os.path.join(ROOT, combined.SENSOR_PATH))
+    weather = pd.read_csv(os.path.join(ROOT, combined.WEATHER_PATH))
+    sites = pd.read_csv(os.path.join(ROOT, combined.SITES_PATH))
+    results = {}
+    for size in args.sizes['merge']:
+        df_sensor = resample(sensor, size)
+        seconds = []
+        for _ in range(args.repeats):
+            start = time.perf_counter()
+            df = combined.merge_datasets(df_sensor, weather, sites, verbose=False)
+            df = combined.add_synthetic_features(df, verbose=False)
+            combined.clean_dataset(df, verbose=False)
+            seconds.append(time.perf_counter() - start)
+        results[f"merge_{size}_s"] = statistics.median(seconds)
+        results[f"merge_{size}_rows_per_s"] = size / statistics.median(seconds)
+    return results
+
+def bench_train(args):
+    """Fit time of both models with the train_ml.py parameters on resampled training rows"""
+    import xgboost as xgb
+    import train_ml
+    from training import DEFAULT_PARAMS
+
+    train_ml.DATA_PATH = DATASET
+    X, y_eff, y_site, _ = train_ml.load_training_data()
+    models = {'efficiency': (xgb.XGBRegressor, y_eff), 'suitability': (xgb.XGBClassifier, y_site)}
+    results = {}
+    for size in args.sizes['train']:
+        rows = np.random.default_rng(42).integers(0, len(X), size)
+        for name, (model_class, y) in models.items():
+            start = time.perf_counter()
+            model_class(**{'random_state': 42, **DEFAULT_PARAMS[name]}).fit(X.iloc[rows], y.iloc[rows])
+            results[f"train_{name}_{size}_s"] = time.perf_counter() - start
+    return results
+
+CASES = {
+    'predict': bench_predict,
+    'batch': bench_batch,
+    'cold_start': bench_cold_start,
+    'merge': bench_merge,
+    'train': bench_train,
+}
+
+def environment():
+    """Where the results were measured, stored next to them"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ML, capture_output=True,
+                                text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    versions = {}
+    for package in PACKAGES:
+        try:
+            versions[package] = importlib.metadata.version(package)
+        except importlib.metadata.PackageNotFoundError:
+            versions[package] = None
+    return {
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "model_backend": os.environ.get('MODEL_BACKEND', 'xgboost'),
+        "packages": versions
+    }
+
+def higher_is_better(metric):
+    return metric.endswith('_per_s')
+
+def compare(results, baseline, threshold):
+    """
+    Relative change of every metric present in both runs
+
+    Returns:
+        List of (case, metric, baseline value, value, change, status); change
+        is positive when the metric got worse
+    """
+    rows = []
+    for case, metrics in results.items():
+        for metric, value in metrics.items():
+            old = baseline.get(case, {}).get(metric)
+            if old is None or old == 0:
+                continue
+            change = (old / value - 1) if higher_is_better(metric) else (value / old - 1)
+            status = "REGRESSION" if change > threshold else "improved" if change < -threshold else "ok"
+            rows.append((case, metric, old, value, change, status))
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--cases', nargs='+', choices=list(CASES), default=list(CASES))
+    parser.add_argument('--output', default='benchmark_results.json', help="JSON file for the results")
+    parser.add_argument('--compare', metavar='BASELINE', help="Results JSON of an earlier run to compare against")
+    parser.add_argument('--threshold', type=float, default=0.10, help="Relative slowdown reported as a regression")
+    parser.add_argument('--quick', action='store_true', help="Fewer requests and only the smallest sizes")
+    parser.add_argument('--requests', type=int, help="Timed /predict requests per variant (default 500, 100 quick)")
+    parser.add_argument('--warmup', type=int, default=20, help="Untimed requests first")
+    parser.add_argument('--repeats', type=int, default=3, help="Runs per merge size (median is reported)")
+    parser.add_argument('--cold-starts', type=int, default=3, help="Fresh interpreters for cold_start")
+    args = parser.parse_args()
+    args.requests = args.requests or (100 if args.quick else 500)
+    args.sizes = {case: sizes[1] if args.quick else sizes[0] for case, sizes in SIZES.items()}
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    report = {"environment": environment(), "settings": {k: v for k, v in vars(args).items()
+                                                         if k not in ('output', 'compare')}, "results": {}}
+    for case in args.cases:
+        print(f"Running {case}...", flush=True)
+        start = time.perf_counter()
+        report["results"][case] = CASES[case](args)
+        print(f"  {case} done in {time.perf_counter() - start:.1f}s")
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print(f"\n{'case':<12}{'metric':<34}{'value':>14}")
+    for case, metrics in report["results"].items():
+        for metric, value in metrics.items():
+            print(f"{case:<12}{metric:<34}{value:>14,.3f}")
+    print(f"\nResults saved to {args.output}")
+
+    if baseline is None:
+        return 0
+    for key in ('cpu_count', 'python', 'model_backend'):
+        if baseline["environment"].get(key) != report["environment"][key]:
+            print(f"Warning: baseline {key} was {baseline['environment'].get(key)}, "
+                  f"now {report['environment'][key]} - results may not be comparable")
+    rows = compare(report["results"], baseline["results"], args.threshold)
+    print(f"\nAgainst {args.compare} (commit {baseline['environment'].get('commit')}), threshold {args.threshold:.0%}:")
+    print(f"{'case':<12}{'metric':<34}{'baseline':>14}{'now':>14}{'change':>9}  status")
+    for case, metric, old, value, change, status in rows:
+        print(f"{case:<12}{metric:<34}{old:>14,.3f}{value:>14,.3f}{change:>+9.1%}  {status}")
+    regressions = sum(1 for row in rows if row[-1] == "REGRESSION")
+    print(f"\n{regressions} regression(s)" if regressions else "\nNo regressions")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
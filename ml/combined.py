@@ -1,19 +1,93 @@
 """
 Solar Panel Dataset Merger
 Combines sensor, weather, and site data into a single comprehensive dataset
+
+Sensor rows with a panel location (lat/lon columns, or a --locations file
+mapping panel_id to lat/lon) get the weather of their nearest station, or the
+inverse distance weighted average of the --weather-k nearest, and the
+nearest site when the site table has coordinates (see src/geo_index.py).
+Rows without a location are assigned a random station and site.
 """
 
+import argparse
+import os
+import sys
 import pandas as pd
 import numpy as np
 from pathlib import Path
 
-def load_datasets():
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src'))
+from dataio import FORMATS, TableWriter, iter_table, read_table, with_format, write_table
+from geo_index import WEATHER_FIELDS, GeoIndex, WeatherStations
+
+SENSOR_PATH = 'data/synthetic/sensor_data.csv'
+WEATHER_PATH = 'data/raw/indian_weather_data.csv'
+SITES_PATH = 'data/raw/Solar_Sites_Dataset_India.csv'
+OUTPUT_PATH = 'data/processed/solar_panel_combined_dataset.csv'
+
+SEED = 42
+# Random draws are generated per block of rows, each block seeded from (SEED, stream, block),
+# so any row gets the same draws whether the file is processed whole or in chunks
+RNG_BLOCK_ROWS = 10_000
+WEATHER_STREAM, SITES_STREAM, IRRADIANCE_STREAM = 0, 1, 2
+
+def block_draws(stream, start, stop, draw, seed=SEED):
+    """
+    Reproducible random values for rows [start, stop) of the sensor data
+    
+    Args:
+        stream: Independent stream id (one per kind of draw)
+        start, stop: Global row range
+        draw: Function (generator, size) -> array, always called with a full block
+        seed: Base seed
+    
+    Returns:
+        Array with one value per row in the range
+    """
+    if stop <= start:
+        return draw(np.random.default_rng([seed, stream, 0]), 0)
+    parts = []
+    first_block, last_block = start // RNG_BLOCK_ROWS, (stop - 1) // RNG_BLOCK_ROWS
+    for block in range(first_block, last_block + 1):
+        values = draw(np.random.default_rng([seed, stream, block]), RNG_BLOCK_ROWS)
+        block_start = block * RNG_BLOCK_ROWS
+        parts.append(values[max(start - block_start, 0):min(stop - block_start, RNG_BLOCK_ROWS)])
+    return np.concatenate(parts)
+
+def has_location(df):
+    return 'lat' in df.columns and 'lon' in df.columns
+
+def add_panel_locations(df_sensor, locations):
+    """Add lat/lon columns to sensor rows from a table of panel_id, lat, lon"""
+    if locations is None or has_location(df_sensor):
+        return df_sensor
+    return df_sensor.merge(locations[['panel_id', 'lat', 'lon']], on='panel_id', how='left')
+
+def build_indexes(df_weather, df_sites, weather_k=1):
+    """
+    Spatial indexes for merge_datasets, built once per merge
+
+    Returns:
+        (WeatherStations or None, GeoIndex over the sites or None), None for
+        a table without lat/lon columns
+    """
+    stations = WeatherStations(df_weather, WEATHER_FIELDS, k=weather_k) if has_location(df_weather) else None
+    site_index = GeoIndex(df_sites['lat'], df_sites['lon']) if has_location(df_sites) else None
+    return stations, site_index
+
+def located_rows(df):
+    """Boolean mask of rows with both lat and lon"""
+    if not has_location(df):
+        return np.zeros(len(df), dtype=bool)
+    return (df['lat'].notna() & df['lon'].notna()).to_numpy()
+
+def load_datasets(sensor_path=SENSOR_PATH):
     """Load all three datasets"""
     print("Loading datasets...")
     
-    df_sensor = pd.read_csv('data/synthetic/sensor_data.csv')
-    df_weather = pd.read_csv('data/raw/indian_weather_data.csv')
-    df_sites = pd.read_csv('data/raw/Solar_Sites_Dataset_India.csv')
+    df_sensor = read_table(sensor_path)
+    df_weather = pd.read_csv(WEATHER_PATH)
+    df_sites = pd.read_csv(SITES_PATH)
     
     print(f"Sensor data: {df_sensor.shape}")
     print(f"Weather data: {df_weather.shape}")
@@ -21,25 +95,46 @@ def load_datasets():
     
     return df_sensor, df_weather, df_sites
 
-def merge_datasets(df_sensor, df_weather, df_sites):
+def merge_datasets(df_sensor, df_weather, df_sites, row_offset=0, verbose=True, indexes=None, weather_k=1):
     """
     Merge the three datasets into one comprehensive dataset
+    
+    Args:
+        row_offset: Global position of df_sensor's first row, so chunks of a
+            larger file get the same random assignments as the whole file
+        indexes: build_indexes() result to reuse across calls; built here
+            when the sensor rows have locations and it is not given
+        weather_k: Stations averaged per located row when building the indexes here
     """
-    print("\nMerging datasets...")
+    if verbose:
+        print("\nMerging datasets...")
+    rows = (row_offset, row_offset + len(df_sensor))
+    located = located_rows(df_sensor)
+    if located.any() and indexes is None:
+        indexes = build_indexes(df_weather, df_sites, weather_k)
+    stations, site_index = indexes or (None, None)
     
     # Step 1: Sample weather features for each sensor row
     # This randomly assigns weather conditions to each sensor reading
-    weather_sample = df_weather.sample(len(df_sensor), replace=True, random_state=42).reset_index(drop=True)
+    weather_idx = block_draws(WEATHER_STREAM, *rows, lambda rng, n: rng.integers(0, len(df_weather), n))
+    weather_sample = df_weather.iloc[weather_idx].reset_index(drop=True)
     
     # Extract relevant weather columns
-    weather_cols = ['temperature', 'humidity', 'cloudcover', 'precip', 'wind_speed']
     # Only use columns that exist in the weather dataset
-    available_weather_cols = [col for col in weather_cols if col in df_weather.columns]
+    available_weather_cols = [col for col in WEATHER_FIELDS if col in df_weather.columns]
+    # Float for every chunk, whether or not it has located rows, so streamed
+    # chunks write the same column types
+    weather_sample = weather_sample[available_weather_cols].astype(float)
+    
+    # Located readings take the weather of their nearest station(s) instead
+    if located.any() and stations is not None:
+        values, _, _ = stations.lookup(df_sensor['lat'].to_numpy()[located], df_sensor['lon'].to_numpy()[located])
+        weather_sample.loc[located, stations.fields] = values
     
     # Step 2: Concatenate sensor data with weather features
     df_merged = pd.concat([
         df_sensor.reset_index(drop=True), 
-        weather_sample[available_weather_cols]
+        weather_sample
     ], axis=1)
     
     # Step 3: Add site information (if site_id exists in sensor data, otherwise randomly assign)
@@ -47,26 +142,32 @@ def merge_datasets(df_sensor, df_weather, df_sites):
         # Merge based on site_id
         df_merged = df_merged.merge(df_sites, on='site_id', how='left', suffixes=('', '_site'))
     else:
-        # Randomly sample site data for each row
-        sites_sample = df_sites.sample(len(df_merged), replace=True, random_state=42).reset_index(drop=True)
+        # Randomly sample site data for each row, or take the nearest site of located rows
+        sites_idx = block_draws(SITES_STREAM, *rows, lambda rng, n: rng.integers(0, len(df_sites), n))
+        if located.any() and site_index is not None:
+            sites_idx[located] = site_index.query(df_sensor['lat'].to_numpy()[located],
+                                                  df_sensor['lon'].to_numpy()[located])[0][:, 0]
+        sites_sample = df_sites.iloc[sites_idx].reset_index(drop=True)
         df_merged = pd.concat([df_merged, sites_sample], axis=1)
     
     return df_merged
 
-def add_synthetic_features(df_merged):
+def add_synthetic_features(df_merged, row_offset=0, verbose=True):
     """
     Add synthetic features and derive calculated fields
-    """
-    print("\nAdding synthetic and derived features...")
     
-    # Set random seed for reproducibility
-    np.random.seed(42)
+    Args:
+        row_offset: Global position of the first row (see merge_datasets)
+    """
+    if verbose:
+        print("\nAdding synthetic and derived features...")
     
     # Add synthetic irradiance (W/m²) if not present
     if 'irradiance' not in df_merged.columns:
         # Realistic irradiance values: 0-1200 W/m²
         # Higher during day, influenced by cloud cover if available
-        df_merged['irradiance'] = np.random.uniform(0, 1200, len(df_merged))
+        df_merged['irradiance'] = block_draws(IRRADIANCE_STREAM, row_offset, row_offset + len(df_merged),
+                                              lambda rng, n: rng.uniform(0, 1200, n))
         
         # Adjust based on cloud cover if available
         if 'cloudcover' in df_merged.columns:
@@ -85,7 +186,8 @@ def add_synthetic_features(df_merged):
     
     # Adjust efficiency based on environmental factors
     if 'efficiency' in df_merged.columns:
-        print("Adjusting efficiency based on environmental factors...")
+        if verbose:
+            print("Adjusting efficiency based on environmental factors...")
         
         # Create base efficiency if needed
         base_efficiency = df_merged['efficiency'].copy()
@@ -127,20 +229,26 @@ def add_synthetic_features(df_merged):
     
     return df_merged
 
-def clean_dataset(df):
+def clean_dataset(df, fill_values=None, verbose=True):
     """
     Clean the merged dataset
+    
+    Args:
+        fill_values: Replacement for missing values per column; defaults to
+            the column medians of df itself
     """
-    print("\nCleaning dataset...")
+    if verbose:
+        print("\nCleaning dataset...")
     
     # Remove duplicate columns
-    df = df.loc[:, ~df.columns.duplicated()]
+    df = df.loc[:, ~df.columns.duplicated()].copy()
     
     # Handle missing values
     numeric_cols = df.select_dtypes(include=[np.number]).columns
     for col in numeric_cols:
         if df[col].isnull().sum() > 0:
-            df[col].fillna(df[col].median(), inplace=True)
+            fill = fill_values.get(col) if fill_values is not None else None
+            df[col] = df[col].fillna(df[col].median() if fill is None else fill)
     
     # Ensure efficiency is between 0 and 1
     if 'efficiency' in df.columns:
@@ -162,8 +270,8 @@ def save_dataset(df, output_path):
     # Create output directory if it doesn't exist
     Path(output_path).parent.mkdir(parents=True, exist_ok=True)
     
-    # Save to CSV
-    df.to_csv(output_path, index=False)
+    # Save as CSV, Parquet or Arrow depending on the extension
+    write_table(df, output_path)
     
     print(f"Dataset saved successfully!")
     print(f"Final shape: {df.shape}")
@@ -173,6 +281,48 @@ def save_dataset(df, output_path):
     
     return output_path
 
+def stream_merge(sensor_path=SENSOR_PATH, output_path=OUTPUT_PATH, chunksize=100_000, locations=None, weather_k=1):
+    """
+    Merge a sensor file of any size in bounded memory
+    
+    Reads the sensor data in chunks, merges, enriches and cleans each chunk
+    and appends it to the output. Random assignments are keyed on global row
+    positions, so the output matches the in-memory path exactly for inputs
+    without missing values. Missing values are filled from the reference
+    tables' medians (weather/site columns) or the first chunk's medians
+    (sensor columns) instead of the whole-file medians.
+    
+    Args:
+        locations: Table of panel_id, lat, lon (see add_panel_locations)
+        weather_k: Stations averaged per located row
+    
+    Returns:
+        Number of rows written
+    """
+    print(f"Streaming {sensor_path} in chunks of {chunksize:,} rows...")
+    df_weather = pd.read_csv(WEATHER_PATH)
+    df_sites = pd.read_csv(SITES_PATH)
+    indexes = build_indexes(df_weather, df_sites, weather_k)
+    fill_values = {**df_sites.median(numeric_only=True).to_dict(), **df_weather.median(numeric_only=True).to_dict()}
+    
+    Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+    rows = 0
+    # The writer only replaces the previous output once the whole file was written
+    with TableWriter(output_path) as sink:
+        for i, chunk in enumerate(iter_table(sensor_path, chunksize)):
+            chunk = add_panel_locations(chunk, locations)
+            if i == 0:
+                fill_values = {**chunk.median(numeric_only=True).to_dict(), **fill_values}
+            df_chunk = merge_datasets(chunk, df_weather, df_sites, row_offset=rows, verbose=False, indexes=indexes)
+            df_chunk = add_synthetic_features(df_chunk, row_offset=rows, verbose=False)
+            df_chunk = clean_dataset(df_chunk, fill_values=fill_values, verbose=False)
+            sink.write(df_chunk)
+            rows += len(df_chunk)
+            print(f"  chunk {i + 1}: {rows:,} rows written")
+    
+    print(f"Dataset saved successfully to {output_path} ({rows:,} rows)")
+    return rows
+
 def generate_summary(df):
     """
     Generate summary statistics for the merged dataset
@@ -199,20 +349,36 @@ def generate_summary(df):
     
     return df
 
-def main():
+def main(stream=False, chunksize=100_000, sensor_path=SENSOR_PATH, output_path=OUTPUT_PATH, locations_path=None,
+         weather_k=1):
     """
     Main execution function
+    
+    Args:
+        stream: Process the sensor file in chunks instead of loading it whole
+        chunksize: Rows per chunk in streaming mode
+        locations_path: CSV of panel_id, lat, lon for sensor data without locations
+        weather_k: Weather stations averaged per located reading
     """
     print("="*80)
     print("SOLAR PANEL DATASET MERGER")
     print("="*80)
     
     try:
+        locations = read_table(locations_path) if locations_path else None
+        if stream:
+            stream_merge(sensor_path, output_path, chunksize, locations, weather_k)
+            print("\n" + "="*80)
+            print("MERGE COMPLETED SUCCESSFULLY!")
+            print("="*80)
+            return None
+        
         # Load datasets
-        df_sensor, df_weather, df_sites = load_datasets()
+        df_sensor, df_weather, df_sites = load_datasets(sensor_path)
+        df_sensor = add_panel_locations(df_sensor, locations)
         
         # Merge datasets
-        df_merged = merge_datasets(df_sensor, df_weather, df_sites)
+        df_merged = merge_datasets(df_sensor, df_weather, df_sites, weather_k=weather_k)
         
         # Add synthetic and derived features
         df_merged = add_synthetic_features(df_merged)
@@ -221,7 +387,6 @@ def main():
         df_merged = clean_dataset(df_merged)
         
         # Save dataset
-        output_path = 'data/processed/solar_panel_combined_dataset.csv'
         save_dataset(df_merged, output_path)
         
         # Generate summary
@@ -236,9 +401,9 @@ def main():
     except FileNotFoundError as e:
         print(f"\nError: Could not find file - {e}")
         print("\nPlease ensure the following files exist:")
-        print("  - data/synthetic/sensor_data.csv")
-        print("  - data/raw/indian_weather_data.csv")
-        print("  - data/raw/Solar_Sites_Dataset_India.csv")
+        print(f"  - {sensor_path}")
+        print(f"  - {WEATHER_PATH}")
+        print(f"  - {SITES_PATH}")
         return None
     
     except Exception as e:
@@ -248,4 +413,16 @@ def main():
         return None
 
 if __name__ == "__main__":
-    df_combined = main()
+    parser = argparse.ArgumentParser(description="Merge sensor, weather and site data")
+    parser.add_argument('--stream', action='store_true', help="Process the sensor file in chunks (bounded memory)")
+    parser.add_argument('--chunksize', type=int, default=100_000, help="Rows per chunk with --stream")
+    parser.add_argument('--sensor', default=SENSOR_PATH, help="Sensor data to merge (.csv, .parquet or .feather)")
+    parser.add_argument('--output', default=OUTPUT_PATH, help="Output file (.csv, .parquet or .feather)")
+    parser.add_argument('--format', choices=sorted(FORMATS), help="Override the output format")
+    parser.add_argument('--locations', help="Table of panel_id, lat, lon for sensor data without lat/lon columns")
+    parser.add_argument('--weather-k', type=int, default=1,
+                        help="Nearest weather stations averaged (inverse distance weighted) per located reading")
+    args = parser.parse_args()
+    output_path = with_format(args.output, args.format) if args.format else args.output
+    df_combined = main(stream=args.stream, chunksize=args.chunksize, sensor_path=args.sensor, output_path=output_path,
+                       locations_path=args.locations, weather_k=args.weather_k)
@@ -1,110 +1,101 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, g, has_request_context, request, jsonify, send_from_directory
 from flask_cors import CORS
-import joblib
-import pandas as pd
 import os
+import itertools
+import json
+import struct
+import time
 import traceback
+import uuid
+import numpy as np
+from insights import INSIGHT_LLM_CALLS, insight_service, USE_OPENAI
+from metrics import CONTENT_TYPE, Counter, Histogram, SampledProfiler, render, render_gauge
+from response_cache import RESPONSE_CACHE, RESPONSE_CACHE_LOOKUPS, load_response_cache
+from shared_store import SharedStore
+from suitability_map import MAP_RENDER_SECONDS, MAP_REQUESTS, WIND_MODEL_MISSING, SuitabilityMap
+from telemetry import TELEMETRY_CHUNK, TELEMETRY_READINGS, TelemetryStore
+from weather import WEATHER_LOOKUPS, WEATHER_PROVIDER, WEATHER_UPSTREAM_SECONDS, WeatherUnavailable, load_weather_service
 app = Flask(__name__)
 CORS(app)
 
-# Configuration
-USE_OPENAI = False  # Set to True if you have an OpenAI API key
-OPENAI_API_KEY = "api"  
 try:
-    from explain import explain_prediction
-    model_eff = joblib.load("efficiency_model.pkl")
-    feature_columns = joblib.load("feature_columns.pkl")
-    model_site = joblib.load("suitability_model.pkl")
-    site_feature_columns = joblib.load("site_feature_columns.pkl")
+    from explain import explain_matrix, get_engine, get_top_features, SHAP_AVAILABLE, EXPLAIN_BACKEND
+    from model_registry import MODEL_BACKEND, registry
+    # Only the 'shap' backend needs a TreeExplainer, the native one uses the booster
+    BUILD_EXPLAINER = EXPLAIN_BACKEND == 'shap'
+    # Load once before any worker fork so model memory stays shared
+    loaded_bundle = registry.preload(explainer=BUILD_EXPLAINER)
     print("Models loaded successfully")
-    print(f" Efficiency model features: {len(feature_columns)}")
-    print(f" Suitability model features: {len(site_feature_columns)}")
+    print(f" Efficiency model features: {len(loaded_bundle.feature_columns)}")
+    print(f" Suitability model features: {len(loaded_bundle.site_feature_columns)}")
 except FileNotFoundError as e:
     print(f"ERROR: Could not load model files - {e}")
     print("Make sure you have run train_ml.py first to generate the .pkl files")
     exit(1)
+except ValueError as e:
+    # Artifacts from different training runs (see feature_encoder.json)
+    print(f"ERROR: Model files are inconsistent - {e}")
+    exit(1)
 
-# Load explain module
-try:
-    
-    SHAP_AVAILABLE = True
+if EXPLAIN_BACKEND == 'shap':
     print(" SHAP explanation module loaded")
-except ImportError:
-    SHAP_AVAILABLE = False
-    print(" SHAP not available - will use simplified explanations")
-    
-    def explain_prediction(data):
-        """Fallback explanation without SHAP"""
-        return {
-            "temperature": -0.05 if data.get('temperature', 25) > 35 else 0.02,
-            "humidity": -0.03 if data.get('humidity', 50) > 70 else 0.01,
-            "irradiance": 0.08 if data.get('irradiance', 800) > 700 else -0.05,
-            "dust_index": -0.06 if data.get('dust_index', 0.5) > 0.5 else 0.01
-        }
+elif MODEL_BACKEND != 'xgboost':
+    print(f" Serving {MODEL_BACKEND} models with NumPy SHAP contributions")
+else:
+    print(" Using XGBoost native SHAP contributions")
 
-# Load OpenAI if enabled
-if USE_OPENAI:
-    try:
-        from openai import OpenAI
-        client = OpenAI(api_key=OPENAI_API_KEY)
-        print(" OpenAI client initialized")
-    except ImportError:
-        print(" OpenAI library not installed. Run: pip install openai")
-        USE_OPENAI = False
-    except Exception as e:
-        print(f" OpenAI initialization failed: {e}")
-        USE_OPENAI = False
+# Hot model reload
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')  # Required for /admin endpoints
+MODEL_WATCH_INTERVAL = float(os.environ.get('MODEL_WATCH_INTERVAL', 0))  # Seconds, 0 disables
+if MODEL_WATCH_INTERVAL > 0:
+    registry.watch(MODEL_WATCH_INTERVAL, explainer=BUILD_EXPLAINER)
+    # Threads do not survive fork, so every worker runs its own watcher
+    os.register_at_fork(after_in_child=lambda: registry.watch(MODEL_WATCH_INTERVAL, explainer=BUILD_EXPLAINER))
+    print(f" Watching model files every {MODEL_WATCH_INTERVAL:g}s")
+# POST /admin/reload reaches one worker, which broadcasts it to the others
+MODEL_RELOAD_POLL = float(os.environ.get('MODEL_RELOAD_POLL', 1.0))  # Seconds
+registry.follow(MODEL_RELOAD_POLL, explainer=BUILD_EXPLAINER)
+os.register_at_fork(after_in_child=lambda: registry.follow(MODEL_RELOAD_POLL, explainer=BUILD_EXPLAINER))
 
-def get_genai_insights(shap_explanation, efficiency):
-    """Get AI-powered insights (or fallback to rule-based)"""
-    if USE_OPENAI:
-        try:
-            prompt = f"Based on SHAP values {shap_explanation} for solar panel efficiency of {efficiency:.2%}. Provide 3 concise insights and actionable suggestions to improve or maintain efficiency."
-            response = client.chat.completions.create(
-                model="gpt-4",
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=250,
-                temperature=0.7
-            )
-            return response.choices[0].message.content.strip()
-        except Exception as e:
-            print(f"OpenAI API error: {e}")
-            return get_fallback_insights(shap_explanation, efficiency)
-    else:
-        return get_fallback_insights(shap_explanation, efficiency)
+# Weather lookups for /weather and readings that send lat/lon instead of weather values (see weather.py)
+try:
+    weather_service = load_weather_service(WEATHER_PROVIDER)
+    if weather_service is not None:
+        print(f" Weather lookup by lat/lon: {weather_service.provider.name} provider")
+except (OSError, KeyError, ValueError) as e:
+    weather_service = None
+    print(f"Warning: weather lookup not available ({e}) - readings must send their weather values")
 
-def get_fallback_insights(shap_explanation, efficiency):
-    """Rule-based insights when OpenAI is not available"""
-    insights = []
-    
-    # Analyze efficiency level
-    if efficiency > 0.85:
-        insights.append("✓ Excellent performance - System is operating at peak efficiency.")
-    elif efficiency > 0.75:
-        insights.append("⚠ Good performance with room for optimization.")
-    else:
-        insights.append("⚠ Low efficiency detected - Immediate attention required.")
-    
-    # Analyze top factors
-    top_factors = sorted(shap_explanation.items(), key=lambda x: abs(x[1]), reverse=True)[:3]
-    
-    for feature, impact in top_factors:
-        if 'temperature' in feature.lower() and impact < -0.03:
-            insights.append("🌡️ High temperature is reducing efficiency. Consider cooling systems or shade structures.")
-        elif 'irradiance' in feature.lower() and impact > 0.05:
-            insights.append("☀️ Good solar irradiance levels. Maintain panel cleanliness to maximize capture.")
-        elif 'dust' in feature.lower() and impact < -0.03:
-            insights.append("🧹 Dust accumulation detected. Schedule cleaning to restore 5-10% efficiency.")
-        elif 'humidity' in feature.lower() and impact < -0.02:
-            insights.append("💧 High humidity affecting performance. Monitor for condensation issues.")
-    
-    # Add recommendations
-    if efficiency < 0.80:
-        insights.append("📊 Recommendation: Conduct full system diagnostic and performance audit.")
-    else:
-        insights.append("🔄 Recommendation: Continue regular maintenance schedule for optimal performance.")
-    
-    return "\n".join(insights)
+# Solar and wind suitability heat maps (see suitability_map.py), re-rendered after a model reload
+try:
+    suitability_map = SuitabilityMap.load()
+    registry.on_reload(suitability_map.clear)
+    print(f" Suitability maps: solar{' and wind' if loaded_bundle.model_wind is not None else ''}")
+except (OSError, KeyError, ValueError) as e:
+    suitability_map = None
+    print(f"Warning: suitability maps not available ({e})")
+
+# Responses of /predict by quantized reading (see response_cache.py), dropped after a model reload
+try:
+    response_cache = load_response_cache(RESPONSE_CACHE)
+    if response_cache is not None:
+        registry.on_reload(response_cache.clear)
+        print(f" /predict response cache: {response_cache.backend.name}")
+except ValueError as e:
+    response_cache = None
+    print(f"Warning: /predict response cache disabled ({e})")
+
+# Rolling per-panel telemetry state (see telemetry.py), shared by the workers
+try:
+    telemetry = TelemetryStore()
+    print(f" Telemetry: up to {telemetry.max_panels:,} panels, {telemetry.window} readings each "
+          f"({telemetry.bytes_per_panel():,.0f} bytes per panel)")
+except ValueError as e:
+    telemetry = None
+    print(f"Warning: telemetry ingest not available ({e})")
+
+if USE_OPENAI:
+    print(f" LLM insights enabled ({insight_service.client.url}) - served asynchronously via /insights/<token>")
 
 @app.route("/", methods=["GET"])
 def serve_html():
@@ -124,142 +115,644 @@ def health_check():
         "status": "healthy",
         "models_loaded": True,
         "shap_available": SHAP_AVAILABLE,
-        "openai_enabled": USE_OPENAI
+        "model_backend": MODEL_BACKEND,
+        "explain_backend": EXPLAIN_BACKEND,
+        "suitability_mode": SUITABILITY_MODE if registry.current().suitability_grid is not None else 'model',
+        "suitability_grid": registry.current().suitability_grid.stats()
+                            if registry.current().suitability_grid is not None else None,
+        "explain_cache": get_engine().cache.stats(),
+        "weather": weather_service.stats() if weather_service is not None else None,
+        "suitability_map": suitability_map.stats() if suitability_map is not None else None,
+        "telemetry": telemetry.stats() if telemetry is not None else None,
+        "response_cache": response_cache.stats() if response_cache is not None else None,
+        "pending_explanations": pending_explanations.stats(),
+        "openai_enabled": USE_OPENAI,
+        "insights": insight_service.stats(),
+        "model_version": registry.version,
+        "model_memory": registry.memory_usage()
     })
 
+def check_admin_token():
+    """Return an error response unless the request carries ADMIN_TOKEN"""
+    if not ADMIN_TOKEN:
+        return jsonify({"error": "Admin endpoints disabled - set ADMIN_TOKEN to enable"}), 403
+    if request.headers.get('X-Admin-Token') != ADMIN_TOKEN:
+        return jsonify({"error": "Invalid admin token"}), 401
+    return None
+
+@app.route("/admin/reload", methods=["GET", "POST"])
+def reload_models():
+    """
+    Reload model artifacts in the background (POST) or report reload status (GET)
+
+    The other workers follow within MODEL_RELOAD_POLL seconds.
+    """
+    denied = check_admin_token()
+    if denied:
+        return denied
+    
+    if request.method == "POST":
+        force = request.args.get('force', 'false').lower() == 'true'
+        if request.args.get('wait', 'false').lower() == 'true':
+            try:
+                registry.reload(explainer=BUILD_EXPLAINER, force=force)
+            except Exception as e:
+                return jsonify({"error": "Reload failed", "message": str(e), "model_version": registry.version}), 500
+            registry.broadcast_reload(force)
+            return jsonify({"status": "reloaded", "model_version": registry.version, "generation": registry.generation})
+        started = registry.reload_async(explainer=BUILD_EXPLAINER, force=force)
+        if started:
+            registry.broadcast_reload(force)
+        return jsonify({"status": "started" if started else "already running", "model_version": registry.version,
+                        "generation": registry.generation}), 202
+    
+    return jsonify({"model_version": registry.version, "generation": registry.generation, **registry.reload_status})
+
+MAX_BATCH_SIZE = int(os.environ.get('MAX_BATCH_SIZE', 10000))
+
+# 'model' runs the suitability classifier, 'grid' uses the precomputed suitability_grid.npz
+# (and the classifier for inputs outside it)
+SUITABILITY_MODE = os.environ.get('SUITABILITY_MODE', 'model')
+
+# Response fields that can be skipped with ?fields= or ?explain=false
+OPTIONAL_STAGES = frozenset(['explanation', 'insights_and_suggestions', 'suitability'])
+
+# Encoded inputs of predictions returned without an explanation, for /explain/<prediction_id>.
+# Kept in shared memory so any worker can answer the poll
+PREDICTION_CACHE_TTL = float(os.environ.get('PREDICTION_CACHE_TTL', 300))  # Seconds
+PENDING_HEADER = struct.Struct('<16sd')  # Model version, predicted efficiency; the float32 row follows
+# Room for twice the current feature count, so retrained models with more features still fit
+pending_explanations = SharedStore(int(os.environ.get('PREDICTION_CACHE_SIZE', 100000)),
+                                   PENDING_HEADER.size + 8 * registry.current().encoder.n_features)
+
+def keep_for_explanation(prediction_id, bundle, row, efficiency):
+    """Store the encoded row of a prediction for /explain/<prediction_id>"""
+    value = PENDING_HEADER.pack(bundle.version.encode(), efficiency) + row.astype(np.float32).tobytes()
+    pending_explanations.set(prediction_id, value, px=int(PREDICTION_CACHE_TTL * 1000))
+
+def pending_explanation(prediction_id):
+    """(model version, encoded row, efficiency) kept for a prediction, or None"""
+    value = pending_explanations.get(prediction_id)
+    if value is None:
+        return None
+    version, efficiency = PENDING_HEADER.unpack_from(value)
+    row = np.frombuffer(value, dtype=np.float32, offset=PENDING_HEADER.size)
+    return version.rstrip(b'\0').decode(), row, efficiency
+
+# Per-stage latency for /metrics (created before the workers fork, see metrics.py)
+STAGES = ('validation', 'location', 'encoding', 'efficiency', 'explanation', 'insights', 'suitability', 'serialization')
+STAGE_SECONDS = Histogram('solarsense_stage_seconds', "Time spent in each stage of a request",
+                          {'endpoint': ('predict', 'predict_batch', 'explain_later'), 'stage': STAGES})
+STAGE_ERRORS = Counter('solarsense_stage_errors_total', "Stages that failed and were answered with a fallback",
+                       {'stage': STAGES})
+ROWS = Counter('solarsense_rows_total', "Readings received by the prediction endpoints",
+               {'endpoint': ('predict', 'predict_batch'), 'outcome': ('scored', 'cached', 'invalid')})
+
+def current_endpoint():
+    """Endpoint of the request being handled, None outside a request"""
+    return request.endpoint if has_request_context() else None
+
+def stage(name):
+    """Time a stage of the current request into solarsense_stage_seconds"""
+    return STAGE_SECONDS.time(endpoint=current_endpoint(), stage=name)
+
+def fill_weather(readings):
+    """
+    Looked-up weather for readings that send lat/lon
+
+    Returns:
+        (readings, sources) as from WeatherService.fill; unchanged readings
+        and no sources when weather lookup is disabled
+    """
+    if weather_service is None:
+        return readings, [None] * len(readings)
+    with stage('location'):
+        return weather_service.fill(readings)
+
+def get_recommended_action(risk_score):
+    """Map a risk score to the recommended maintenance action"""
+    if risk_score < 30:
+        return "Monitor closely - System performing well"
+    elif risk_score < 60:
+        return "Optimize - Consider maintenance and cleaning"
+    else:
+        return "Immediate action required - Failure risk detected!"
+
+def build_insights(explanation, efficiency):
+    """
+    Insight response fields for one prediction, never raising
+
+    Returns the rule-based (or cached LLM) text right away; when an LLM answer
+    is being generated, insights_token can be polled at /insights/<token>.
+    """
+    try:
+        insights = insight_service.submit(explanation, efficiency)
+    except Exception as e:
+        print(f"Insights generation error: {e}")
+        STAGE_ERRORS.inc(stage='insights')
+        return {"insights_and_suggestions": f"Efficiency: {efficiency:.1%}. System {'requires attention' if efficiency < 0.75 else 'operating normally'}."}
+    fields = {"insights_and_suggestions": insights["text"], "insights_source": insights["source"]}
+    if "token" in insights:
+        fields["insights_token"] = insights["token"]
+    return fields
+
+def run_predictions(batch, bundle, top_n=None, stages=OPTIONAL_STAGES):
+    """
+    Score a batch of encoded readings with one call per model
+
+    Makes one call each to the efficiency regressor, the SHAP explainer and
+    the suitability classifier for the whole batch. Stages that are not
+    requested are skipped; their inputs are kept for /explain/<prediction_id>.
+
+    Args:
+        batch: EncodedBatch from bundle.encoder.encode_batch
+        bundle: ModelBundle the batch was encoded with
+        top_n: Only return the N most important features in each explanation
+        stages: Optional response fields to compute (see OPTIONAL_STAGES)
+
+    Returns:
+        List of response dictionaries in the same order as batch.index
+    """
+    n = len(batch)
+    want_explanation = 'explanation' in stages or 'insights_and_suggestions' in stages
+
+    # Predict efficiency
+    with stage('efficiency'):
+        efficiencies = [max(0.0, min(1.0, float(e))) for e in bundle.model_eff.predict(batch.X)]  # Clamp between 0 and 1
+
+    # Get SHAP explanations
+    explanations = [None] * n
+    if want_explanation:
+        try:
+            with stage('explanation'):
+                # Insights look at the top 3 factors, so never trim below that here
+                explanations = explain_matrix(batch.X, bundle, top_n=max(top_n, 3) if top_n else None)
+        except Exception as e:
+            print(f"SHAP explanation error: {e}")
+            STAGE_ERRORS.inc(stage='explanation')
+            explanations = [{"error": "Explanation not available"} for _ in range(n)]
+
+    # Suitability prediction
+    suitability = [None] * n
+    if 'suitability' in stages:
+        try:
+            with stage('suitability'):
+                if SUITABILITY_MODE == 'grid' and bundle.suitability_grid is not None:
+                    # Rows outside the grid are scored with the model and counted
+                    predictions = bundle.suitability_grid.predict(batch.base, bundle.model_site, bundle.encoder)
+                else:
+                    predictions = bundle.model_site.predict(bundle.encoder.site_features(batch.base))
+                suitability = ['Yes' if pred == 1 else 'No' for pred in predictions]
+        except Exception as e:
+            print(f"Suitability prediction error: {e}")
+            traceback.print_exc()
+            STAGE_ERRORS.inc(stage='suitability')
+            suitability = ['Unknown'] * n
+
+    results = []
+    insights_seconds = 0.0
+    for row, efficiency, explanation, site in zip(batch.X, efficiencies, explanations, suitability):
+        risk_score = round((1 - efficiency) * 100, 2)
+        result = {
+            "prediction_id": uuid.uuid4().hex,
+            "predicted_efficiency": round(efficiency, 3),
+            "risk_score": risk_score,
+            "failure_flag": efficiency < 0.75,
+            "recommended_action": get_recommended_action(risk_score),
+            "model_version": bundle.version
+        }
+
+        # Get AI insights
+        if 'insights_and_suggestions' in stages:
+            start = time.perf_counter()
+            result.update(build_insights(explanation, efficiency))
+            insights_seconds += time.perf_counter() - start
+
+        if 'explanation' in stages:
+            if top_n and "error" not in explanation:
+                explanation = dict(get_top_features(explanation, top_n))
+            result["explanation"] = explanation
+        else:
+            # Keep the encoded inputs so the explanation can be computed later
+            keep_for_explanation(result["prediction_id"], bundle, row, efficiency)
+
+        if 'suitability' in stages:
+            result["suitability"] = site
+
+        results.append(result)
+
+    if 'insights_and_suggestions' in stages:
+        STAGE_SECONDS.observe(insights_seconds, endpoint=current_endpoint(), stage='insights')
+    return results
+
+def get_stages():
+    """
+    Read which optional stages to compute from the request
+
+    ?explain=false skips the explanation and insights; ?fields=a,b computes only
+    the listed optional fields. Without either, every stage runs.
+    """
+    stages = set(OPTIONAL_STAGES)
+    fields = request.args.get('fields')
+    if fields:
+        stages &= {field.strip() for field in fields.split(',')}
+    if request.args.get('explain', 'true').lower() in ('false', '0', 'no'):
+        stages -= {'explanation', 'insights_and_suggestions'}
+    return frozenset(stages)
+
+def get_top_n():
+    """Read the optional ?top_n= explanation size from the request"""
+    top_n = request.args.get('top_n', type=int)
+    return top_n if top_n and top_n > 0 else None
+
+def parse_batch_payload(req):
+    """
+    Read a batch of readings from a JSON array or an NDJSON body
+
+    Accepts a JSON array, an object with a "readings" array, or one JSON
+    object per line. NDJSON lines that fail to parse are returned as
+    ValueError entries so they can be reported per row.
+    """
+    body = req.get_data(as_text=True)
+    if not body.strip():
+        return []
+
+    if 'ndjson' not in (req.content_type or ''):
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            payload = None
+        if isinstance(payload, dict) and 'readings' in payload:
+            payload = payload['readings']
+        if isinstance(payload, list):
+            return payload
+        if payload is not None:
+            return [payload]
+
+    readings = []
+    for line_no, line in enumerate(body.splitlines(), 1):
+        if not line.strip():
+            continue
+        try:
+            readings.append(json.loads(line))
+        except ValueError as e:
+            readings.append(ValueError(f"Invalid JSON on line {line_no}: {e}"))
+    return readings
+
 @app.route("/predict", methods=["POST"])
 def predict():
     """Main prediction endpoint"""
     try:
-        data = request.json
+        with stage('validation'):
+            data = request.json
         
         if not data:
             return jsonify({"error": "No data provided"}), 400
         
-        # Validate required inputs
-        required = ['temperature', 'humidity', 'irradiance']
-        missing = [field for field in required if field not in data]
-        if missing:
-            return jsonify({"error": f"Missing required fields: {missing}"}), 400
-        
-        # Set defaults
-        if 'dust_index' not in data:
-            data['dust_index'] = 0.5
-        
-        # Calculate panel temperature
-        data['panel_temp'] = data['temperature'] + (data['irradiance'] / 800.0) * 20
+        # Readings with lat/lon may leave out the weather values
+        (data,), (weather_source,) = fill_weather([data])
         
-        # Add default features that might be in the model
-        data['cloudcover'] = data.get('cloudcover', 0)
-        data['precip'] = data.get('precip', 0)
-        data['wind_speed'] = data.get('wind_speed', 5)
-        data['voltage'] = data.get('voltage', 35)
-        data['current'] = data.get('current', 8)
+        bundle = registry.current()
+        top_n, stages = get_top_n(), get_stages()
+        cache_key = result = None
+        if response_cache is not None and isinstance(data, dict):
+            cache_key = response_cache.key(data, bundle, stages, top_n)
+            result = response_cache.get(cache_key)
         
-        # Prepare efficiency prediction
-        df = pd.DataFrame([data])
-        df = df.reindex(columns=feature_columns, fill_value=0)
-        
-        # Predict efficiency
-        efficiency = float(model_eff.predict(df)[0])
-        efficiency = max(0.0, min(1.0, efficiency))  # Clamp between 0 and 1
+        if result is not None:
+            result = {"prediction_id": uuid.uuid4().hex, **result, "cached": True}
+            if 'explanation' not in stages:
+                # Keep this reading's inputs so the new id can be explained later
+                try:
+                    with stage('encoding'):
+                        row, _ = bundle.encoder.encode(data)
+                except ValueError as e:
+                    ROWS.inc(endpoint='predict', outcome='invalid')
+                    return jsonify({"error": str(e)}), 400
+                keep_for_explanation(result["prediction_id"], bundle, row, result["predicted_efficiency"])
+            ROWS.inc(endpoint='predict', outcome='cached')
+        else:
+            with stage('encoding'):
+                batch = bundle.encoder.encode_batch([data])
+            if batch.errors:
+                ROWS.inc(endpoint='predict', outcome='invalid')
+                return jsonify({"error": batch.errors[0]}), 400
+            
+            result = run_predictions(batch, bundle, top_n=top_n, stages=stages)[0]
+            if cache_key is not None:
+                response_cache.set(cache_key, dict(result))
+                result["cached"] = False
+            ROWS.inc(endpoint='predict', outcome='scored')
+        if weather_source is not None:
+            result["weather_source"] = weather_source
         
-        risk_score = round((1 - efficiency) * 100, 2)
-        failure_flag = efficiency < 0.75
+        # Return results
+        with stage('serialization'):
+            return jsonify(result)
+    
+    except Exception as e:
+        # The traceback goes to the server log only
+        print(f"Prediction error: {e}")
+        traceback.print_exc()
+        return jsonify({
+            "error": "Prediction failed",
+            "message": str(e)
+        }), 500
+
+@app.route("/predict/batch", methods=["POST"])
+def predict_batch():
+    """Batch prediction endpoint (JSON array or NDJSON of readings)"""
+    try:
+        with stage('validation'):
+            readings = parse_batch_payload(request)
         
-        # Get SHAP explanation
-        try:
-            explanation = explain_prediction(data)
-        except Exception as e:
-            print(f"SHAP explanation error: {e}")
-            explanation = {"error": "Explanation not available"}
+        if not readings:
+            return jsonify({"error": "No data provided"}), 400
+        if len(readings) > MAX_BATCH_SIZE:
+            return jsonify({"error": f"Batch too large: {len(readings)} readings (max {MAX_BATCH_SIZE})"}), 413
         
-        # Get AI insights
-        try:
-            insights = get_genai_insights(explanation, efficiency)
-        except Exception as e:
-            print(f"Insights generation error: {e}")
-            insights = f"Efficiency: {efficiency:.1%}. System {'requires attention' if failure_flag else 'operating normally'}."
+        readings, weather_sources = fill_weather(readings)
         
-        # Suitability prediction
-        try:
-            site_data = {
-                'GHI (kWh/m²/day)': data['irradiance'] / 200,
-                'DNI (kWh/m²/day)': data['irradiance'] / 240,
-                'DHI (% of GHI)': 20,
-                'Snowfall (mm/year)': 0,
-                'Quarter1-Cloud cover': data['cloudcover'],
-                'Quarter1-Sunshine duration': 8,
-                'Quarter1-Ambient temperature': data['temperature'],
-                'Quarter1-Relative humidity': data['humidity'],
-                'Quarter1-Precipitation': data['precip'],
-                'Quarter2-Cloud cover': data['cloudcover'],
-                'Quarter2-Sunshine duration': 8,
-                'Quarter2-Ambient temperature': data['temperature'],
-                'Quarter2-Relative humidity': data['humidity'],
-                'Quarter2-Precipitation': data['precip'],
-                'Quarter3-Cloud cover': data['cloudcover'],
-                'Quarter3-Sunshine duration': 8,
-                'Quarter3-Ambient temperature': data['temperature'],
-                'Quarter3-Relative humidity': data['humidity'],
-                'Quarter3-Precipitation': data['precip'],
-                'Quarter4-Cloud cover': data['cloudcover'],
-                'Quarter4-Sunshine duration': 8,
-                'Quarter4-Ambient temperature': data['temperature'],
-                'Quarter4-Relative humidity': data['humidity'],
-                'Quarter4-Precipitation': data['precip'],
-                'YearlyCloud cover': data['cloudcover'],
-                'Sunshine duration': 8,
-                'Ambient temperature': data['temperature'],
-                'Relative humidity': data['humidity'],
-                'Precipitation': data['precip'] * 4
-            }
-            
-            df_site = pd.DataFrame([site_data])
-            df_site = df_site.reindex(columns=site_feature_columns, fill_value=0)
-            suitability_pred = model_site.predict(df_site)[0]
-            suitability = 'Yes' if suitability_pred == 1 else 'No'
-        except Exception as e:
-            print(f"Suitability prediction error: {e}")
-            traceback.print_exc()
-            suitability = 'Unknown'
+        # Encode every reading, keeping errors per row
+        bundle = registry.current()
+        with stage('encoding'):
+            batch = bundle.encoder.encode_batch(readings)
+        ROWS.inc(len(batch.errors), endpoint='predict_batch', outcome='invalid')
+        results = [None] * len(readings)
+        for i, message in batch.errors.items():
+            results[i] = {"index": i, "error": message}
         
-        # Determine recommended action
-        if risk_score < 30:
-            action = "Monitor closely - System performing well"
-        elif risk_score < 60:
-            action = "Optimize - Consider maintenance and cleaning"
-        else:
-            action = "Immediate action required - Failure risk detected!"
+        if len(batch):
+            try:
+                scored = run_predictions(batch, bundle, top_n=get_top_n(), stages=get_stages())
+            except Exception as e:
+                print(f"Batch prediction error: {e}")
+                traceback.print_exc()
+                scored = [{"error": "Prediction failed", "message": str(e)}] * len(batch)
+            for i, result in zip(batch.index, scored):
+                results[i] = {"index": i, **result}
+                if weather_sources[i] is not None:
+                    results[i]["weather_source"] = weather_sources[i]
+            ROWS.inc(len(batch), endpoint='predict_batch', outcome='scored')
         
-        # Return results
-        return jsonify({
-            "predicted_efficiency": round(efficiency, 3),
-            "risk_score": risk_score,
-            "failure_flag": failure_flag,
-            "explanation": explanation,
-            "insights_and_suggestions": insights,
-            "recommended_action": action,
-            "suitability": suitability
-        })
+        with stage('serialization'):
+            return jsonify({
+                "model_version": bundle.version,
+                "count": len(results),
+                "errors": sum(1 for r in results if 'error' in r),
+                "results": results
+            })
     
     except Exception as e:
-        print(f"Prediction error: {e}")
+        # The traceback goes to the server log only
+        print(f"Batch prediction error: {e}")
         traceback.print_exc()
         return jsonify({
-            "error": "Prediction failed",
-            "message": str(e),
-            "traceback": traceback.format_exc()
+            "error": "Batch prediction failed",
+            "message": str(e)
         }), 500
 
+def iter_ndjson(stream):
+    """Readings of an NDJSON stream as they arrive; bad lines become ValueError entries"""
+    for line_no, line in enumerate(iter(stream.readline, b''), 1):
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as e:
+            yield ValueError(f"Invalid JSON on line {line_no}: {e}")
+
+def panel_report(report):
+    """Telemetry report with the recommended action for its risk score"""
+    if report["risk_score"] is not None:
+        report["recommended_action"] = get_recommended_action(report["risk_score"])
+    return report
+
+@app.route("/telemetry", methods=["POST"])
+def ingest_telemetry():
+    """
+    Add panel readings (panel_id, timestamp, voltage, current, panel_temp,
+    dust_index, efficiency) to the rolling per-panel state
+
+    NDJSON bodies (Content-Type application/x-ndjson, may be chunked) are read
+    and applied TELEMETRY_CHUNK readings at a time as they stream in; JSON
+    arrays are applied whole.
+    """
+    if telemetry is None:
+        return jsonify({"error": "Telemetry ingest not available"}), 404
+    if 'ndjson' in (request.content_type or ''):
+        readings = iter_ndjson(request.stream)
+    else:
+        readings = parse_batch_payload(request)
+    accepted, errors, offset = 0, [], 0
+    chunk = []
+    for reading in itertools.chain(readings, [None]):
+        if reading is not None:
+            chunk.append(reading)
+        if len(chunk) >= TELEMETRY_CHUNK or (reading is None and chunk):
+            count, chunk_errors = telemetry.ingest(chunk)
+            accepted += count
+            errors.extend({"index": offset + i, "error": message} for i, message in chunk_errors)
+            offset += len(chunk)
+            chunk = []
+    if not offset:
+        return jsonify({"error": "No data provided"}), 400
+    return jsonify({
+        "accepted": accepted,
+        "rejected": len(errors),
+        "errors": errors[:100],
+        "panels": telemetry.n_panels
+    })
+
+@app.route("/telemetry", methods=["GET"])
+def telemetry_fleet():
+    """Panels with the highest risk score (?limit=, default 100)"""
+    if telemetry is None:
+        return jsonify({"error": "Telemetry ingest not available"}), 404
+    limit = min(max(request.args.get('limit', 100, type=int), 1), 10000)
+    return jsonify({"panels": telemetry.n_panels, "riskiest": [panel_report(r) for r in telemetry.riskiest(limit)]})
+
+@app.route("/telemetry/<panel_id>", methods=["GET"])
+def telemetry_panel(panel_id):
+    """Rolling statistics, trends and risk of one panel"""
+    if telemetry is None:
+        return jsonify({"error": "Telemetry ingest not available"}), 404
+    report = telemetry.panel(panel_id)
+    if report is None:
+        return jsonify({"error": f"No readings for panel {panel_id}"}), 404
+    return jsonify(panel_report(report))
+
+@app.route("/explain/<prediction_id>", methods=["GET"])
+def explain_later(prediction_id):
+    """Compute the explanation and insights for an earlier /predict?explain=false call"""
+    pending = pending_explanation(prediction_id)
+    if pending is None:
+        return jsonify({"error": "Unknown or expired prediction_id"}), 404
+    
+    version, row, efficiency = pending
+    bundle = registry.current()
+    if bundle.version != version:
+        # The inputs were encoded for the columns of the earlier model
+        return jsonify({"error": "Model changed since the prediction - predict again",
+                        "model_version": bundle.version}), 409
+    top_n = get_top_n()
+    try:
+        with stage('explanation'):
+            explanation = explain_matrix(row.reshape(1, -1), bundle, top_n=max(top_n, 3) if top_n else None)[0]
+    except Exception as e:
+        print(f"SHAP explanation error: {e}")
+        STAGE_ERRORS.inc(stage='explanation')
+        explanation = {"error": "Explanation not available"}
+    
+    with stage('insights'):
+        insights = build_insights(explanation, efficiency)
+    if top_n and "error" not in explanation:
+        explanation = dict(get_top_features(explanation, top_n))
+    
+    with stage('serialization'):
+        return jsonify({
+            "prediction_id": prediction_id,
+            "explanation": explanation,
+            **insights,
+            "model_version": bundle.version
+        })
+
+@app.route("/weather", methods=["GET"])
+def weather_lookup():
+    """Current weather at ?lat=&lon= through the configured provider (cached per grid cell)"""
+    if weather_service is None:
+        return jsonify({"error": "Weather lookup disabled - set WEATHER_PROVIDER"}), 404
+    lat, lon = request.args.get('lat'), request.args.get('lon')
+    if lat is None or lon is None:
+        return jsonify({"error": "lat and lon are required"}), 400
+    try:
+        weather, source = weather_service.lookup(lat, lon)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except WeatherUnavailable as e:
+        return jsonify({"error": "Weather lookup failed", "message": str(e)}), 502
+    return jsonify({"lat": float(lat), "lon": float(lon), "weather": weather, "source": source})
+
+def map_response(layer, render):
+    """Response for a SuitabilityMap render(bundle) call"""
+    if suitability_map is None:
+        return jsonify({"error": "Suitability maps not available - weather station table missing"}), 404
+    bundle = registry.current()
+    if layer == 'wind' and bundle.model_wind is None:
+        return jsonify({"error": WIND_MODEL_MISSING}), 404
+    try:
+        body, headers, cached = render(bundle)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return Response(body, headers={**headers, "X-Cache": "HIT" if cached else "MISS",
+                                   "X-Model-Version": bundle.version})
+
+@app.route("/suitability/tiles/<layer>/<int:z>/<int:x>/<int:y>.<fmt>", methods=["GET"])
+def suitability_tile(layer, z, x, y, fmt):
+    """Web Mercator suitability tile for a map tile layer (fmt 'png' or 'bin')"""
+    return map_response(layer, lambda bundle: suitability_map.tile(bundle, layer, z, x, y, fmt))
+
+@app.route("/suitability/map", methods=["GET"])
+def suitability_area():
+    """Suitability map of ?bbox=west,south,east,north at ?resolution= degrees (&layer=solar|wind, &format=png|bin)"""
+    try:
+        bbox = [float(v) for v in request.args.get('bbox', '').split(',')]
+        resolution = float(request.args.get('resolution', 0.1))
+    except ValueError:
+        return jsonify({"error": "bbox must be west,south,east,north and resolution a number of degrees"}), 400
+    if len(bbox) != 4:
+        return jsonify({"error": "bbox must be west,south,east,north"}), 400
+    layer, fmt = request.args.get('layer', 'solar'), request.args.get('format', 'png')
+    return map_response(layer, lambda bundle: suitability_map.area(bundle, layer, bbox, resolution, fmt))
+
+@app.route("/insights/<token>", methods=["GET"])
+def poll_insights(token):
+    """Poll the LLM insights for a token from /predict (?wait=seconds to long-poll)"""
+    wait = min(max(request.args.get('wait', 0, type=float), 0), 30)
+    result = insight_service.result(token, wait=wait)
+    if result is None:
+        return jsonify({"error": "Unknown or expired insights token"}), 404
+    return jsonify({"token": token, **result})
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Prometheus metrics: request and stage latencies, counts, errors and the serving models"""
+    bundle = registry.current()
+    model_info = render_gauge('solarsense_model_info', "Models this worker serves",
+                              [({"version": bundle.version, "backend": MODEL_BACKEND,
+                                 "explain_backend": EXPLAIN_BACKEND}, 1)])
+    loaded_at = render_gauge('solarsense_model_loaded_timestamp_seconds', "When the serving models were loaded",
+                             [({"version": bundle.version}, bundle.loaded_at)])
+    return Response(render(METRICS, model_info + loaded_at), content_type=CONTENT_TYPE)
+
+@app.route("/admin/profile", methods=["GET", "POST"])
+def profile_settings():
+    """Report (GET) or change (POST ?rate=0.01&profiler=pyinstrument) request profiling"""
+    denied = check_admin_token()
+    if denied:
+        return denied
+    
+    if request.method == "POST":
+        try:
+            profiler.configure(rate=request.args.get('rate', type=float), profiler=request.args.get('profiler'))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+    return jsonify(profiler.stats())
+
+# Request metrics, created once every route is registered
+ENDPOINTS = sorted(rule.endpoint for rule in app.url_map.iter_rules())
+REQUESTS = Counter('solarsense_requests_total', "HTTP requests by endpoint and status class",
+                   {'endpoint': ENDPOINTS, 'status': ('2xx', '3xx', '4xx', '5xx')})
+REQUEST_SECONDS = Histogram('solarsense_request_seconds', "Request handling time", {'endpoint': ENDPOINTS})
+METRICS = [REQUESTS, REQUEST_SECONDS, STAGE_SECONDS, STAGE_ERRORS, ROWS, WEATHER_LOOKUPS, WEATHER_UPSTREAM_SECONDS,
+           MAP_REQUESTS, MAP_RENDER_SECONDS, TELEMETRY_READINGS,
+           RESPONSE_CACHE_LOOKUPS, INSIGHT_LLM_CALLS]
+
+# Sampled profiling; the rate and profiler can be changed at runtime through /admin/profile
+PROFILE_RATE = float(os.environ.get('PROFILE_RATE', 0))  # Fraction of requests, 0 disables
+PROFILER = os.environ.get('PROFILER', 'cprofile')  # 'cprofile' or 'pyinstrument'
+profiler = SampledProfiler(output_dir=os.environ.get('PROFILE_DIR'), keep=int(os.environ.get('PROFILE_KEEP', 100)))
+try:
+    profiler.configure(rate=PROFILE_RATE, profiler=PROFILER)
+except ValueError as e:
+    print(f"Warning: {e} - request profiling disabled")
+if profiler.rate > 0:
+    print(f" Profiling {profiler.rate:.1%} of requests with {profiler.profiler} into {profiler.output_dir}")
+
+@app.before_request
+def start_request():
+    g.request_start = time.perf_counter()
+    # Admins can profile a single request with the X-Profile header
+    force = bool(ADMIN_TOKEN) and 'X-Profile' in request.headers and request.headers.get('X-Admin-Token') == ADMIN_TOKEN
+    g.profile = profiler.start(force=force)
+
+@app.after_request
+def record_request(response):
+    endpoint = request.endpoint or 'other'
+    REQUESTS.inc(endpoint=endpoint, status=f"{response.status_code // 100}xx")
+    if 'request_start' in g:
+        REQUEST_SECONDS.observe(time.perf_counter() - g.request_start, endpoint=endpoint)
+    return response
+
+@app.teardown_request
+def stop_profile(exc):
+    handle = g.pop('profile', None)
+    if handle is not None:
+        try:
+            print(f"Request profile written to {profiler.stop(handle, request.endpoint or 'other')}")
+        except Exception as e:
+            print(f"Profile error: {e}")
+
 if __name__ == "__main__":
     print("\n" + "="*80)
     print("SOLARSENSE AI - FLASK SERVER")
     print("="*80)
     print(f"Models loaded: ✓")
-    print(f"SHAP available: {'✓' if SHAP_AVAILABLE else '⚠ Using fallback'}")
+    print(f"Model backend: {MODEL_BACKEND}")
+    print(f"Explanation backend: {EXPLAIN_BACKEND}")
     print(f"OpenAI enabled: {'✓' if USE_OPENAI else '⚠ Using rule-based insights'}")
-    print(f"\nServer starting on http://localhost:5001")
+    print(f"\nServer starting on http://localhost:{os.environ.get('PORT', 10000)}")
+    print("Development server - in production run: gunicorn -c gunicorn.conf.py app:app")
     print("="*80 + "\n")
     
-app.run(debug=False, port=int(os.environ.get('PORT', 10000)), host='0.0.0.0')
+    app.run(debug=False, port=int(os.environ.get('PORT', 10000)), host='0.0.0.0')
@@ -0,0 +1,256 @@
+"""
+Dataset reading and writing for the ML pipeline
+
+The pipeline scripts (combined.py, f_e.py, train_ml.py) pass datasets around
+through these helpers. The format follows the file extension:
+
+    .csv                 text, kept for compatibility
+    .parquet             columnar, zstd-compressed, supports column projection
+    .feather / .arrow    Arrow IPC, zstd-compressed, fastest to load
+
+Parquet and Arrow files keep their column types, so they survive round trips
+without re-parsing text floats; write_table also applies SCHEMA_DTYPES.
+
+A directory is read as one dataset made of its files in name order (e.g. the
+part-NNNNN files written by f_e.py); files starting with '.' or '_' are skipped.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+FORMATS = {'csv': '.csv', 'parquet': '.parquet', 'feather': '.feather'}
+
+# Explicit column types; columns not listed keep the type pandas inferred.
+# Integer types only apply to integer columns whose values fit (panel ids may
+# be strings or exceed 32 bits, see apply_schema)
+SCHEMA_DTYPES = {
+    'panel_id': 'int64',
+    'weather_code': 'int32',
+    'city': 'category',
+    'wind_dir': 'category',
+    'Label (Yes/No)': 'category'
+}
+
+def file_format(path):
+    """'csv', 'parquet' or 'feather' from a file extension"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.parquet':
+        return 'parquet'
+    if ext in ('.feather', '.arrow'):
+        return 'feather'
+    return 'csv'
+
+def with_format(path, fmt):
+    """Same path with the extension for fmt ('csv', 'parquet' or 'feather')"""
+    return os.path.splitext(path)[0] + FORMATS[fmt]
+
+def find_dataset(path):
+    """
+    Prefer a columnar copy of a dataset if one exists next to it
+
+    Args:
+        path: Dataset path with any supported extension
+
+    Returns:
+        The .parquet or .feather sibling if it exists, otherwise path
+    """
+    for fmt in ('parquet', 'feather'):
+        candidate = with_format(path, fmt)
+        if os.path.exists(candidate):
+            return candidate
+    return path
+
+def dataset_files(path):
+    """Data files of a partitioned dataset directory, in name order"""
+    names = sorted(n for n in os.listdir(path)
+                   if not n.startswith(('.', '_')) and not n.endswith('.tmp')
+                   and os.path.isfile(os.path.join(path, n)))
+    return [os.path.join(path, n) for n in names]
+
+def _fits(series, dtype):
+    """Whether an integer cast keeps every value of a column"""
+    if dtype == 'category':
+        return True
+    if not pd.api.types.is_integer_dtype(series.dtype):
+        return False
+    limits = np.iinfo(dtype)
+    return series.empty or (limits.min <= series.min() and series.max() <= limits.max)
+
+def apply_schema(df, categories=True):
+    """
+    Cast known columns to their SCHEMA_DTYPES type
+
+    Columns with missing values are left alone, and so are columns an
+    integer type does not fit (text ids, values out of range).
+
+    Args:
+        categories: Also dictionary-encode the 'category' columns
+    """
+    casts = {col: dtype for col, dtype in SCHEMA_DTYPES.items()
+             if col in df.columns and not df[col].isnull().any()
+             and (categories or dtype != 'category') and _fits(df[col], dtype)}
+    return df.astype(casts) if casts else df
+
+def read_columns(path):
+    """Column names of a dataset without loading its rows"""
+    if os.path.isdir(path):
+        return read_columns(dataset_files(path)[0])
+    fmt = file_format(path)
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        return pq.read_schema(path).names
+    if fmt == 'feather':
+        import pyarrow.ipc as ipc
+        with ipc.open_file(path) as reader:
+            return reader.schema.names
+    return pd.read_csv(path, nrows=0).columns.tolist()
+
+def read_table(path, columns=None):
+    """
+    Load a dataset, optionally only some of its columns
+
+    Args:
+        path: .csv, .parquet, .feather or .arrow file, or a directory of them
+        columns: Column names to load (None loads everything)
+
+    Returns:
+        pandas DataFrame
+    """
+    if os.path.isdir(path):
+        return pd.concat([read_table(p, columns) for p in dataset_files(path)], ignore_index=True)
+    fmt = file_format(path)
+    if fmt == 'parquet':
+        return pd.read_parquet(path, columns=columns)
+    if fmt == 'feather':
+        return pd.read_feather(path, columns=columns)
+    return pd.read_csv(path, usecols=columns)
+
+def iter_table(path, chunksize=100_000, columns=None):
+    """
+    Yield a dataset as DataFrame chunks of at most chunksize rows
+
+    Args:
+        path: .csv, .parquet, .feather or .arrow file, or a directory of them
+        chunksize: Maximum rows per chunk
+        columns: Column names to load (None loads everything)
+    """
+    if os.path.isdir(path):
+        for file_path in dataset_files(path):
+            yield from iter_table(file_path, chunksize, columns)
+        return
+    fmt = file_format(path)
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize, columns=columns):
+            yield batch.to_pandas()
+    elif fmt == 'feather':
+        import pyarrow.ipc as ipc
+        with ipc.open_file(path) as reader:
+            for i in range(reader.num_record_batches):
+                batch = reader.get_batch(i)
+                if columns is not None:
+                    batch = batch.select(columns)
+                for offset in range(0, batch.num_rows, chunksize):
+                    yield batch.slice(offset, chunksize).to_pandas()
+    else:
+        yield from pd.read_csv(path, usecols=columns, chunksize=chunksize)
+
+def write_table(df, path, compression='zstd'):
+    """
+    Save a dataset in the format given by its extension
+
+    Writes to a temporary file first and renames it, so readers never see a
+    half-written dataset.
+
+    Args:
+        df: DataFrame to save
+        path: Output path; the extension selects the format
+        compression: Codec for Parquet/Arrow files
+    """
+    fmt = file_format(path)
+    tmp_path = f"{path}.tmp"
+    if fmt == 'parquet':
+        apply_schema(df).to_parquet(tmp_path, index=False, compression=compression)
+    elif fmt == 'feather':
+        apply_schema(df).reset_index(drop=True).to_feather(tmp_path, compression=compression)
+    else:
+        df.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+    return path
+
+class TableWriter:
+    """
+    Append DataFrame chunks to one dataset file
+
+    CSV chunks are appended as text; Parquet chunks become row groups and
+    Arrow chunks record batches, all cast to the schema of the first chunk
+    (the types pandas inferred, without the SCHEMA_DTYPES casts).
+    The file appears under its final name when the writer is closed.
+
+    Usage:
+        with TableWriter("out.parquet") as writer:
+            for chunk in chunks:
+                writer.write(chunk)
+    """
+
+    def __init__(self, path, compression='zstd'):
+        self.path = path
+        self.format = file_format(path)
+        self.compression = compression
+        self.rows = 0
+        self._tmp_path = f"{path}.tmp"
+        self._writer = None
+        self._schema = None
+        self._sink = None
+
+    def write(self, df):
+        if self.format == 'csv':
+            if self._sink is None:
+                self._sink = open(self._tmp_path, 'w', newline='')
+            df.to_csv(self._sink, index=False, header=(self.rows == 0))
+        else:
+            import pyarrow as pa
+            # No SCHEMA_DTYPES casts: each chunk would get its own category
+            # dictionary, and whether an integer type fits can differ between chunks
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if self._writer is None:
+                self._schema = table.schema
+                if self.format == 'parquet':
+                    import pyarrow.parquet as pq
+                    self._writer = pq.ParquetWriter(self._tmp_path, self._schema, compression=self.compression)
+                else:
+                    import pyarrow.ipc as ipc
+                    self._writer = ipc.new_file(self._tmp_path, self._schema,
+                                                options=ipc.IpcWriteOptions(compression=self.compression))
+            table = table.cast(self._schema)
+            if self.format == 'parquet':
+                self._writer.write_table(table)
+            else:
+                self._writer.write(table)
+        self.rows += len(df)
+
+    def close(self):
+        if self._sink is not None:
+            self._sink.close()
+        if self._writer is not None:
+            self._writer.close()
+        if os.path.exists(self._tmp_path):
+            os.replace(self._tmp_path, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            # Leave the previous dataset untouched on failure
+            if self._sink is not None:
+                self._sink.close()
+            if self._writer is not None:
+                self._writer.close()
+            if os.path.exists(self._tmp_path):
+                os.remove(self._tmp_path)
+        return False
@@ -1,74 +1,173 @@
 """
 SHAP-based explanation module for solar panel efficiency predictions
+
+Explanations come from XGBoost's native TreeSHAP (pred_contribs=True) by
+default, which gives the same values as shap.TreeExplainer without importing
+shap on the hot path. Set EXPLAIN_BACKEND=shap to use shap.TreeExplainer.
+Models served without xgboost (MODEL_BACKEND=compiled, onnx or treelite) have
+no booster; they compute the same TreeSHAP values in NumPy from the tree
+tables (TreeEnsemble.contributions).
+Results are cached per quantized feature vector, since telemetry from the
+same panel changes slowly.
 """
 
-import pandas as pd
+import importlib.util
+import os
+import weakref
 
-# Try to import required libraries
-try:
-    import shap
-    import joblib
-    SHAP_AVAILABLE = True
-except ImportError as e:
-    print(f"Warning: Could not import required libraries - {e}")
-    print("Run: pip install shap joblib")
-    SHAP_AVAILABLE = False
+import numpy as np
 
-if SHAP_AVAILABLE:
-    try:
-        # Load efficiency model & features
-        model = joblib.load("efficiency_model.pkl")
-        feature_columns = joblib.load("feature_columns.pkl")
-        
-        # Initialize SHAP explainer
-        explainer = shap.TreeExplainer(model)
-        print("✓ SHAP TreeExplainer initialized successfully")
-        
-    except FileNotFoundError as e:
-        print(f"Error: Model files not found - {e}")
-        print("Make sure you have run train_ml.py first")
-        SHAP_AVAILABLE = False
-    except Exception as e:
-        print(f"Error initializing SHAP: {e}")
-        SHAP_AVAILABLE = False
+from cache import LRUCache
+from model_registry import MODEL_BACKEND, registry
+
+# Configuration
+EXPLAIN_BACKEND = os.environ.get('EXPLAIN_BACKEND', 'native')  # 'native' or 'shap'
+EXPLAIN_CACHE_SIZE = int(os.environ.get('EXPLAIN_CACHE_SIZE', 10000))
+# Mantissa bits kept when quantizing cache keys (10 bits ~ 0.1% relative precision)
+EXPLAIN_CACHE_BITS = int(os.environ.get('EXPLAIN_CACHE_BITS', 10))
+
+SHAP_AVAILABLE = importlib.util.find_spec('shap') is not None
+if EXPLAIN_BACKEND == 'shap' and not SHAP_AVAILABLE:
+    print("Warning: shap is not installed - using XGBoost pred_contribs instead")
+    print("Run: pip install shap")
+    EXPLAIN_BACKEND = 'native'
+if EXPLAIN_BACKEND == 'shap' and MODEL_BACKEND != 'xgboost':
+    print("Warning: shap needs the XGBoost models - using the compiled trees' TreeSHAP values instead")
+    EXPLAIN_BACKEND = 'native'
 
-def explain_prediction(input_data: dict):
+class ExplanationEngine:
+    """
+    Compute and cache per-feature contributions for one model bundle
+
+    Args:
+        bundle: ModelBundle whose efficiency model is explained
+        backend: 'native' for XGBoost pred_contribs (or TreeEnsemble.contributions
+            without xgboost), 'shap' for shap.TreeExplainer
+        cache_size: Maximum number of cached explanations (0 disables caching)
+        cache_bits: Float32 mantissa bits kept in the cache key
+    """
+
+    def __init__(self, bundle, backend=EXPLAIN_BACKEND, cache_size=EXPLAIN_CACHE_SIZE,
+                 cache_bits=EXPLAIN_CACHE_BITS):
+        self.bundle = bundle
+        self.backend = backend
+        self.feature_columns = bundle.feature_columns
+        self.cache = LRUCache(cache_size)
+        self._key_mask = np.uint32((0xFFFFFFFF << (23 - min(max(cache_bits, 0), 23))) & 0xFFFFFFFF)
+        compiled = not hasattr(bundle.model_eff, 'get_booster')
+        self._booster = bundle.model_eff.get_booster() if backend == 'native' and not compiled else None
+
+    def _keys(self, X):
+        """Cache keys for each row: the float32 bits with low mantissa bits dropped"""
+        quantized = np.ascontiguousarray(X, dtype=np.float32).view(np.uint32) & self._key_mask
+        return [row.tobytes() for row in quantized]
+
+    def contributions(self, X):
+        """Raw contribution matrix (n_rows x n_features), without the bias term"""
+        if self.backend == 'native' and self._booster is None:
+            return self.bundle.model_eff.contributions(X)
+        if self.backend == 'native':
+            import xgboost as xgb
+            # Retrained boosters validate feature names; the legacy pickle has none
+            matrix = xgb.DMatrix(X, feature_names=self.feature_columns)
+            return self._booster.predict(matrix, pred_contribs=True)[:, :-1]
+        shap_values = self.bundle.explainer.shap_values(X)
+        if isinstance(shap_values, list):
+            # For some tree models, shap_values might be a list
+            shap_values = shap_values[0] if len(shap_values) > 0 else shap_values
+        return shap_values
+
+    def explain(self, X, top_n=None):
+        """
+        Explain every row of an encoded feature matrix
+
+        Args:
+            X: Float32 matrix in feature_columns order
+            top_n: Only return the N features with the largest absolute impact
+
+        Returns:
+            List of {feature: contribution} dictionaries, one per row
+        """
+        keys = self._keys(X)
+        values = [self.cache.get(key) for key in keys]
+        missing = [i for i, v in enumerate(values) if v is None]
+        if missing:
+            computed = self.contributions(X[missing])
+            for i, row_values in zip(missing, computed):
+                values[i] = np.asarray(row_values, dtype=np.float32)
+                self.cache.set(keys[i], values[i])
+        return [self._to_dict(row_values, top_n) for row_values in values]
+
+    def _to_dict(self, row_values, top_n=None):
+        if top_n is None or top_n >= len(row_values):
+            return {col: float(v) for col, v in zip(self.feature_columns, row_values)}
+        top = np.argsort(-np.abs(row_values), kind='stable')[:top_n]
+        return {self.feature_columns[i]: float(row_values[i]) for i in top}
+
+_engines = weakref.WeakKeyDictionary()
+
+def get_engine(bundle=None):
+    """ExplanationEngine for a bundle (the current one by default), built once"""
+    bundle = bundle or registry.current()
+    engine = _engines.get(bundle)
+    if engine is None:
+        engine = _engines.setdefault(bundle, ExplanationEngine(bundle))
+    return engine
+
+def explain_prediction(input_data: dict, top_n: int = None):
     """
     Generate SHAP-based explanation for a prediction
     
     Args:
         input_data: Dictionary with input features
+        top_n: Only return the N most important features
         
     Returns:
         Dictionary mapping feature names to their SHAP values
     """
-    if not SHAP_AVAILABLE:
-        # Fallback to simple rule-based explanation
-        return get_simple_explanation(input_data)
-    
     try:
-        # Prepare input dataframe
-        df = pd.DataFrame([input_data])
-        df = df.reindex(columns=feature_columns, fill_value=0)
-        
-        # Calculate SHAP values
-        shap_values = explainer.shap_values(df)
-        
-        # Convert to dictionary
-        if isinstance(shap_values, list):
-            # For some tree models, shap_values might be a list
-            shap_values = shap_values[0] if len(shap_values) > 0 else shap_values
+        row, _ = registry.current().encoder.encode(input_data)
+        return explain_matrix(row.reshape(1, -1), top_n=top_n)[0]
         
-        explanation = {
-            col: float(shap_values[0][i]) 
-            for i, col in enumerate(feature_columns)
-        }
+    except Exception as e:
+        print(f"SHAP calculation error: {e}")
+        return get_simple_explanation(input_data)
+
+def explain_batch(rows: list, top_n: int = None):
+    """
+    Generate SHAP-based explanations for several predictions at once
+    
+    Args:
+        rows: List of dictionaries with input features
+        top_n: Only return the N most important features per row
         
-        return explanation
+    Returns:
+        List of dictionaries mapping feature names to their SHAP values,
+        in the same order as the input
+    """
+    try:
+        batch = registry.current().encoder.encode_batch(rows)
+        if batch.errors:
+            raise ValueError(next(iter(batch.errors.values())))
+        return explain_matrix(batch.X, top_n=top_n)
         
     except Exception as e:
         print(f"SHAP calculation error: {e}")
-        return get_simple_explanation(input_data)
+        return [get_simple_explanation(row) for row in rows]
+
+def explain_matrix(X, bundle=None, top_n=None):
+    """
+    Generate SHAP-based explanations for an already encoded feature matrix
+    
+    Args:
+        X: Float32 matrix in feature_columns order (see features.FeatureEncoder)
+        bundle: ModelBundle X was encoded with (defaults to the current one)
+        top_n: Only return the N most important features per row
+        
+    Returns:
+        List of dictionaries mapping feature names to their SHAP values
+    """
+    return get_engine(bundle).explain(X, top_n=top_n)
 
 def get_simple_explanation(input_data: dict):
     """
@@ -163,7 +262,7 @@ if __name__ == "__main__":
     }
     
     print("Testing SHAP explanation module...")
-    print(f"SHAP available: {SHAP_AVAILABLE}")
+    print(f"Explanation backend: {EXPLAIN_BACKEND}")
     print("\nTest input:")
     for k, v in test_data.items():
         print(f"  {k}: {v}")
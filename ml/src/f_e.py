@@ -1,9 +1,235 @@
+"""
+Incremental feature engineering for the processed dataset
+
+Derived columns are declared in DERIVED_FEATURES (or added with
+register_feature) and written, together with the input columns, to a
+separate partitioned output directory:
+
+    data/processed/features/
+        part-00000.parquet
+        part-00001.parquet
+        _manifest.json
+
+The input is either a single file, split into fixed row ranges, or a
+directory whose files are the partitions (e.g. one file per day). The
+manifest records which partitions have been featurized, with which feature
+definitions, and a fingerprint of their input. A rerun only touches
+partitions whose input is new or changed, or that miss a feature added or
+redefined since; adding a feature backfills it from the existing output
+partitions, optionally a few partitions per run (--max-partitions).
+Outputs and the manifest are replaced atomically, so an interrupted run
+keeps every partition finished before it. Run from the repository root:
+
+    python ml/src/f_e.py
+    python ml/src/f_e.py data/processed/daily/ --output data/processed/features
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import time
+
 import pandas as pd
 
-df = pd.read_csv("data/processed/final_dataset.csv")
+from dataio import FORMATS, dataset_files, find_dataset, iter_table, read_table, write_table
+
+INPUT_PATH = "data/processed/final_dataset.csv"
+OUTPUT_DIR = "data/processed/features"
+MANIFEST_FILE = "_manifest.json"
+MANIFEST_VERSION = 1
+
+# name -> pandas expression (evaluated with DataFrame.eval) or function(df) -> Series.
+# Features are computed in this order, so later ones may use earlier ones.
+DERIVED_FEATURES = {
+    "power": "voltage * current",
+    "temp_stress": "panel_temp * temperature",
+    "weather_risk": "humidity * dust_index"
+}
+
+# Explicit versions for function features; expressions are versioned by their text
+FEATURE_VERSIONS = {}
+
+def register_feature(name, definition, version=None):
+    """
+    Declare a derived feature
+
+    Existing output partitions get the new column the next time the stage
+    runs. Redefining a feature (new expression or version) recomputes it.
+
+    Args:
+        name: Output column name
+        definition: Expression for DataFrame.eval, e.g. "voltage * current",
+            or a function taking a DataFrame and returning a Series
+        version: Required for functions; bump it when the function changes
+    """
+    if callable(definition) and version is None:
+        raise ValueError(f"Feature '{name}' is a function and needs an explicit version")
+    DERIVED_FEATURES[name] = definition
+    if version is not None:
+        FEATURE_VERSIONS[name] = str(version)
+    else:
+        FEATURE_VERSIONS.pop(name, None)
+
+def feature_signature(name):
+    """Identifies a feature's definition in the manifest"""
+    if name in FEATURE_VERSIONS:
+        return f"v{FEATURE_VERSIONS[name]}"
+    return hashlib.sha256(DERIVED_FEATURES[name].encode()).hexdigest()[:12]
+
+def compute_features(df, names):
+    """Add the named derived features to df (in DERIVED_FEATURES order)"""
+    for name in DERIVED_FEATURES:
+        if name in names:
+            definition = DERIVED_FEATURES[name]
+            df[name] = definition(df) if callable(definition) else df.eval(definition)
+    return df
+
+def content_hash(df):
+    """Fingerprint of a DataFrame's values"""
+    return str(int(pd.util.hash_pandas_object(df, index=False).sum()))
+
+def file_fingerprint(path):
+    """Cheap fingerprint of a partition file, without reading it"""
+    stat = os.stat(path)
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+def load_manifest(output_dir):
+    path = os.path.join(output_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def save_manifest(output_dir, manifest):
+    """Write the manifest atomically"""
+    path = os.path.join(output_dir, MANIFEST_FILE)
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(f"{path}.tmp", path)
+
+def rows_partitions(path, chunk_rows):
+    """
+    Row ranges of a single dataset file as (key, fingerprint, load) tuples
+
+    The fingerprint is a hash of the rows, so the file has to be read, but
+    unchanged ranges are neither recomputed nor rewritten.
+    """
+    buffer, start = [], 0
+    pending = 0
+    for chunk in iter_table(path, chunk_rows):
+        # Re-chunk to exact ranges: columnar readers may yield smaller batches
+        buffer.append(chunk)
+        pending += len(chunk)
+        while pending >= chunk_rows:
+            df = pd.concat(buffer, ignore_index=True) if len(buffer) > 1 else buffer[0].reset_index(drop=True)
+            part, rest = df.iloc[:chunk_rows], df.iloc[chunk_rows:]
+            yield f"rows-{start:012d}", content_hash(part), (lambda part=part: part.copy())
+            start += chunk_rows
+            buffer, pending = ([rest], len(rest)) if len(rest) else ([], 0)
+    if pending:
+        df = pd.concat(buffer, ignore_index=True) if len(buffer) > 1 else buffer[0].reset_index(drop=True)
+        yield f"rows-{start:012d}", content_hash(df), (lambda df=df: df)
+
+def directory_partitions(path):
+    """Files of a partitioned dataset directory as (key, fingerprint, load) tuples"""
+    for file_path in dataset_files(path):
+        yield os.path.basename(file_path), file_fingerprint(file_path), (lambda file_path=file_path: read_table(file_path))
+
+def run(input_path=INPUT_PATH, output_dir=OUTPUT_DIR, fmt='parquet', chunk_rows=100_000,
+        max_partitions=None, full=False):
+    """
+    Bring the feature output up to date with the input and DERIVED_FEATURES
+
+    Args:
+        input_path: Dataset file, or directory of partition files
+        output_dir: Directory for the featurized partitions and the manifest
+        fmt: Output format ('csv', 'parquet' or 'feather')
+        chunk_rows: Rows per partition when the input is a single file
+        max_partitions: Stop after updating this many partitions (None for all),
+            to spread a backfill over several runs
+        full: Ignore the manifest and recompute everything
+
+    Returns:
+        Dictionary of partition counts: computed, backfilled, unchanged, removed, deferred
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    source = {"path": os.path.abspath(input_path), "chunk_rows": None if os.path.isdir(input_path) else chunk_rows,
+              "format": fmt}
+    manifest = load_manifest(output_dir)
+    if full or manifest is None or manifest.get("version") != MANIFEST_VERSION or manifest.get("source") != source:
+        # Partitions of a previous layout would be picked up by directory readers
+        for entry in (manifest or {}).get("partitions", {}).values():
+            stale = os.path.join(output_dir, entry["file"])
+            if os.path.exists(stale):
+                os.remove(stale)
+        manifest = {"version": MANIFEST_VERSION, "source": source, "partitions": {}, "next_index": 0}
+    signatures = {name: feature_signature(name) for name in DERIVED_FEATURES}
+    manifest["features"] = signatures
+
+    if os.path.isdir(input_path):
+        partitions = directory_partitions(input_path)
+    else:
+        partitions = rows_partitions(input_path, chunk_rows)
+
+    counts = dict.fromkeys(("computed", "backfilled", "unchanged", "removed", "deferred"), 0)
+    seen = set()
+    for key, fingerprint, load in partitions:
+        seen.add(key)
+        entry = manifest["partitions"].get(key)
+        index = manifest["next_index"] if entry is None else entry["index"]
+        output_name = f"part-{index:05d}{FORMATS[fmt]}"
+        output_path = os.path.join(output_dir, output_name)
+
+        backfill = entry is not None and entry["fingerprint"] == fingerprint and os.path.exists(output_path)
+        if backfill and entry["features"] == signatures:
+            counts["unchanged"] += 1
+            continue
+        if max_partitions is not None and counts["computed"] + counts["backfilled"] >= max_partitions:
+            counts["deferred"] += 1
+            continue
+        missing = [n for n, sig in signatures.items() if not backfill or entry["features"].get(n) != sig]
+
+        if backfill:
+            # Only the new or redefined columns are computed; dropped features are removed
+            df = read_table(output_path)
+            df = df.drop(columns=[n for n in entry["features"] if n not in signatures and n in df.columns])
+        else:
+            df = load()
+        write_table(compute_features(df, missing), output_path)
+        manifest["next_index"] = max(manifest["next_index"], index + 1)
+        manifest["partitions"][key] = {"index": index, "file": output_name, "fingerprint": fingerprint,
+                                       "rows": len(df), "features": dict(signatures)}
+        # Saved after every partition so an interrupted run keeps its progress
+        save_manifest(output_dir, manifest)
+        counts["backfilled" if backfill else "computed"] += 1
+
+    for key in sorted(set(manifest["partitions"]) - seen):
+        entry = manifest["partitions"].pop(key)
+        stale = os.path.join(output_dir, entry["file"])
+        if os.path.exists(stale):
+            os.remove(stale)
+        counts["removed"] += 1
+    save_manifest(output_dir, manifest)
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description="Add derived features to the processed dataset incrementally")
+    parser.add_argument('input', nargs='?', default=INPUT_PATH, help="Dataset file or directory of partitions")
+    parser.add_argument('--output', default=OUTPUT_DIR, help="Output directory")
+    parser.add_argument('--format', choices=sorted(FORMATS), default='parquet', help="Output partition format")
+    parser.add_argument('--chunk-rows', type=int, default=100_000, help="Rows per partition for a single input file")
+    parser.add_argument('--max-partitions', type=int, help="Update at most this many partitions in this run")
+    parser.add_argument('--full', action='store_true', help="Recompute every partition")
+    args = parser.parse_args()
 
-df["power"] = df["voltage"] * df["current"]
-df["temp_stress"] = df["panel_temp"] * df["temperature"]
-df["weather_risk"] = df["humidity"] * df["dust_index"]
+    # Use a Parquet/Arrow copy of a single input file when there is one (see dataio.py)
+    input_path = args.input if os.path.isdir(args.input) else find_dataset(args.input)
+    start = time.perf_counter()
+    counts = run(input_path, args.output, args.format, args.chunk_rows, args.max_partitions, args.full)
+    print(f"Features {', '.join(DERIVED_FEATURES)} for {input_path} -> {args.output} "
+          f"in {time.perf_counter() - start:.2f}s")
+    print(", ".join(f"{kind}: {n}" for kind, n in counts.items()))
 
-df.to_csv("data/processed/final_dataset.csv", index=False)
+if __name__ == "__main__":
+    main()
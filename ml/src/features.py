@@ -0,0 +1,357 @@
+"""
+Feature encoding for solar panel efficiency and suitability predictions
+
+Maps request dictionaries straight into float32 NumPy rows laid out in the
+model's column order. Column positions, defaults and the synthesized site
+features are all precomputed once when the encoder is built.
+
+The column layout itself is a fitted artifact (TableEncoder, saved as
+feature_encoder.json next to the models): numeric columns plus one-hot
+columns for the categories of every text column. Training encodes datasets
+with it and serving encodes readings with the same tables.
+"""
+
+import json
+
+import numpy as np
+import pandas as pd
+
+REQUIRED_FIELDS = ['temperature', 'humidity', 'irradiance']
+
+# Defaults used when a reading does not provide the field
+INPUT_DEFAULTS = {
+    'dust_index': 0.5,
+    'cloudcover': 0,
+    'precip': 0,
+    'wind_speed': 5,
+    'voltage': 35,
+    'current': 8
+}
+
+# Weather inputs the site features are synthesized from
+BASE_FIELDS = ['temperature', 'humidity', 'irradiance', 'cloudcover', 'precip']
+
+# Site features as (base field, scale, constant): value = field * scale + constant
+SITE_FEATURE_SPEC = {
+    'GHI (kWh/m²/day)': ('irradiance', 1 / 200, 0),
+    'DNI (kWh/m²/day)': ('irradiance', 1 / 240, 0),
+    'DHI (% of GHI)': (None, 0, 20),
+    'Snowfall (mm/year)': (None, 0, 0),
+    'YearlyCloud cover': ('cloudcover', 1, 0),
+    'Sunshine duration': (None, 0, 8),
+    'Ambient temperature': ('temperature', 1, 0),
+    'Relative humidity': ('humidity', 1, 0),
+    'Precipitation': ('precip', 4, 0)
+}
+# The same quarterly values are repeated for every quarter of the year
+for _quarter in range(1, 5):
+    SITE_FEATURE_SPEC.update({
+        f'Quarter{_quarter}-Cloud cover': ('cloudcover', 1, 0),
+        f'Quarter{_quarter}-Sunshine duration': (None, 0, 8),
+        f'Quarter{_quarter}-Ambient temperature': ('temperature', 1, 0),
+        f'Quarter{_quarter}-Relative humidity': ('humidity', 1, 0),
+        f'Quarter{_quarter}-Precipitation': ('precip', 1, 0)
+    })
+
+ENCODER_FILE = "feature_encoder.json"
+ENCODER_VERSION = 1
+
+def is_missing(value):
+    """Whether a reading value is absent: None, or a number that is not finite"""
+    if value is None:
+        return True
+    try:
+        return not np.isfinite(float(value))
+    except (TypeError, ValueError, OverflowError):
+        return False  # Not a number; reported as an invalid value
+
+def panel_temperature(temperature, irradiance):
+    """Estimate panel temperature from ambient temperature and irradiance"""
+    return temperature + (irradiance / 800.0) * 20
+
+class EncodedBatch:
+    """
+    Result of encoding a list of readings
+
+    Attributes:
+        X: Efficiency feature matrix (n_valid x n_features, float32)
+        base: Weather inputs per valid row in BASE_FIELDS order (float64, so
+            derived features round the same way as the pandas path)
+        index: Positions of the valid rows in the original input
+        errors: Dictionary mapping input position to an error message
+    """
+
+    def __init__(self, X, base, index, errors):
+        self.X = X
+        self.base = base
+        self.index = index
+        self.errors = errors
+
+    def __len__(self):
+        return len(self.index)
+
+class FeatureEncoder:
+    """
+    Encode readings into model-ready float32 matrices
+
+    Args:
+        feature_columns: Column order of the efficiency model
+        site_feature_columns: Column order of the suitability model (optional)
+        categories: TableEncoder.category_index of the fitted encoder, so text
+            fields of a reading set their one-hot column (optional)
+    """
+
+    def __init__(self, feature_columns, site_feature_columns=None, categories=None):
+        self.feature_columns = list(feature_columns)
+        self.site_feature_columns = list(site_feature_columns or [])
+        self.n_features = len(self.feature_columns)
+        self._categories = categories or {}
+
+        self._index = {col: i for i, col in enumerate(self.feature_columns)}
+        self._base_index = {field: i for i, field in enumerate(BASE_FIELDS)}
+        self._panel_temp_index = self._index.get('panel_temp')
+
+        # Row template holding the defaults, copied for every reading
+        self._template = np.zeros(self.n_features, dtype=np.float32)
+        self._base_template = np.zeros(len(BASE_FIELDS))
+        for field, value in INPUT_DEFAULTS.items():
+            if field in self._index:
+                self._template[self._index[field]] = value
+            if field in self._base_index:
+                self._base_template[self._base_index[field]] = value
+
+        # Site columns as vectorized (target, source, scale, constant) arrays
+        site_index = {col: i for i, col in enumerate(self.site_feature_columns)}
+        spec = [(site_index[col],) + SITE_FEATURE_SPEC[col]
+                for col in SITE_FEATURE_SPEC if col in site_index]
+        self._site_target = np.array([s[0] for s in spec], dtype=np.intp)
+        self._site_source = np.array([self._base_index.get(s[1], 0) for s in spec], dtype=np.intp)
+        self._site_scale = np.array([s[2] for s in spec], dtype=np.float64)
+        self._site_constant = np.array([s[3] for s in spec], dtype=np.float64)
+
+    @property
+    def fields(self):
+        """Reading keys that change the encoding; all others are ignored"""
+        return frozenset(self._index) | frozenset(self._base_index) | frozenset(self._categories)
+
+    def _encode_into(self, data, row, base):
+        """Fill preallocated row and base vectors from one reading"""
+        if not isinstance(data, dict):
+            raise ValueError("Reading must be a JSON object")
+
+        # Validate required inputs; null, NaN and infinite count as missing
+        missing = [field for field in REQUIRED_FIELDS if is_missing(data.get(field))]
+        if missing:
+            raise ValueError(f"Missing required fields: {missing}")
+
+        row[:] = self._template
+        base[:] = self._base_template
+        for key, value in data.items():
+            if key in self._categories and value is not None:
+                if str(value) not in self._categories[key]:
+                    raise ValueError(f"Unknown value for '{key}': {value!r}")
+                position = self._categories[key][str(value)]
+                if position is not None:
+                    row[position] = 1
+                continue
+            i = self._index.get(key)
+            j = self._base_index.get(key)
+            if (i is None and j is None) or value is None:
+                continue
+            try:
+                value = float(value)
+            except (TypeError, ValueError):
+                raise ValueError(f"Invalid value for '{key}': {value!r}")
+            if i is not None:
+                row[i] = value
+            if j is not None:
+                base[j] = value
+
+        # Panel temperature is always derived from the weather inputs
+        if self._panel_temp_index is not None:
+            row[self._panel_temp_index] = panel_temperature(
+                base[self._base_index['temperature']], base[self._base_index['irradiance']])
+
+    def encode(self, data):
+        """
+        Encode a single reading
+
+        Args:
+            data: Dictionary with the request fields
+
+        Returns:
+            Tuple of (feature row, base weather vector)
+
+        Raises:
+            ValueError: If a required field is missing or a value is not numeric
+        """
+        row = np.empty(self.n_features, dtype=np.float32)
+        base = np.empty(len(BASE_FIELDS))
+        self._encode_into(data, row, base)
+        return row, base
+
+    def encode_batch(self, rows):
+        """
+        Encode a list of readings into one matrix, keeping per-row errors
+
+        Args:
+            rows: List of request dictionaries (exceptions are reported as errors)
+
+        Returns:
+            EncodedBatch with the valid rows packed at the top of the matrix
+        """
+        X = np.empty((len(rows), self.n_features), dtype=np.float32)
+        base = np.empty((len(rows), len(BASE_FIELDS)))
+        index, errors = [], {}
+        for i, data in enumerate(rows):
+            try:
+                if isinstance(data, Exception):
+                    raise data
+                self._encode_into(data, X[len(index)], base[len(index)])
+                index.append(i)
+            except ValueError as e:
+                errors[i] = str(e)
+        n = len(index)
+        return EncodedBatch(X[:n], base[:n], index, errors)
+
+    def site_features(self, base):
+        """
+        Build the suitability model matrix from base weather vectors
+
+        Args:
+            base: Array of shape (n, len(BASE_FIELDS)) from encode/encode_batch
+
+        Returns:
+            Float32 matrix in site_feature_columns order
+        """
+        base = np.atleast_2d(base)
+        X_site = np.zeros((len(base), len(self.site_feature_columns)), dtype=np.float32)
+        X_site[:, self._site_target] = base[:, self._site_source] * self._site_scale + self._site_constant
+        return X_site
+
+    def to_dict(self, row):
+        """Map an encoded row back to a {feature: value} dictionary"""
+        return {col: float(value) for col, value in zip(self.feature_columns, row)}
+
+class TableEncoder:
+    """
+    Fitted column layout shared by training and serving
+
+    Text columns are one-hot encoded like pd.get_dummies(drop_first=True):
+    one column per category except the first (alphabetically), and a row
+    whose category is missing gets zeros. Unlike get_dummies the categories
+    are fixed once fitted, so the same layout is produced for any data and
+    values never seen in training are rejected instead of silently adding
+    or dropping columns.
+
+    Args:
+        numeric: Numeric feature columns, in matrix order
+        categories: {text column: sorted list of categories}
+    """
+
+    def __init__(self, numeric, categories):
+        self.numeric = list(numeric)
+        self.categories = {col: list(cats) for col, cats in categories.items()}
+        self.feature_columns = self.numeric + [
+            f"{col}_{cat}" for col, cats in self.categories.items() for cat in cats[1:]
+        ]
+        # Matrix position of every category (None for the dropped first one)
+        self.category_index = {}
+        offset = len(self.numeric)
+        for col, cats in self.categories.items():
+            self.category_index[col] = {cat: (offset + i - 1 if i else None) for i, cat in enumerate(cats)}
+            offset += max(len(cats) - 1, 0)
+
+    @property
+    def input_columns(self):
+        """Dataset columns the encoder reads"""
+        return self.numeric + list(self.categories)
+
+    @classmethod
+    def fit(cls, frames, exclude=()):
+        """
+        Learn the layout from one or more DataFrames
+
+        Args:
+            frames: Iterable of DataFrames. The first one decides which
+                columns are numeric; later ones (e.g. further chunks of the
+                same file) only need the text columns.
+            exclude: Columns that are not features (targets, ids)
+        """
+        frames = iter(frames)
+        first = next(frames)
+        features = [c for c in first.columns if c not in exclude]
+        numeric = [c for c in features if pd.api.types.is_numeric_dtype(first[c])]
+        text = [c for c in features if c not in numeric]
+        categories = {col: set(first[col].dropna().astype(str).unique()) for col in text}
+        for frame in frames:
+            for col in text:
+                categories[col].update(frame[col].dropna().astype(str).unique())
+        return cls(numeric, {col: sorted(cats) for col, cats in categories.items()})
+
+    def check_columns(self, columns, exclude=()):
+        """
+        Raise ValueError unless columns (minus exclude) are exactly the input columns
+
+        Used before training with an existing encoder, so a changed dataset
+        schema fails instead of training a model with a different layout.
+        """
+        columns = [c for c in columns if c not in exclude]
+        missing = [c for c in self.input_columns if c not in columns]
+        unexpected = [c for c in columns if c not in self.input_columns]
+        if missing or unexpected:
+            raise ValueError(f"Dataset does not match {ENCODER_FILE}: "
+                             f"missing columns {missing}, unexpected columns {unexpected}")
+
+    def transform(self, df):
+        """
+        Encode a DataFrame into a float32 feature matrix
+
+        Missing numeric values become 0, like the fillna(0) of the training data.
+
+        Raises:
+            ValueError: If a column is missing or a text column holds a category
+                the encoder was not fitted with
+        """
+        missing = [c for c in self.input_columns if c not in df.columns]
+        if missing:
+            raise ValueError(f"Missing columns for {ENCODER_FILE}: {missing}")
+        X = np.zeros((len(df), len(self.feature_columns)), dtype=np.float32)
+        if self.numeric:
+            X[:, :len(self.numeric)] = df[self.numeric].to_numpy(dtype=np.float32, na_value=np.nan)
+            np.nan_to_num(X[:, :len(self.numeric)], copy=False, nan=0.0)
+        for col, cats in self.categories.items():
+            values = df[col].astype(object)
+            codes = pd.Categorical(values, categories=cats).codes
+            unknown = (codes < 0) & values.notna().to_numpy()
+            if unknown.any():
+                raise ValueError(f"Unknown categories for '{col}': {sorted(set(values[unknown].astype(str)))[:10]}")
+            rows = np.flatnonzero(codes > 0)
+            X[rows, self.category_index[col][cats[1]] + codes[rows] - 1] = 1
+        return X
+
+    def to_dict(self):
+        return {"version": ENCODER_VERSION, "numeric": self.numeric, "categories": self.categories,
+                "feature_columns": self.feature_columns}
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a saved encoder
+
+        Raises:
+            ValueError: If the file is from another encoder version or its
+                recorded column order does not match its tables
+        """
+        with open(path) as f:
+            data = json.load(f)
+        if data.get("version") != ENCODER_VERSION:
+            raise ValueError(f"{path}: unsupported encoder version {data.get('version')}")
+        encoder = cls(data["numeric"], data["categories"])
+        if encoder.feature_columns != data["feature_columns"]:
+            raise ValueError(f"{path}: feature_columns do not match the category tables")
+        return encoder
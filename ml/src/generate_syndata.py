@@ -1,22 +1,234 @@
-import pandas as pd
+"""
+Synthetic solar panel telemetry generator
+
+Simulates a fleet of panels reporting at a fixed interval over a time span,
+with optional degradation models:
+
+    dust      dust accumulates at a per-panel rate and is reset by periodic
+              cleaning; it lowers current and efficiency
+    thermal   efficiency and voltage derate with panel temperature above 25°C
+    drift     per-panel long-term efficiency loss (%/year)
+
+Rows are generated in vectorized blocks of whole timesteps and streamed to
+the output, so the dataset never has to fit in memory. Every block is seeded
+from (seed, block), so the output is identical for any number of workers.
+Run from the repository root:
+
+    python ml/src/generate_syndata.py --panels 19 --days 30 --interval 60   # data/synthetic/fleet.csv
+    python ml/src/generate_syndata.py --panels 10000 --days 365 --interval 5 \\
+        --output data/synthetic/fleet.parquet --workers 8
+    python ml/src/generate_syndata.py --legacy   # original 5,000 random rows, data/synthetic/sensor_data.csv
+"""
+
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
 import numpy as np
+import pandas as pd
+
+from dataio import FORMATS, TableWriter, with_format, write_table
+
+OUTPUT_PATH = "data/synthetic/fleet.csv"
+# The file combined.py and the committed data use; only --legacy writes it by default
+LEGACY_OUTPUT_PATH = "data/synthetic/sensor_data.csv"
+DEGRADATION_MODELS = ('dust', 'thermal', 'drift')
+COLUMNS = ['panel_id', 'timestamp', 'voltage', 'current', 'panel_temp', 'dust_index', 'efficiency']
+
+def legacy_dataset(rows=5000, seed=42):
+    """The original generator: independent random readings for 19 panels, no timestamps"""
+    np.random.seed(seed)
+    data = {
+        "panel_id": np.random.randint(1, 20, rows),
+        "voltage": np.random.normal(35, 3, rows),
+        "current": np.random.normal(8, 1, rows),
+        "panel_temp": np.random.normal(45, 5, rows),
+        "dust_index": np.random.uniform(0, 1, rows),
+        "efficiency": np.random.normal(0.9, 0.05, rows)
+    }
+
+    df = pd.DataFrame(data)
+
+    # Simulate degradation
+    df.loc[df["dust_index"] > 0.7, "efficiency"] -= 0.15
+    df.loc[df["panel_temp"] > 55, "efficiency"] -= 0.1
+    return df
+
+class FleetConfig:
+    """
+    Parameters of a simulated fleet
+
+    Args:
+        panels: Number of panels (ids 1..panels)
+        days: Time span in days
+        interval: Minutes between readings
+        start: First timestamp
+        degradation: Subset of DEGRADATION_MODELS to apply
+        seed: Base seed for the panel parameters and every block
+    """
+
+    def __init__(self, panels=19, days=30, interval=60, start="2025-01-01",
+                 degradation=DEGRADATION_MODELS, seed=42):
+        unknown = set(degradation) - set(DEGRADATION_MODELS)
+        if unknown:
+            raise ValueError(f"Unknown degradation models: {sorted(unknown)}")
+        self.panels = panels
+        self.interval = interval
+        self.steps = int(days * 24 * 60 // interval)
+        self.start = pd.Timestamp(start)
+        self.degradation = tuple(degradation)
+        self.seed = seed
+
+    @property
+    def rows(self):
+        return self.steps * self.panels
+
+    def panel_parameters(self):
+        """Per-panel constants, drawn once from the base seed"""
+        rng = np.random.default_rng([self.seed, 0])
+        n = self.panels
+        return {
+            "base_efficiency": rng.normal(0.9, 0.03, n),
+            "dust_rate": rng.uniform(0.01, 0.05, n),         # dust_index per day
+            "cleaning_days": rng.integers(7, 45, n),         # days between cleanings
+            "cleaning_phase": rng.uniform(0, 45, n),         # days since last cleaning at start
+            "drift_rate": rng.uniform(0.003, 0.012, n)       # efficiency loss per year
+        }
+
+def generate_block(config, step_start, step_stop, params=None):
+    """
+    Readings for all panels over timesteps [step_start, step_stop)
+
+    Rows are ordered by timestep, then panel id.
+
+    Returns:
+        DataFrame with COLUMNS
+    """
+    rng = np.random.default_rng([config.seed, 1, step_start])
+    params = params or config.panel_parameters()
+    shape = (step_stop - step_start, config.panels)
+    degradation = config.degradation
+
+    hours = np.arange(step_start, step_stop, dtype=np.float64)[:, None] * (config.interval / 60)
+    hour_of_day = (config.start.hour + config.start.minute / 60 + hours) % 24
+    days = hours / 24
+
+    # Daylight follows a half sine between 06:00 and 18:00; ambient peaks mid-afternoon
+    daylight = np.clip(np.sin(np.pi * (hour_of_day - 6) / 12), 0, None)
+    ambient = 28 + 7 * np.sin(2 * np.pi * (hour_of_day - 9) / 24) + rng.normal(0, 1.5, shape)
+    panel_temp = ambient + 25 * daylight + rng.normal(0, 2, shape)
+
+    if 'dust' in degradation:
+        since_cleaning = (days + params["cleaning_phase"]) % params["cleaning_days"]
+        dust_index = np.clip(since_cleaning * params["dust_rate"] + rng.normal(0, 0.02, shape), 0, 1)
+    else:
+        dust_index = rng.uniform(0, 1, shape)
+
+    efficiency = params["base_efficiency"] + rng.normal(0, 0.02, shape)
+    voltage = rng.normal(35, 3, shape)
+    current = 8 * daylight + rng.normal(0, 0.5, shape)
+    if 'dust' in degradation:
+        efficiency = efficiency - 0.2 * dust_index
+        current = current * (1 - 0.3 * dust_index)
+    if 'thermal' in degradation:
+        excess = np.clip(panel_temp - 25, 0, None)
+        efficiency = efficiency - 0.004 * excess
+        voltage = voltage * (1 - 0.003 * excess)
+    if 'drift' in degradation:
+        efficiency = efficiency * (1 - params["drift_rate"] * days / 365)
+
+    timestamps = config.start + pd.to_timedelta(hours[:, 0], unit='h')
+    return pd.DataFrame({
+        "panel_id": np.tile(np.arange(1, config.panels + 1, dtype=np.int32), shape[0]),
+        "timestamp": np.repeat(timestamps.values, config.panels),
+        "voltage": voltage.ravel(),
+        "current": np.clip(current, 0, None).ravel(),
+        "panel_temp": panel_temp.ravel(),
+        "dust_index": dust_index.ravel(),
+        "efficiency": np.clip(efficiency, 0, 1).ravel()
+    }, columns=COLUMNS)
+
+def block_ranges(config, chunk_rows):
+    """Timestep ranges of about chunk_rows rows each (at least one timestep)"""
+    steps_per_block = max(1, chunk_rows // config.panels)
+    return [(s, min(s + steps_per_block, config.steps)) for s in range(0, config.steps, steps_per_block)]
+
+def _generate_range(config, step_range):
+    """Process pool entry point"""
+    return generate_block(config, *step_range)
+
+def generate(config, output_path, chunk_rows=1_000_000, workers=1):
+    """
+    Stream the simulated fleet to output_path
+
+    Args:
+        config: FleetConfig
+        output_path: .csv, .parquet or .feather file
+        chunk_rows: Approximate rows per block
+        workers: Worker processes (1 generates in this process)
+
+    Returns:
+        Number of rows written
+    """
+    ranges = block_ranges(config, chunk_rows)
+    Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+    start = time.perf_counter()
+    with TableWriter(output_path) as sink:
+        for block in _iter_blocks(config, ranges, workers):
+            sink.write(block)
+            elapsed = time.perf_counter() - start
+            print(f"  {sink.rows:,}/{config.rows:,} rows ({sink.rows / elapsed:,.0f} rows/s)")
+    return sink.rows
 
-np.random.seed(42)
+def _iter_blocks(config, ranges, workers):
+    """Blocks in order; with workers > 1 at most 2 * workers blocks are in flight"""
+    if workers <= 1:
+        params = config.panel_parameters()
+        for step_range in ranges:
+            yield generate_block(config, *step_range, params=params)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = []
+        for step_range in ranges:
+            pending.append(pool.submit(_generate_range, config, step_range))
+            if len(pending) >= 2 * workers:
+                yield pending.pop(0).result()
+        for future in pending:
+            yield future.result()
 
-rows = 5000
-data = {
-    "panel_id": np.random.randint(1, 20, rows),
-    "voltage": np.random.normal(35, 3, rows),
-    "current": np.random.normal(8, 1, rows),
-    "panel_temp": np.random.normal(45, 5, rows),
-    "dust_index": np.random.uniform(0, 1, rows),
-    "efficiency": np.random.normal(0.9, 0.05, rows)
-}
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic solar panel telemetry")
+    parser.add_argument('--panels', type=int, default=19)
+    parser.add_argument('--days', type=float, default=30)
+    parser.add_argument('--interval', type=float, default=60, help="Minutes between readings")
+    parser.add_argument('--start', default="2025-01-01", help="First timestamp")
+    parser.add_argument('--degradation', nargs='*', default=list(DEGRADATION_MODELS),
+                        choices=DEGRADATION_MODELS, help="Degradation models to apply (none if empty)")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--chunk-rows', type=int, default=1_000_000, help="Approximate rows per block")
+    parser.add_argument('--workers', type=int, default=1, help=f"Worker processes (this machine has {os.cpu_count()})")
+    parser.add_argument('--output', help=f"Output file (.csv, .parquet or .feather; default {OUTPUT_PATH}, "
+                                         f"or {LEGACY_OUTPUT_PATH} with --legacy)")
+    parser.add_argument('--format', choices=sorted(FORMATS), help="Override the output format")
+    parser.add_argument('--legacy', action='store_true', help="Write the original 5,000 random rows instead")
+    args = parser.parse_args()
+    output_path = args.output or (LEGACY_OUTPUT_PATH if args.legacy else OUTPUT_PATH)
+    output_path = with_format(output_path, args.format) if args.format else output_path
 
-df = pd.DataFrame(data)
+    if args.legacy:
+        Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+        write_table(legacy_dataset(), output_path)
+        print(f"Wrote 5,000 legacy rows to {output_path}")
+        return
 
-# Simulate degradation
-df.loc[df["dust_index"] > 0.7, "efficiency"] -= 0.15
-df.loc[df["panel_temp"] > 55, "efficiency"] -= 0.1
+    config = FleetConfig(args.panels, args.days, args.interval, args.start, args.degradation, args.seed)
+    print(f"Generating {config.panels:,} panels x {config.steps:,} readings = {config.rows:,} rows "
+          f"(degradation: {', '.join(config.degradation) or 'none'}) -> {output_path}")
+    start = time.perf_counter()
+    rows = generate(config, output_path, args.chunk_rows, args.workers)
+    print(f"Done: {rows:,} rows in {time.perf_counter() - start:.1f}s")
 
-df.to_csv("data/synthetic/sensor_data.csv", index=False)
+if __name__ == "__main__":
+    main()
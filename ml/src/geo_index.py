@@ -0,0 +1,267 @@
+"""
+Nearest-location lookup by latitude and longitude
+
+GeoIndex buckets the map into a regular lat/lon grid (like geohash cells)
+and stores, for every cell, the few locations that can be among the k
+nearest of any point inside it: those whose distance to the cell centre is
+at most the centre's k-th nearest distance plus the cell diameter. A query
+finds the cell of every point with one division and only measures the
+distances to that cell's candidates, so matching is exact and runs at
+millions of points per second in NumPy. Points outside the grid are compared
+with every location.
+
+WeatherStations pairs an index with the weather table
+(data/raw/indian_weather_data.csv). combined.py uses it to join sensor
+readings to their nearest stations, and the 'stations' provider of
+weather.py to answer /weather and /predict lookups by lat/lon. With k > 1 the
+values of the k nearest stations are averaged with inverse distance weights.
+
+To check the index against a brute-force search and time it (from ml/src):
+
+    python geo_index.py --points 2000000 --k 3
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+WEATHER_STATIONS = os.environ.get('WEATHER_STATIONS', os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data', 'raw', 'indian_weather_data.csv'))
+# Weather columns a station provides for merged rows and /predict requests
+WEATHER_FIELDS = ['temperature', 'humidity', 'cloudcover', 'precip', 'wind_speed']
+
+# Points matched per step, so the (points x candidates x 3) gather stays small
+BLOCK_POINTS = 65536
+# Grid cells whose candidates are computed per step when building the index
+BLOCK_CELLS = 4096
+
+def unit_vectors(lat, lon):
+    """Points on the unit sphere, shape (n, 3)"""
+    lat, lon = np.radians(lat), np.radians(lon)
+    cos_lat = np.cos(lat)
+    return np.stack([cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)], axis=-1)
+
+def chord_to_km(chord):
+    """Great-circle distance for a straight-line distance between unit vectors"""
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.clip(chord / 2, 0, 1))
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance in km between points in degrees (broadcasts)"""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype=np.float64)) for v in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+def idw_weights(distances, power=2.0):
+    """Inverse distance weights per row, summing to 1; a point on a location gets all the weight"""
+    inverse = 1 / np.maximum(distances, 1e-9) ** power
+    return inverse / inverse.sum(axis=1, keepdims=True)
+
+class GeoIndex:
+    """
+    Exact k-nearest-neighbour search over fixed locations
+
+    Args:
+        lat, lon: Location coordinates in degrees
+        k: Largest k that query() will be asked for
+        cell_deg: Grid cell size in degrees
+        margin_deg: Grid extent beyond the outermost locations
+    """
+
+    def __init__(self, lat, lon, k=1, cell_deg=0.25, margin_deg=2.0):
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        if not len(self.lat) or not (np.isfinite(self.lat).all() and np.isfinite(self.lon).all()):
+            raise ValueError("GeoIndex needs at least one location and finite coordinates")
+        self.k = min(k, len(self.lat))
+        self.cell_deg = cell_deg
+        self._xyz = unit_vectors(self.lat, self.lon)
+
+        self.lat0 = max(np.floor(self.lat.min() - margin_deg), -90.0)
+        self.lon0 = np.floor(self.lon.min() - margin_deg)
+        self.rows = int(np.ceil((min(self.lat.max() + margin_deg, 90.0) - self.lat0) / cell_deg))
+        self.cols = int(np.ceil((self.lon.max() + margin_deg - self.lon0) / cell_deg))
+        self.candidates = self._build_candidates()
+        self._counts = (self.candidates >= 0).sum(axis=1)
+
+    def __len__(self):
+        return len(self.lat)
+
+    def _build_candidates(self):
+        """(cells, width) candidate location indexes per cell, nearest first, padded with -1"""
+        row, col = np.divmod(np.arange(self.rows * self.cols), self.cols)
+        south = self.lat0 + row * self.cell_deg
+        west = self.lon0 + col * self.cell_deg
+        center_lat, center_lon = south + self.cell_deg / 2, west + self.cell_deg / 2
+        # Distance from the centre to the farthest corner; the corners nearer the pole are closer
+        radius = haversine_km(center_lat, center_lon, south, west)
+        blocks, width = [], 1
+        for start in range(0, len(row), BLOCK_CELLS):
+            cells = slice(start, start + BLOCK_CELLS)
+            d = haversine_km(center_lat[cells, None], center_lon[cells, None], self.lat, self.lon)
+            kth = np.partition(d, self.k - 1, axis=1)[:, self.k - 1]
+            d[d > (kth + 2 * radius[cells])[:, None]] = np.inf
+            order = np.argsort(d, axis=1, kind='stable')
+            count = np.isfinite(d).sum(axis=1)
+            width = max(width, int(count.max()))
+            blocks.append((order, count))
+        candidates = np.full((len(row), width), -1, dtype=np.int32)
+        for start, (order, count) in zip(range(0, len(row), BLOCK_CELLS), blocks):
+            block = order[:, :width]
+            candidates[start:start + len(block)] = np.where(np.arange(width) < count[:, None], block, -1)
+        return candidates
+
+    def _nearest(self, lat, lon, candidates, k):
+        """k nearest of each point's candidates as (indexes, chord lengths), nearest first"""
+        points = unit_vectors(lat, lon)
+        # Squared chord between unit vectors: 2 - 2 cos(angle), monotonic in the great-circle distance
+        d = 2 - 2 * np.einsum('ijk,ik->ij', self._xyz[candidates], points)
+        d[candidates < 0] = np.inf
+        if k == 1:
+            nearest = np.argmin(d, axis=1)[:, None]
+        else:
+            nearest = np.argpartition(d, k - 1, axis=1)[:, :k] if k < d.shape[1] else np.argsort(d, axis=1)
+            nearest = np.take_along_axis(nearest, np.argsort(np.take_along_axis(d, nearest, 1), axis=1), 1)
+        return np.take_along_axis(candidates, nearest, 1), np.sqrt(np.maximum(np.take_along_axis(d, nearest, 1), 0))
+
+    def query(self, lat, lon, k=None):
+        """
+        k nearest locations of every point
+
+        Args:
+            lat, lon: Point coordinates in degrees (finite)
+            k: Neighbours per point, at most the index's k
+
+        Returns:
+            (indexes, distances in km), both shape (n, k), nearest first
+
+        Raises:
+            ValueError: If k exceeds the index's k or a coordinate is not finite
+        """
+        k = self.k if k is None else k
+        if not 1 <= k <= self.k:
+            raise ValueError(f"k must be between 1 and {self.k} for this index, got {k}")
+        lat = np.atleast_1d(np.asarray(lat, dtype=np.float64))
+        lon = np.atleast_1d(np.asarray(lon, dtype=np.float64))
+        if not (np.isfinite(lat).all() and np.isfinite(lon).all()):
+            raise ValueError("lat/lon must be finite numbers")
+
+        row = np.floor((lat - self.lat0) / self.cell_deg).astype(np.intp)
+        col = np.floor((lon - self.lon0) / self.cell_deg).astype(np.intp)
+        inside_grid = (row >= 0) & (row < self.rows) & (col >= 0) & (col < self.cols)
+        cell = np.where(inside_grid, row * self.cols + col, 0)
+        inside = inside_grid.copy()  # Inside points still to be matched
+
+        indexes = np.empty((len(lat), k), dtype=np.intp)
+        chords = np.empty((len(lat), k))
+        if k == 1:
+            # Most cells have a single candidate, which is the answer without comparing distances
+            settled = np.flatnonzero(inside & (self._counts[cell] == 1))
+            indexes[settled, 0] = self.candidates[cell[settled], 0]
+            for start in range(0, len(settled), BLOCK_POINTS):
+                block = settled[start:start + BLOCK_POINTS]
+                cosine = np.einsum('ij,ij->i', self._xyz[indexes[block, 0]], unit_vectors(lat[block], lon[block]))
+                chords[block, 0] = np.sqrt(np.maximum(2 - 2 * cosine, 0))
+            inside[settled] = False
+        inside_rows = np.flatnonzero(inside)
+        for start in range(0, len(inside_rows), BLOCK_POINTS):
+            block = inside_rows[start:start + BLOCK_POINTS]
+            indexes[block], chords[block] = self._nearest(lat[block], lon[block], self.candidates[cell[block]], k)
+        # Few points fall outside the grid; they are compared with every location
+        outside_rows = np.flatnonzero(~inside_grid)
+        everything = np.arange(len(self), dtype=np.int32)
+        for start in range(0, len(outside_rows), BLOCK_POINTS):
+            block = outside_rows[start:start + BLOCK_POINTS]
+            candidates = np.broadcast_to(everything, (len(block), len(self)))
+            indexes[block], chords[block] = self._nearest(lat[block], lon[block], candidates, k)
+        return indexes, chord_to_km(chords)
+
+    def interpolate(self, lat, lon, values, k=None, power=2.0):
+        """
+        Values at every point from its k nearest locations
+
+        Args:
+            values: (locations,) or (locations, columns) array
+            k: Neighbours per point (1 copies the nearest location's values)
+            power: Inverse distance weighting exponent
+
+        Returns:
+            (interpolated values, nearest location index, distance to it in km)
+        """
+        values = np.asarray(values, dtype=np.float64)
+        indexes, distances = self.query(lat, lon, k)
+        if indexes.shape[1] == 1:
+            return values[indexes[:, 0]], indexes[:, 0], distances[:, 0]
+        weights = idw_weights(distances, power)
+        weights = weights.reshape(weights.shape + (1,) * (values.ndim - 1))
+        return (values[indexes] * weights).sum(axis=1), indexes[:, 0], distances[:, 0]
+
+class WeatherStations:
+    """
+    Weather table with a GeoIndex over its stations
+
+    Args:
+        table: DataFrame with lat, lon and the weather columns
+        fields: Weather columns to look up (those missing from the table are skipped)
+        k: Stations averaged per point
+        power: Inverse distance weighting exponent
+    """
+
+    def __init__(self, table, fields=WEATHER_FIELDS, k=1, power=2.0):
+        self.fields = [field for field in fields if field in table.columns]
+        self.names = table['city'].astype(str).to_numpy() if 'city' in table.columns else np.arange(len(table)).astype(str)
+        self.values = table[self.fields].to_numpy(dtype=np.float64)
+        self.k = k
+        self.power = power
+        self.index = GeoIndex(table['lat'], table['lon'], k=k)
+
+    @classmethod
+    def load(cls, path=WEATHER_STATIONS, **kwargs):
+        import pandas as pd
+
+        return cls(pd.read_csv(path), **kwargs)
+
+    def lookup(self, lat, lon):
+        """(weather values (n, fields), nearest station index, distance in km) for every point"""
+        return self.index.interpolate(lat, lon, self.values, self.k, self.power)
+
+def main():
+    parser = argparse.ArgumentParser(description="Check GeoIndex against brute force and time it")
+    parser.add_argument('--stations', default=WEATHER_STATIONS, help="CSV with lat/lon columns")
+    parser.add_argument('--points', type=int, default=1_000_000, help="Random points to match")
+    parser.add_argument('--k', type=int, default=1)
+    args = parser.parse_args()
+
+    import pandas as pd
+
+    table = pd.read_csv(args.stations)
+    start = time.perf_counter()
+    index = GeoIndex(table['lat'], table['lon'], k=args.k)
+    print(f"{len(index)} locations, {index.rows}x{index.cols} cells, up to {index.candidates.shape[1]} "
+          f"candidates per cell, built in {time.perf_counter() - start:.2f}s")
+
+    rng = np.random.default_rng(42)
+    # Points spread over the locations' bounding box, 1% of them beyond the grid
+    lat = rng.uniform(index.lat.min(), index.lat.max(), args.points)
+    lon = rng.uniform(index.lon.min(), index.lon.max(), args.points)
+    far = rng.random(args.points) < 0.01
+    lat[far] = np.clip(lat[far] + rng.choice([-10, 10], far.sum()), -90, 90)
+    start = time.perf_counter()
+    indexes, distances = index.query(lat, lon)
+    seconds = time.perf_counter() - start
+    print(f"{args.points:,} points (k={args.k}) in {seconds:.2f}s: {args.points / seconds:,.0f} points/s")
+
+    sample = rng.choice(args.points, min(args.points, 20000), replace=False)
+    brute = haversine_km(lat[sample, None], lon[sample, None], index.lat, index.lon)
+    expected = np.sort(brute, axis=1)[:, :args.k]
+    diff = np.abs(distances[sample] - expected).max()
+    print(f"Max distance difference against brute force on {len(sample):,} points: {diff:.2e} km")
+    if diff > 1e-6:
+        print("Check FAILED")
+        raise SystemExit(1)
+    print("Check passed")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""
+Gunicorn settings for serving app.py in production (the procfile uses them)
+
+    gunicorn -c gunicorn.conf.py app:app
+
+app.py loads the models when it is imported. With preload_app the master
+imports it once and then forks the workers, so they share the model memory
+(see ModelRegistry.preload) instead of loading a copy each. Workers are
+threaded (gthread), which also keeps idle HTTP connections open between
+requests. Settings come from the environment:
+
+    PORT                    Listen port (default 10000)
+    WEB_CONCURRENCY         Worker processes (default: one per CPU)
+    GUNICORN_THREADS        Threads per worker (default 4)
+    GUNICORN_TIMEOUT        Seconds a worker may stop responding before it is replaced (default 30).
+                            Threaded workers keep responding while a request runs; request
+                            time is bounded in the app (MAX_BATCH_SIZE, LLM_TIMEOUT)
+    GUNICORN_KEEPALIVE      Seconds an idle keep-alive connection stays open (default 5)
+    GUNICORN_MAX_REQUESTS   Restart a worker after this many requests, 0 to never (default 0)
+    GUNICORN_ACCESS_LOG     Access log file, "-" for stdout (default: off)
+
+State that has to be seen by every worker (metrics, telemetry, prediction
+ids for /explain/<prediction_id>, tokens for /insights/<token>) is allocated
+in shared memory before the fork, and POST /admin/reload is broadcast to all
+workers, so requests need no sticky routing.
+"""
+
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 10000)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+preload_app = True
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = timeout
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 0))
+max_requests_jitter = max_requests // 10
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG')
+
+# Parallelism comes from the workers: one native thread per prediction call
+# avoids every worker's XGBoost/OpenMP pool competing for all cores. Set
+# before preload_app imports the app, so the models pick it up.
+os.environ.setdefault('OMP_NUM_THREADS', '1')
@@ -0,0 +1,249 @@
+"""
+Insight generation for solar panel efficiency predictions
+
+Rule-based insights are returned immediately. When USE_OPENAI is enabled the
+LLM text is generated on a background worker pool: the caller gets a token to
+poll /insights/<token> with, identical requests share one LLM call through a
+cache keyed on the bucketed efficiency and top SHAP factors, and a limiter
+caps how many LLM calls can be queued at once. Token results are kept in a
+SharedStore allocated before the workers fork, so any worker can answer a poll.
+
+The LLM is reached through its OpenAI-compatible HTTP API, so OPENAI_BASE_URL
+can point at a local stub server (see stub_llm_server.py).
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import LRUCache
+from metrics import Counter
+from shared_store import SharedStore
+
+# Configuration
+USE_OPENAI = os.environ.get('USE_OPENAI', 'false').lower() == 'true'  # Set to true if you have an OpenAI API key
+OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY', 'api')
+OPENAI_BASE_URL = os.environ.get('OPENAI_BASE_URL', 'https://api.openai.com/v1')
+OPENAI_MODEL = os.environ.get('OPENAI_MODEL', 'gpt-4')
+LLM_TIMEOUT = float(os.environ.get('LLM_TIMEOUT', 30))  # Seconds per LLM call
+INSIGHT_WORKERS = int(os.environ.get('INSIGHT_WORKERS', 4))  # Concurrent LLM calls
+INSIGHT_MAX_PENDING = int(os.environ.get('INSIGHT_MAX_PENDING', 64))  # Queued + running LLM calls
+INSIGHT_CACHE_SIZE = int(os.environ.get('INSIGHT_CACHE_SIZE', 5000))
+INSIGHT_CACHE_TTL = float(os.environ.get('INSIGHT_CACHE_TTL', 3600))  # Seconds
+INSIGHT_TOKEN_TTL = float(os.environ.get('INSIGHT_TOKEN_TTL', 600))  # Seconds a token can be polled
+INSIGHT_TOKEN_BYTES = int(os.environ.get('INSIGHT_TOKEN_BYTES', 4096))  # Largest stored token result (JSON)
+INSIGHT_POLL_INTERVAL = 0.05  # Seconds between checks while waiting for a token result
+EFFICIENCY_BUCKET = 0.05  # Efficiencies within the same 5% share cached insights
+
+logger = logging.getLogger(__name__)
+
+# Created before the workers fork (see metrics.py)
+INSIGHT_LLM_CALLS = Counter('solarsense_insight_llm_calls_total', "LLM insight calls by outcome",
+                            {'outcome': ('ok', 'error')})
+
+def get_fallback_insights(shap_explanation, efficiency):
+    """Rule-based insights when OpenAI is not available"""
+    insights = []
+
+    # Analyze efficiency level
+    if efficiency > 0.85:
+        insights.append("✓ Excellent performance - System is operating at peak efficiency.")
+    elif efficiency > 0.75:
+        insights.append("⚠ Good performance with room for optimization.")
+    else:
+        insights.append("⚠ Low efficiency detected - Immediate attention required.")
+
+    # Analyze top factors
+    top_factors = sorted(shap_explanation.items(), key=lambda x: abs(x[1]), reverse=True)[:3]
+
+    for feature, impact in top_factors:
+        if 'temperature' in feature.lower() and impact < -0.03:
+            insights.append("🌡️ High temperature is reducing efficiency. Consider cooling systems or shade structures.")
+        elif 'irradiance' in feature.lower() and impact > 0.05:
+            insights.append("☀️ Good solar irradiance levels. Maintain panel cleanliness to maximize capture.")
+        elif 'dust' in feature.lower() and impact < -0.03:
+            insights.append("🧹 Dust accumulation detected. Schedule cleaning to restore 5-10% efficiency.")
+        elif 'humidity' in feature.lower() and impact < -0.02:
+            insights.append("💧 High humidity affecting performance. Monitor for condensation issues.")
+
+    # Add recommendations
+    if efficiency < 0.80:
+        insights.append("📊 Recommendation: Conduct full system diagnostic and performance audit.")
+    else:
+        insights.append("🔄 Recommendation: Continue regular maintenance schedule for optimal performance.")
+
+    return "\n".join(insights)
+
+def insight_cache_key(shap_explanation, efficiency):
+    """Cache key: efficiency bucket plus the top 3 factors and their direction"""
+    top_factors = sorted(shap_explanation.items(), key=lambda x: abs(x[1]), reverse=True)[:3]
+    bucket = round(round(efficiency / EFFICIENCY_BUCKET) * EFFICIENCY_BUCKET, 2)
+    return (bucket,) + tuple((feature, impact >= 0) for feature, impact in top_factors)
+
+class ChatCompletionsClient:
+    """
+    Minimal client for an OpenAI-compatible /chat/completions endpoint
+
+    Args:
+        base_url: API root, e.g. https://api.openai.com/v1 or a local stub
+        api_key: Bearer token sent with every request
+        model: Model name passed through to the API
+        timeout: Seconds to wait for a response
+    """
+
+    def __init__(self, base_url=OPENAI_BASE_URL, api_key=OPENAI_API_KEY, model=OPENAI_MODEL, timeout=LLM_TIMEOUT):
+        self.url = base_url.rstrip('/') + '/chat/completions'
+        self.api_key = api_key
+        self.model = model
+        self.timeout = timeout
+
+    def complete(self, prompt, max_tokens=250, temperature=0.7):
+        """Return the text of the first choice for a single user prompt"""
+        body = json.dumps({
+            "model": self.model,
+            "messages": [{"role": "user", "content": prompt}],
+            "max_tokens": max_tokens,
+            "temperature": temperature
+        }).encode()
+        req = urllib.request.Request(self.url, data=body, headers={
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.api_key}"
+        })
+        with urllib.request.urlopen(req, timeout=self.timeout) as response:
+            payload = json.load(response)
+        return payload["choices"][0]["message"]["content"].strip()
+
+class InsightService:
+    """
+    Asynchronous, cached and rate-limited LLM insight generation
+
+    Args:
+        client: Object with complete(prompt) -> str, or None for rule-based only
+        workers: Maximum concurrent LLM calls
+        max_pending: Maximum queued plus running LLM calls; beyond that
+            requests only get the rule-based text
+        cache_size: Number of cached LLM answers
+        cache_ttl: Seconds a cached LLM answer stays valid
+        token_ttl: Seconds a token can be polled after it was issued
+        token_bytes: Largest token result, as JSON, the shared store holds
+    """
+
+    def __init__(self, client=None, workers=INSIGHT_WORKERS, max_pending=INSIGHT_MAX_PENDING,
+                 cache_size=INSIGHT_CACHE_SIZE, cache_ttl=INSIGHT_CACHE_TTL, token_ttl=INSIGHT_TOKEN_TTL,
+                 token_bytes=INSIGHT_TOKEN_BYTES):
+        self.client = client
+        self.cache = LRUCache(cache_size, ttl=cache_ttl)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="insights") if client else None
+        self._pending = threading.BoundedSemaphore(max_pending)
+        self._tokens = SharedStore(max(cache_size, max_pending) * 4, token_bytes)
+        self.token_ttl = token_ttl
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self.llm_calls = 0
+        self.llm_errors = 0
+        self.throttled = 0
+        self.llm_seconds = 0.0
+
+    @property
+    def enabled(self):
+        return self.client is not None
+
+    def submit(self, shap_explanation, efficiency):
+        """
+        Insights for one prediction, without waiting for the LLM
+
+        Returns:
+            Dictionary with "text" (cached LLM text or the rule-based text),
+            "source" ("llm" or "rules") and, while an LLM answer is being
+            generated, a "token" to poll with result()
+        """
+        fallback = get_fallback_insights(shap_explanation, efficiency)
+        if not self.enabled or "error" in shap_explanation:
+            return {"text": fallback, "source": "rules"}
+
+        key = insight_cache_key(shap_explanation, efficiency)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return {"text": cached, "source": "llm"}
+
+        with self._lock:
+            token = self._in_flight.get(key)
+            if token is None:
+                if not self._pending.acquire(blocking=False):
+                    self.throttled += 1
+                    return {"text": fallback, "source": "rules"}
+                token = uuid.uuid4().hex
+                self._in_flight[key] = token
+                self._store(token, {"status": "pending"})
+                self._executor.submit(self._generate, key, token, shap_explanation, efficiency, fallback)
+        return {"text": fallback, "source": "rules", "token": token}
+
+    def _store(self, token, result, fallback=None):
+        """Save a token result where every worker can poll it, or the fallback text if it is too large"""
+        if not self._tokens.set(token, json.dumps(result), px=int(self.token_ttl * 1000)):
+            logger.warning("Insight result for token %s exceeds INSIGHT_TOKEN_BYTES", token)
+            self._tokens.set(token, json.dumps({"status": "failed", "text": fallback, "source": "rules",
+                                                "error": "LLM answer too large"}), px=int(self.token_ttl * 1000))
+
+    def _generate(self, key, token, shap_explanation, efficiency, fallback):
+        """Worker: call the LLM, cache the answer, fall back on errors"""
+        start = time.perf_counter()
+        try:
+            prompt = f"Based on SHAP values {shap_explanation} for solar panel efficiency of {efficiency:.2%}. Provide 3 concise insights and actionable suggestions to improve or maintain efficiency."
+            text = self.client.complete(prompt)
+            self.cache.set(key, text)
+            INSIGHT_LLM_CALLS.inc(outcome='ok')
+            self._store(token, {"status": "ready", "text": text, "source": "llm"}, fallback)
+        except Exception as e:
+            logger.warning("LLM insight request failed: %s", e)
+            INSIGHT_LLM_CALLS.inc(outcome='error')
+            self.llm_errors += 1
+            self._store(token, {"status": "failed", "text": fallback, "source": "rules", "error": str(e)})
+        finally:
+            self.llm_calls += 1
+            self.llm_seconds += time.perf_counter() - start
+            with self._lock:
+                self._in_flight.pop(key, None)
+            self._pending.release()
+
+    def result(self, token, wait=0):
+        """
+        Poll the LLM answer for a token
+
+        Args:
+            token: Token returned by submit()
+            wait: Seconds to block for the answer before reporting "pending"
+
+        Returns:
+            Dictionary with "status" (pending, ready or failed) and "text",
+            or None if the token is unknown or expired
+        """
+        deadline = time.monotonic() + wait
+        while True:
+            value = self._tokens.get(token)
+            if value is None:
+                return None
+            result = json.loads(value)
+            if result["status"] != "pending" or time.monotonic() >= deadline:
+                return result
+            time.sleep(min(INSIGHT_POLL_INTERVAL, max(deadline - time.monotonic(), 0)))
+
+    def stats(self):
+        """Counters for /health"""
+        return {
+            "enabled": self.enabled,
+            "llm_calls": self.llm_calls,
+            "llm_errors": self.llm_errors,
+            "llm_seconds": round(self.llm_seconds, 3),
+            "throttled": self.throttled,
+            "in_flight": len(self._in_flight),
+            "cache": self.cache.stats(),
+            "tokens": self._tokens.stats()
+        }
+
+insight_service = InsightService(ChatCompletionsClient() if USE_OPENAI else None)
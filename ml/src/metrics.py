@@ -0,0 +1,297 @@
+"""
+Request metrics in the Prometheus text format and a sampled request profiler
+
+Counters and histograms keep their numbers in anonymous shared memory.
+app.py creates them when it is imported, so with preload_app
+(gunicorn.conf.py) they are allocated in the master before the workers fork,
+and every worker adds to the same numbers: /metrics reports the whole server
+whichever worker answers the scrape. This is why label values are declared
+up front; a value that was not declared is counted as "other". Started
+without preloading, every worker counts on its own.
+
+The profiler settings are shared the same way, so switching it on through
+one worker switches it on for all of them.
+"""
+
+import bisect
+import cProfile
+import importlib.util
+import itertools
+import mmap
+import multiprocessing
+import os
+import random
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+# Latency buckets in seconds, 100 us to 10 s
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+PROFILERS = ('cprofile', 'pyinstrument')
+PROFILE_SUFFIX = {'cprofile': '.prof', 'pyinstrument': '.html'}
+PYINSTRUMENT_AVAILABLE = importlib.util.find_spec('pyinstrument') is not None
+
+def shared_array(shape, dtype=np.float64):
+    """Zeroed array in memory that processes forked later share"""
+    dtype = np.dtype(dtype)
+    size = int(np.prod(shape))
+    buffer = mmap.mmap(-1, max(size, 1) * dtype.itemsize)  # MAP_SHARED | MAP_ANONYMOUS
+    return np.frombuffer(buffer, dtype=dtype, count=size).reshape(shape)
+
+def format_labels(labels):
+    """Prometheus label set, e.g. {stage="encoding"}"""
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+def format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+class Metric:
+    """
+    Metric with one row of shared values per label combination
+
+    Args:
+        name: Metric name
+        help: Description for the # HELP line
+        labels: {label name: allowed values}
+        width: Values per label combination
+    """
+    kind = None
+
+    def __init__(self, name, help, labels=None, width=1):
+        self.name = name
+        self.help = help
+        self.labels = {label: tuple(str(v) for v in values) + (() if 'other' in values else ('other',))
+                       for label, values in (labels or {}).items()}
+        self._positions = [{value: i for i, value in enumerate(values)} for values in self.labels.values()]
+        self._combinations = list(itertools.product(*self.labels.values()))
+        self._values = shared_array((len(self._combinations), width))
+        self._lock = multiprocessing.Lock()
+
+    def _slot(self, labels):
+        slot = 0
+        for label, positions in zip(self.labels, self._positions):
+            slot = slot * len(positions) + positions.get(str(labels.get(label)), positions['other'])
+        return slot
+
+    def samples(self):
+        """(labels, values) for every label combination with a non-zero value"""
+        with self._lock:
+            values = self._values.copy()
+        for combination, row in zip(self._combinations, values):
+            if row.any():
+                yield dict(zip(self.labels, combination)), row
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for labels, row in self.samples():
+            lines.extend(self._lines(labels, row))
+        return lines
+
+    def _lines(self, labels, row):
+        raise NotImplementedError
+
+class Counter(Metric):
+    """Monotonic counter; name it with a _total suffix"""
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        slot = self._slot(labels)
+        with self._lock:
+            self._values[slot, 0] += amount
+
+    def _lines(self, labels, row):
+        return [f"{self.name}{format_labels(labels)} {format_value(row[0])}"]
+
+class Histogram(Metric):
+    """
+    Distribution of observed values in cumulative buckets
+
+    Args:
+        buckets: Increasing upper bounds; +Inf is added
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=None, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        # Per bucket counts (the last one is +Inf), then the sum
+        super().__init__(name, help, labels, width=len(self.buckets) + 2)
+
+    def observe(self, value, **labels):
+        slot = self._slot(labels)
+        bucket = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._values[slot, bucket] += 1
+            self._values[slot, -1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the seconds spent in the with block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _lines(self, labels, row):
+        counts = np.cumsum(row[:-1])
+        lines = [f"{self.name}_bucket{format_labels({**labels, 'le': bound})} {format_value(count)}"
+                 for bound, count in zip(self.buckets + ('+Inf',), counts)]
+        lines.append(f"{self.name}_sum{format_labels(labels)} {format_value(row[-1])}")
+        lines.append(f"{self.name}_count{format_labels(labels)} {format_value(counts[-1])}")
+        return lines
+
+def render_gauge(name, help, samples):
+    """Lines of a gauge computed at scrape time from (labels, value) pairs"""
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} gauge"]
+    lines.extend(f"{name}{format_labels(labels)} {format_value(value)}" for labels, value in samples)
+    return lines
+
+def render(metrics, extra=()):
+    """Prometheus exposition text of metrics plus already rendered extra lines"""
+    lines = [line for metric in metrics for line in metric.render()]
+    lines.extend(extra)
+    return '\n'.join(lines) + '\n'
+
+class SampledProfiler:
+    """
+    Profile a random fraction of requests with cProfile or pyinstrument
+
+    Every sampled request is written to output_dir as a .prof file (cProfile,
+    open with snakeviz or pstats) or an .html page (pyinstrument). One request
+    is profiled at a time per process; samples that come up while another
+    request is being profiled are skipped.
+
+    Args:
+        rate: Fraction of requests to profile, 0 disables sampling
+        profiler: 'cprofile' or 'pyinstrument'
+        output_dir: Directory for the profiles
+        keep: Number of profile files kept, older ones are deleted
+    """
+
+    def __init__(self, rate=0.0, profiler='cprofile', output_dir=None, keep=100):
+        self.output_dir = output_dir or os.path.join(tempfile.gettempdir(), 'solarsense_profiles')
+        self.keep = keep
+        self._settings = shared_array((2,))  # rate, index into PROFILERS
+        self._busy = threading.Lock()
+        self.configure(rate, profiler)
+
+    @property
+    def rate(self):
+        return float(self._settings[0])
+
+    @property
+    def profiler(self):
+        return PROFILERS[int(self._settings[1])]
+
+    def configure(self, rate=None, profiler=None):
+        """
+        Change the sampling rate and/or profiler, in every worker
+
+        Raises:
+            ValueError: If rate is outside [0, 1] or the profiler is unknown or not installed
+        """
+        if rate is not None and not 0 <= rate <= 1:
+            raise ValueError(f"Profile rate must be between 0 and 1, got {rate}")
+        if profiler is not None:
+            if profiler not in PROFILERS:
+                raise ValueError(f"Unknown profiler '{profiler}' (use {' or '.join(PROFILERS)})")
+            if profiler == 'pyinstrument' and not PYINSTRUMENT_AVAILABLE:
+                raise ValueError("pyinstrument is not installed - run: pip install pyinstrument")
+            self._settings[1] = PROFILERS.index(profiler)
+        if rate is not None:
+            self._settings[0] = rate
+
+    def start(self, force=False):
+        """
+        Start profiling the current request if it is sampled
+
+        Args:
+            force: Profile regardless of the rate
+
+        Returns:
+            Handle for stop(), or None if the request is not profiled
+        """
+        if not force and (self.rate <= 0 or random.random() >= self.rate):
+            return None
+        if not self._busy.acquire(blocking=False):
+            return None
+        try:
+            profiler = self.profiler
+            if profiler == 'pyinstrument':
+                import pyinstrument
+                profile = pyinstrument.Profiler(async_mode='disabled')
+                profile.start()
+            else:
+                profile = cProfile.Profile()
+                profile.enable()
+        except Exception:
+            self._busy.release()
+            raise
+        return profiler, profile, time.perf_counter()
+
+    def stop(self, handle, name):
+        """
+        Stop a profile started by start() and write it out
+
+        Args:
+            handle: Return value of start()
+            name: Request name for the file name, e.g. the endpoint
+
+        Returns:
+            Path of the written profile
+        """
+        profiler, profile, start = handle
+        try:
+            if profiler == 'pyinstrument':
+                profile.stop()
+            else:
+                profile.disable()
+            milliseconds = (time.perf_counter() - start) * 1000
+            os.makedirs(self.output_dir, exist_ok=True)
+            path = os.path.join(self.output_dir, f"{time.strftime('%Y%m%d-%H%M%S')}_{os.getpid()}_"
+                                                 f"{name}_{milliseconds:.0f}ms{PROFILE_SUFFIX[profiler]}")
+            if profiler == 'pyinstrument':
+                with open(path, 'w') as f:
+                    f.write(profile.output_html())
+            else:
+                profile.dump_stats(path)
+        finally:
+            self._busy.release()
+        self._prune()
+        return path
+
+    def files(self):
+        """Profile files in output_dir, newest first"""
+        try:
+            names = [n for n in os.listdir(self.output_dir) if n.endswith(tuple(PROFILE_SUFFIX.values()))]
+        except FileNotFoundError:
+            return []
+        paths = [os.path.join(self.output_dir, n) for n in names]
+        return sorted(paths, key=lambda p: os.path.getmtime(p) if os.path.exists(p) else 0, reverse=True)
+
+    def _prune(self):
+        for path in self.files()[self.keep:]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        """Settings and recent profiles for the admin endpoint"""
+        return {
+            "rate": self.rate,
+            "profiler": self.profiler,
+            "pyinstrument_available": PYINSTRUMENT_AVAILABLE,
+            "output_dir": self.output_dir,
+            "recent": [os.path.basename(p) for p in self.files()[:10]]
+        }
@@ -0,0 +1,489 @@
+"""
+Model registry for the efficiency and suitability models
+
+Loads every model artifact once per process and hands out the boosters,
+feature column lists, feature encoder and a lazily built SHAP explainer.
+Load the registry before the server forks its workers (gunicorn --preload)
+so the read-only model memory stays shared between them.
+
+With MODEL_BACKEND=compiled the models are the NumPy tree tables exported by
+tree_engine.py (efficiency_model.npz, suitability_model.npz), so serving
+needs neither xgboost nor the pickled wrappers. MODEL_BACKEND=onnx and
+MODEL_BACKEND=treelite run the exports of runtimes.py instead.
+
+New models written by train_ml.py can be swapped in without a restart:
+reload() loads and warms a fresh bundle next to the serving one and only then
+replaces it, so in-flight requests finish on the bundle they started with.
+Every worker process holds its own bundle, so a reload requested from one
+of them is broadcast through a generation counter in shared memory that
+the others follow (broadcast_reload / follow).
+"""
+
+import gc
+import hashlib
+import importlib.util
+import multiprocessing
+import os
+import threading
+import time
+
+import numpy as np
+
+from features import ENCODER_FILE, FeatureEncoder, TableEncoder
+from suitability_grid import GRID_FILE, SuitabilityGrid, model_digest
+from runtimes import RUNTIME_PACKAGES, load_runtime_model
+from metrics import shared_array
+from tree_engine import MODEL_NAMES, TreeEnsemble, tables_path
+
+MODEL_DIR = os.environ.get('MODEL_DIR', os.path.dirname(os.path.abspath(__file__)))
+MODEL_BACKENDS = ('xgboost', 'compiled', 'onnx', 'treelite')
+MODEL_BACKEND = os.environ.get('MODEL_BACKEND', 'xgboost')
+
+if MODEL_BACKEND not in MODEL_BACKENDS:
+    print(f"Warning: unknown MODEL_BACKEND '{MODEL_BACKEND}' - using xgboost")
+    MODEL_BACKEND = 'xgboost'
+if MODEL_BACKEND in RUNTIME_PACKAGES and importlib.util.find_spec(RUNTIME_PACKAGES[MODEL_BACKEND]) is None:
+    print(f"Warning: {RUNTIME_PACKAGES[MODEL_BACKEND]} is not installed - using xgboost")
+    print(f"Run: pip install {RUNTIME_PACKAGES[MODEL_BACKEND]}")
+    MODEL_BACKEND = 'xgboost'
+if MODEL_BACKEND == 'xgboost' and importlib.util.find_spec('xgboost') is None:
+    if all(os.path.exists(tables_path(MODEL_DIR, name)) for name in MODEL_NAMES):
+        print("Warning: xgboost is not installed - serving the compiled tree tables")
+        MODEL_BACKEND = 'compiled'
+
+MODEL_ARTIFACTS = [
+    "efficiency_model.pkl", "efficiency_model.ubj", "efficiency_model.npz",
+    "efficiency_model.onnx", "efficiency_model.so",
+    "suitability_model.pkl", "suitability_model.ubj", "suitability_model.npz",
+    "suitability_model.onnx", "suitability_model.so",
+    "feature_columns.pkl", "site_feature_columns.pkl",
+    ENCODER_FILE, "suitability_grid.npz",
+    "wind_suitability_model.pkl", "wind_suitability_model.ubj", "wind_suitability_model.npz"
+]
+
+# Reading used to warm a freshly loaded bundle before it serves traffic
+WARMUP_READING = {'temperature': 25, 'humidity': 50, 'irradiance': 800}
+
+def process_rss_bytes():
+    """Resident set size of the current process in bytes (0 if unknown)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+        # Peak RSS is the best approximation available without /proc
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    except (ImportError, OSError):
+        return 0
+
+def artifact_paths(model_dir):
+    """Existing model artifact files in model_dir"""
+    paths = [os.path.join(model_dir, name) for name in MODEL_ARTIFACTS]
+    return [path for path in paths if os.path.exists(path)]
+
+def artifact_version(model_dir):
+    """Short content hash identifying the set of model artifacts"""
+    digest = hashlib.sha256()
+    for path in artifact_paths(model_dir):
+        digest.update(os.path.basename(path).encode())
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    return digest.hexdigest()[:12]
+
+def artifact_mtimes(model_dir):
+    """Modification times of the model artifacts, used by the file watcher"""
+    return {path: os.stat(path).st_mtime_ns for path in artifact_paths(model_dir)}
+
+def load_model(model_dir, name, backend='xgboost'):
+    """
+    Load a model, preferring XGBoost's native UBJSON format over the pickle
+
+    Args:
+        model_dir: Directory holding the artifacts
+        name: Artifact name without extension (e.g. "efficiency_model")
+        backend: One of MODEL_BACKENDS
+
+    Returns:
+        Fitted XGBoost sklearn wrapper, TreeEnsemble ('compiled') or
+        runtimes.RuntimeModel ('onnx', 'treelite')
+    """
+    if backend in RUNTIME_PACKAGES:
+        return load_runtime_model(model_dir, name, backend)
+    if backend == 'compiled':
+        path = tables_path(model_dir, name)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"{path} not found - run tree_engine.py to export it")
+        return TreeEnsemble.load(path)
+    ubj_path = os.path.join(model_dir, f"{name}.ubj")
+    pkl_path = os.path.join(model_dir, f"{name}.pkl")
+    if os.path.exists(ubj_path):
+        import xgboost as xgb
+        model = xgb.XGBClassifier() if 'suitability' in name else xgb.XGBRegressor()
+        model.load_model(ubj_path)
+        return model
+    import joblib
+    return joblib.load(pkl_path)
+
+def model_feature_names(model):
+    """Feature names stored in a model, or None"""
+    if not hasattr(model, 'get_booster'):
+        return model.feature_names
+    return model.get_booster().feature_names
+
+def model_size(model):
+    """Size of a model's serialized booster (or of its tree tables or export), in bytes"""
+    if not hasattr(model, 'get_booster'):
+        return model.nbytes
+    return len(model.get_booster().save_raw())
+
+class ModelBundle:
+    """
+    One consistent set of loaded model artifacts
+
+    Attributes:
+        version: Content hash of the artifacts the bundle was loaded from
+        backend: One of MODEL_BACKENDS
+        loaded_at: Unix time the bundle finished loading
+        model_eff: Efficiency regressor
+        model_site: Suitability classifier
+        feature_columns: Column order of the efficiency model
+        site_feature_columns: Column order of the suitability model
+        table_encoder: Fitted TableEncoder the models were trained with, or
+            None for artifacts saved before feature_encoder.json existed
+        encoder: FeatureEncoder built from both column lists
+        suitability_grid: SuitabilityGrid for model_site, or None if there is
+            no grid file or it was built from a different model
+        model_wind: Wind site suitability classifier for the suitability map,
+            or None if train_ml.py --wind has not been run
+    """
+
+    def __init__(self, model_dir=MODEL_DIR, backend=MODEL_BACKEND):
+        self.model_dir = model_dir
+        self.backend = backend
+        self.version = artifact_version(model_dir)
+        rss_before = process_rss_bytes()
+        self.model_eff = load_model(model_dir, "efficiency_model", backend)
+        self.model_site = load_model(model_dir, "suitability_model", backend)
+        if backend != 'xgboost':
+            # The tables carry their column order
+            self.feature_columns = self.model_eff.feature_names
+            self.site_feature_columns = self.model_site.feature_names
+        else:
+            import joblib
+            self.feature_columns = joblib.load(os.path.join(model_dir, "feature_columns.pkl"))
+            self.site_feature_columns = joblib.load(os.path.join(model_dir, "site_feature_columns.pkl"))
+        self.table_encoder = self._load_table_encoder()
+        self.encoder = FeatureEncoder(self.feature_columns, self.site_feature_columns,
+                                      self.table_encoder.category_index if self.table_encoder else None)
+        self.loaded_rss_bytes = max(0, process_rss_bytes() - rss_before)
+        self.model_bytes = {
+            "efficiency_model_bytes": model_size(self.model_eff),
+            "suitability_model_bytes": model_size(self.model_site)
+        }
+
+        self.suitability_grid = self._load_grid()
+        self.model_wind = self._load_wind()
+        self.loaded_at = time.time()
+
+        self._explainer = None
+        self._explainer_lock = threading.Lock()
+
+    def _load_table_encoder(self):
+        """
+        Load feature_encoder.json and check it against the models
+
+        Raises:
+            ValueError: If the encoder, the column lists and the boosters
+                disagree on the feature layout
+        """
+        path = os.path.join(self.model_dir, ENCODER_FILE)
+        if not os.path.exists(path):
+            return None
+        table_encoder = TableEncoder.load(path)
+        layouts = {
+            "feature_columns.pkl": self.feature_columns,
+            "site_feature_columns.pkl": self.site_feature_columns,
+            "efficiency_model": model_feature_names(self.model_eff),
+            "suitability_model": model_feature_names(self.model_site)
+        }
+        for name, columns in layouts.items():
+            if columns is not None and list(columns) != table_encoder.feature_columns:
+                raise ValueError(f"{ENCODER_FILE} does not match {name} - retrain with train_ml.py")
+        return table_encoder
+
+    def _load_grid(self):
+        """Load the precomputed suitability grid if it matches model_site"""
+        path = os.path.join(self.model_dir, GRID_FILE)
+        if not os.path.exists(path):
+            return None
+        grid = SuitabilityGrid.load(path)
+        if grid.digest != model_digest(self.model_site):
+            print(f"Warning: {GRID_FILE} was built from a different suitability model - ignoring it")
+            print("Run suitability_grid.py again to rebuild it")
+            return None
+        return grid
+
+    def _load_wind(self):
+        """
+        Load the wind suitability classifier if it was trained
+
+        It is only exported as tree tables, so every backend other than
+        xgboost serves the compiled copy.
+        """
+        backend = 'xgboost' if self.backend == 'xgboost' else 'compiled'
+        if backend == 'compiled':
+            paths = [tables_path(self.model_dir, "wind_suitability_model")]
+        else:
+            paths = [os.path.join(self.model_dir, f"wind_suitability_model.{ext}") for ext in ('ubj', 'pkl')]
+        if not any(os.path.exists(path) for path in paths):
+            return None
+        return load_model(self.model_dir, "wind_suitability_model", backend)
+
+    @property
+    def explainer(self):
+        """SHAP TreeExplainer for the efficiency model, built on first use"""
+        if self._explainer is None:
+            with self._explainer_lock:
+                if self._explainer is None:
+                    import shap
+                    self._explainer = shap.TreeExplainer(self.model_eff)
+        return self._explainer
+
+    def warm(self, explainer=False):
+        """
+        Run a test prediction and explanation so the bundle is ready before it serves traffic
+
+        Raises:
+            Exception: Whatever a model or the explanation engine raised, so a
+                broken bundle is never swapped in
+        """
+        from explain import get_engine  # explain.py imports this module
+
+        batch = self.encoder.encode_batch([dict(WARMUP_READING)])
+        self.model_eff.predict(batch.X)
+        self.model_site.predict(self.encoder.site_features(batch.base))
+        # The path /predict explains with (pred_contribs, or the compiled trees' SHAP tables)
+        get_engine(self).contributions(batch.X)
+        if explainer:
+            self.explainer.shap_values(batch.X)
+        return self
+
+    def memory_usage(self):
+        """Approximate memory held by the models, in bytes"""
+        usage = dict(self.model_bytes, loaded_rss_bytes=self.loaded_rss_bytes)
+        if self.suitability_grid is not None:
+            usage["suitability_grid_bytes"] = self.suitability_grid.bits.nbytes
+        if self.model_wind is not None:
+            usage["wind_model_bytes"] = model_size(self.model_wind)
+        return usage
+
+class ModelRegistry:
+    """Process-wide holder of the current ModelBundle"""
+
+    def __init__(self, model_dir=MODEL_DIR):
+        self.model_dir = model_dir
+        self._bundle = None
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._reload_thread = None
+        self._watcher = None
+        self.reload_status = {"state": "idle", "error": None, "version": None, "finished_at": None}
+        self._listeners = []
+        # Reload generation and its force flag, shared by the forked workers
+        self._signal = shared_array((2,), np.int64)
+        self._signal_lock = multiprocessing.Lock()
+        self._generation = 0  # Last generation this process reloaded for
+        self._follower = None
+
+    def current(self):
+        """Return the loaded bundle, loading it on first use"""
+        bundle = self._bundle
+        if bundle is None:
+            with self._lock:
+                if self._bundle is None:
+                    self._bundle = ModelBundle(self.model_dir)
+                bundle = self._bundle
+        return bundle
+
+    @property
+    def version(self):
+        """Version identifier of the serving bundle"""
+        return self.current().version
+
+    def on_reload(self, callback):
+        """Register callback(bundle) to run after a new bundle is swapped in"""
+        self._listeners.append(callback)
+
+    def preload(self, explainer=False):
+        """
+        Load the models before workers are forked
+
+        Freezes the garbage collector afterwards so the loaded objects are not
+        touched (and copied) by collections in the forked workers.
+
+        Args:
+            explainer: Also build the SHAP explainer up front
+        """
+        bundle = self.current()
+        if explainer:
+            bundle.explainer
+        if bundle.backend != 'xgboost':
+            bundle.model_eff.leaf_paths()
+        gc.freeze()
+        return bundle
+
+    def reload(self, explainer=False, force=False):
+        """
+        Load, warm and atomically swap in the artifacts currently on disk
+
+        Args:
+            explainer: Build and warm the SHAP explainer before swapping
+            force: Reload even if the artifact version has not changed
+
+        Returns:
+            The serving bundle after the reload
+
+        Raises:
+            Exception: Whatever loading or warming raised; the old bundle keeps serving
+        """
+        with self._reload_lock:
+            self.reload_status.update(state="loading", error=None)
+            try:
+                current = self._bundle
+                if not force and current is not None and current.version == artifact_version(self.model_dir):
+                    self.reload_status.update(state="idle", version=current.version, finished_at=time.time())
+                    return current
+
+                bundle = ModelBundle(self.model_dir).warm(explainer=explainer)
+                with self._lock:
+                    self._bundle = bundle
+                for callback in self._listeners:
+                    callback(bundle)
+                print(f"Model bundle {bundle.version} loaded")
+                self.reload_status.update(state="idle", version=bundle.version, finished_at=time.time())
+                return bundle
+            except Exception as e:
+                print(f"Model reload failed: {e}")
+                self.reload_status.update(state="failed", error=str(e), finished_at=time.time())
+                raise
+
+    def reload_async(self, explainer=False, force=False):
+        """
+        Start reload() on a background thread
+
+        Returns:
+            False if a reload is already running, True otherwise
+        """
+        if self._reload_thread is not None and self._reload_thread.is_alive():
+            return False
+
+        def run():
+            try:
+                self.reload(explainer=explainer, force=force)
+            except Exception:
+                pass  # Recorded in reload_status
+
+        self.reload_status.update(state="loading", error=None)
+        self._reload_thread = threading.Thread(target=run, name="model-reload", daemon=True)
+        self._reload_thread.start()
+        return True
+
+    def watch(self, interval=5.0, explainer=False):
+        """
+        Poll the artifact files and reload when they change
+
+        A change is only picked up once the modification times are stable for
+        one full interval, so half-written files from train_ml.py are skipped.
+        Threads do not survive fork, so call this again in each worker.
+
+        Args:
+            interval: Seconds between polls
+            explainer: Passed through to reload()
+        """
+        if self._watcher is not None and self._watcher.is_alive():
+            return self._watcher
+
+        def run():
+            seen = artifact_mtimes(self.model_dir)
+            pending = None
+            while True:
+                time.sleep(interval)
+                try:
+                    mtimes = artifact_mtimes(self.model_dir)
+                except OSError:
+                    continue  # Files being replaced, try again next poll
+                if mtimes == seen:
+                    pending = None
+                elif mtimes != pending:
+                    pending = mtimes
+                else:
+                    seen, pending = mtimes, None
+                    try:
+                        self.reload(explainer=explainer)
+                    except Exception:
+                        pass  # Recorded in reload_status
+
+        self._watcher = threading.Thread(target=run, name="model-watcher", daemon=True)
+        self._watcher.start()
+        return self._watcher
+
+    @property
+    def generation(self):
+        """Number of reloads broadcast so far"""
+        return int(self._signal[0])
+
+    def broadcast_reload(self, force=False):
+        """
+        Ask every process following the registry (see follow) to reload
+
+        The calling process counts as done: it reloads itself beforehand.
+
+        Returns:
+            The new generation
+        """
+        with self._signal_lock:
+            self._signal[0] += 1
+            self._signal[1] = int(force)
+            self._generation = int(self._signal[0])
+        return self._generation
+
+    def follow(self, interval=1.0, explainer=False):
+        """
+        Reload whenever another process broadcasts a reload
+
+        Threads do not survive fork, so call this again in each worker.
+
+        Args:
+            interval: Seconds between checks of the shared generation
+            explainer: Passed through to reload()
+        """
+        if self._follower is not None and self._follower.is_alive():
+            return self._follower
+
+        def run():
+            while True:
+                time.sleep(interval)
+                with self._signal_lock:
+                    generation, force = int(self._signal[0]), bool(self._signal[1])
+                if generation == self._generation:
+                    continue
+                self._generation = generation
+                try:
+                    self.reload(explainer=explainer, force=force)
+                except Exception:
+                    pass  # Recorded in reload_status
+
+        self._follower = threading.Thread(target=run, name="model-reload-follower", daemon=True)
+        self._follower.start()
+        return self._follower
+
+    def memory_usage(self):
+        """Model memory of the current bundle plus the process RSS"""
+        usage = self.current().memory_usage()
+        usage["process_rss_bytes"] = process_rss_bytes()
+        return usage
+
+registry = ModelRegistry()
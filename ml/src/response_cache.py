@@ -0,0 +1,270 @@
+"""
+Response cache for /predict keyed on quantized readings
+
+Panels often send nearly the same reading minute after minute. The cache key
+rounds every numeric input to a step (RESPONSE_CACHE_PRECISION, e.g. 0.5 °C,
+1 % humidity, 10 W/m²), so such readings share one response, computed for the
+first reading of its bucket. Only the fields the feature encoder reads are
+part of the key, next to the model version and the requested stages and
+top_n. Entries expire after RESPONSE_CACHE_TTL seconds, the least recently
+used are evicted beyond RESPONSE_CACHE_SIZE, and everything is dropped when
+new models are loaded. Fields that belong to one request (PER_REQUEST_FIELDS)
+are never cached, and responses whose LLM insights are still being generated
+are not cached at all.
+
+Backends (RESPONSE_CACHE):
+
+    memory   an LRUCache per worker process
+    shared   a Redis-compatible store (RESPONSE_CACHE_URL) shared by every
+             worker and instance; without Redis, a shared_store.SharedStore
+             shared by the workers of this instance
+    none     no caching
+"""
+
+import hashlib
+import importlib.util
+import json
+import os
+import threading
+
+from cache import LRUCache
+from metrics import Counter
+from shared_store import SharedStore
+
+# Configuration
+RESPONSE_CACHE = os.environ.get('RESPONSE_CACHE', 'memory')  # 'memory', 'shared' or 'none'
+RESPONSE_CACHE_URL = os.environ.get('RESPONSE_CACHE_URL', 'redis://localhost:6379/0')
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 10000))
+RESPONSE_CACHE_TTL = float(os.environ.get('RESPONSE_CACHE_TTL', 60))  # Seconds
+RESPONSE_CACHE_VALUE_BYTES = int(os.environ.get('RESPONSE_CACHE_VALUE_BYTES', 8192))  # Largest response without Redis
+RESPONSE_CACHE_PREFIX = 'solarsense:predict:'
+REDIS_AVAILABLE = importlib.util.find_spec('redis') is not None
+
+# Quantization step per reading field; fields without a step are keyed on their exact value
+DEFAULT_PRECISION = {
+    'temperature': 0.5,
+    'humidity': 1.0,
+    'irradiance': 10.0,
+    'dust_index': 0.01,
+    'cloudcover': 1.0,
+    'precip': 0.1,
+    'wind_speed': 0.5,
+    'voltage': 0.1,
+    'current': 0.01
+}
+
+# Response fields issued for one request, which a cache hit must not repeat
+PER_REQUEST_FIELDS = ('prediction_id', 'insights_token', 'cached', 'weather_source')
+
+# Created at import, before the workers fork (see metrics.py)
+RESPONSE_CACHE_LOOKUPS = Counter('solarsense_response_cache_lookups_total', "/predict response cache lookups",
+                                 {'result': ('hit', 'miss')})
+
+def parse_precision(text):
+    """
+    Quantization steps from 'field=step,field=step' on top of DEFAULT_PRECISION
+
+    Raises:
+        ValueError: If an entry is malformed or a step is not positive
+    """
+    precision = dict(DEFAULT_PRECISION)
+    for item in filter(None, (part.strip() for part in (text or '').split(','))):
+        field, _, step = item.partition('=')
+        try:
+            step = float(step)
+        except ValueError:
+            raise ValueError(f"Invalid RESPONSE_CACHE_PRECISION entry '{item}' (use field=step)")
+        if step <= 0:
+            raise ValueError(f"Precision step for '{field.strip()}' must be positive, got {step}")
+        precision[field.strip()] = step
+    return precision
+
+try:
+    RESPONSE_CACHE_PRECISION = parse_precision(os.environ.get('RESPONSE_CACHE_PRECISION'))
+except ValueError as e:
+    print(f"Warning: {e} - using the default precision")
+    RESPONSE_CACHE_PRECISION = dict(DEFAULT_PRECISION)
+
+def quantize_reading(data, fields, precision=RESPONSE_CACHE_PRECISION):
+    """
+    Canonical form of the reading fields that matter
+
+    Numeric values (numbers or numeric strings) of fields with a step become
+    the index of their step; other values are kept as strings.
+
+    Returns:
+        Sorted tuple of (field, value)
+    """
+    items = []
+    for field in sorted(key for key in data if key in fields and data[key] is not None):
+        value = data[field]
+        step = precision.get(field)
+        if step is not None and not isinstance(value, bool):
+            try:
+                items.append((field, round(float(value) / step)))
+                continue
+            except (TypeError, ValueError, OverflowError):
+                pass  # Not a finite number, the encoder reports it
+        items.append((field, str(value)))
+    return tuple(items)
+
+class MemoryBackend:
+    """Responses in an LRUCache of this process"""
+    name = 'memory'
+
+    def __init__(self, maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL):
+        self.cache = LRUCache(maxsize, ttl=ttl)
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, response):
+        self.cache.set(key, response)
+
+    def clear(self):
+        self.cache.clear()
+
+    def stats(self):
+        return self.cache.stats()
+
+class SharedBackend:
+    """
+    Responses in a Redis-compatible store shared by all workers and instances
+
+    Args:
+        client: redis.Redis or SharedStore
+        ttl: Seconds an entry stays valid
+        prefix: Namespace of the cache's keys
+    """
+    name = 'shared'
+
+    def __init__(self, client, ttl=RESPONSE_CACHE_TTL, prefix=RESPONSE_CACHE_PREFIX):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def connect(cls, url=RESPONSE_CACHE_URL, **kwargs):
+        import redis
+
+        return cls(redis.Redis.from_url(url, socket_timeout=0.1), **kwargs)
+
+    def _name(self, key):
+        return self.prefix + hashlib.sha1(repr(key).encode()).hexdigest()
+
+    def get(self, key):
+        try:
+            value = self.client.get(self._name(key))
+        except Exception as e:
+            # A cache outage must not fail the request; it is scored instead
+            print(f"Response cache error: {e}")
+            self.errors += 1
+            value = None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(value)
+
+    def set(self, key, response):
+        try:
+            self.client.set(self._name(key), json.dumps(response), px=int(self.ttl * 1000))
+        except Exception as e:
+            print(f"Response cache error: {e}")
+            self.errors += 1
+
+    def clear(self):
+        try:
+            names = list(self.client.scan_iter(match=self.prefix + '*'))
+            if names:
+                self.client.delete(*names)
+        except Exception as e:
+            print(f"Response cache error: {e}")
+            self.errors += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        stats = {"hits": self.hits, "misses": self.misses, "errors": self.errors,
+                 "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0}
+        try:
+            info = self.client.info('stats')
+            stats["evictions"] = info.get("evicted_keys")
+            stats["expirations"] = info.get("expired_keys")
+        except Exception:
+            stats["evictions"] = None
+        return stats
+
+class ResponseCache:
+    """
+    /predict responses by quantized reading, model version and request options
+
+    Args:
+        backend: MemoryBackend or SharedBackend
+        precision: {field: quantization step}
+    """
+
+    def __init__(self, backend, precision=RESPONSE_CACHE_PRECISION):
+        self.backend = backend
+        self.precision = precision
+
+    def key(self, data, bundle, stages, top_n=None):
+        """Cache key of a reading scored with bundle"""
+        return (bundle.version, tuple(sorted(stages)), top_n,
+                quantize_reading(data, bundle.encoder.fields, self.precision))
+
+    def get(self, key):
+        """Cached response, or None"""
+        response = self.backend.get(key)
+        RESPONSE_CACHE_LOOKUPS.inc(result='miss' if response is None else 'hit')
+        return response
+
+    def set(self, key, response):
+        """Cache a response, without its PER_REQUEST_FIELDS, unless a stage failed or insights are pending"""
+        explanation = response.get("explanation")
+        if isinstance(explanation, dict) and "error" in explanation or response.get("suitability") == 'Unknown':
+            return
+        if "insights_token" in response:
+            return
+        self.backend.set(key, {field: value for field, value in response.items() if field not in PER_REQUEST_FIELDS})
+
+    def clear(self, bundle=None):
+        """Drop every cached response (used as a registry.on_reload callback)"""
+        self.backend.clear()
+
+    def stats(self):
+        """Backend, precision and hit/miss/eviction counters for /health"""
+        return {"backend": self.backend.name, "precision": self.precision, **self.backend.stats()}
+
+def load_response_cache(backend=RESPONSE_CACHE):
+    """
+    ResponseCache for a backend name, or None for 'none'
+
+    Without the redis package, or if Redis cannot be reached, 'shared' falls
+    back to a SharedStore with a warning; it is shared by the workers forked
+    after this call, but not between instances.
+
+    Raises:
+        ValueError: For an unknown backend
+    """
+    if backend == 'none':
+        return None
+    if backend == 'memory':
+        return ResponseCache(MemoryBackend())
+    if backend != 'shared':
+        raise ValueError(f"Unknown RESPONSE_CACHE '{backend}' (use memory, shared or none)")
+    if not REDIS_AVAILABLE:
+        print("Warning: redis is not installed - using a response cache shared by this instance's workers")
+        print("Run: pip install redis")
+        return ResponseCache(SharedBackend(SharedStore(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_VALUE_BYTES)))
+    shared = SharedBackend.connect()
+    try:
+        shared.client.ping()
+    except Exception as e:
+        print(f"Warning: cannot reach {RESPONSE_CACHE_URL} ({e}) - using a response cache shared by this instance's workers")
+        return ResponseCache(SharedBackend(SharedStore(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_VALUE_BYTES)))
+    return ResponseCache(shared)
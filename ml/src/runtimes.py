@@ -0,0 +1,247 @@
+"""
+ONNX Runtime and Treelite backends for the efficiency and suitability models
+
+The export command writes, next to the other model artifacts:
+
+    efficiency_model.onnx, suitability_model.onnx   ONNX TreeEnsembleRegressor graphs
+    efficiency_model.so, suitability_model.so       Treelite libraries compiled with tl2cgen
+
+The ONNX graphs are built from the tree_engine tables (the classifier adds a
+Sigmoid node), the libraries from the boosters. With --quantize, tl2cgen
+replaces the float thresholds by integer bin indexes, which makes the
+comparisons cheaper but may shift predictions slightly;
+benchmarks/bench_backends.py reports the deviation. The registry serves
+them with MODEL_BACKEND=onnx or MODEL_BACKEND=treelite. Feature names,
+digests and explanations still come from the tree tables (.npz), which have
+to exist as well.
+
+The runtimes are optional (pip install -r requirements-runtimes.txt);
+without them the registry serves xgboost. Usage (from ml/src, after
+train_ml.py):
+
+    python runtimes.py
+    python runtimes.py --format treelite --quantize
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from tree_engine import MODEL_NAMES, TreeEnsemble, export_models, tables_path
+
+RUNTIME_FILES = {'onnx': '.onnx', 'treelite': '.so'}
+# Package each backend needs at serving time
+RUNTIME_PACKAGES = {'onnx': 'onnxruntime', 'treelite': 'tl2cgen'}
+# Threads per prediction call; serving parallelism comes from the worker processes
+RUNTIME_THREADS = int(os.environ.get('RUNTIME_THREADS', 1))
+
+ONNX_OPSET = 17
+ONNX_ML_OPSET = 3
+ONNX_IR_VERSION = 8
+
+def runtime_path(model_dir, name, backend):
+    """Exported file of a model for 'onnx' or 'treelite'"""
+    return os.path.join(model_dir, name + RUNTIME_FILES[backend])
+
+def to_onnx(ensemble):
+    """
+    ONNX model evaluating a TreeEnsemble
+
+    Input "input" is the float32 feature matrix; the output is "variable"
+    (regression) or the positive class "probability" (binary:logistic), shape (n, 1).
+    """
+    import onnx
+    from onnx import TensorProto, helper
+
+    n_nodes = len(ensemble.feature)
+    tree = np.repeat(np.arange(ensemble.n_trees), np.diff(np.append(ensemble.roots, n_nodes)))
+    root = ensemble.roots[tree]
+    node_id = np.arange(n_nodes) - root
+    leaf = ensemble.child == np.arange(n_nodes)
+    regressor = helper.make_node(
+        'TreeEnsembleRegressor', ['input'], ['margin'], domain='ai.onnx.ml',
+        nodes_treeids=tree.tolist(),
+        nodes_nodeids=node_id.tolist(),
+        nodes_featureids=ensemble.feature.tolist(),
+        nodes_modes=['LEAF' if is_leaf else 'BRANCH_LT' for is_leaf in leaf],
+        nodes_values=np.where(leaf, 0, ensemble.threshold).tolist(),
+        nodes_truenodeids=np.where(leaf, 0, ensemble.child - root).tolist(),
+        nodes_falsenodeids=np.where(leaf, 0, ensemble.child + 1 - root).tolist(),
+        nodes_missing_value_tracks_true=ensemble.default_left.astype(int).tolist(),
+        target_treeids=tree[leaf].tolist(),
+        target_nodeids=node_id[leaf].tolist(),
+        target_ids=[0] * int(leaf.sum()),
+        target_weights=ensemble.value[leaf].tolist(),
+        n_targets=1, aggregate_function='SUM', base_values=[float(ensemble.base_margin)], post_transform='NONE')
+
+    nodes = [regressor]
+    output = 'margin'
+    if ensemble.objective == 'binary:logistic':
+        nodes.append(helper.make_node('Sigmoid', ['margin'], ['probability']))
+        output = 'probability'
+    elif ensemble.objective == 'reg:squarederror':
+        nodes.append(helper.make_node('Identity', ['margin'], ['variable']))
+        output = 'variable'
+    graph = helper.make_graph(
+        nodes, 'tree_ensemble',
+        [helper.make_tensor_value_info('input', TensorProto.FLOAT, [None, ensemble.n_features_in_])],
+        [helper.make_tensor_value_info(output, TensorProto.FLOAT, [None, 1])])
+    model = helper.make_model(graph, ir_version=ONNX_IR_VERSION,
+                              opset_imports=[helper.make_opsetid('', ONNX_OPSET),
+                                             helper.make_opsetid('ai.onnx.ml', ONNX_ML_OPSET)])
+    onnx.checker.check_model(model)
+    return model
+
+def export_onnx(ensemble, path):
+    with open(f"{path}.tmp", 'wb') as f:
+        f.write(to_onnx(ensemble).SerializeToString())
+    os.replace(f"{path}.tmp", path)
+
+def export_treelite(booster, path, quantize=False):
+    """Compile a booster into a shared library with Treelite/tl2cgen (needs a C compiler)"""
+    import tl2cgen
+    import treelite
+
+    model = treelite.frontend.from_xgboost(booster)
+    # The library is written next to the target and swapped in, so watchers never see half a file
+    tmp_path = f"{path}.tmp{RUNTIME_FILES['treelite']}"
+    tl2cgen.export_lib(model, toolchain='gcc', libpath=tmp_path,
+                       params={'quantize': int(quantize), 'parallel_comp': os.cpu_count()}, verbose=False)
+    os.replace(tmp_path, path)
+
+class RuntimeModel:
+    """
+    XGBoost-style predict/predict_proba on top of an exported model
+
+    Args:
+        path: Exported file
+        tables: TreeEnsemble of the same model, for feature names, digest and contributions
+    """
+
+    def __init__(self, path, tables):
+        self.path = path
+        self.tables = tables
+        self.objective = tables.objective
+        self.feature_names = tables.feature_names
+        self.digest = tables.digest
+        self.nbytes = os.path.getsize(path)
+
+    @property
+    def n_features_in_(self):
+        return len(self.feature_names)
+
+    def _output(self, X):
+        """Regression values or positive class probabilities, shape (n,)"""
+        raise NotImplementedError
+
+    def predict(self, X):
+        output = self._output(np.ascontiguousarray(X, dtype=np.float32))
+        if self.objective == 'binary:logistic':
+            return (output > 0.5).astype(np.int64)
+        return output
+
+    def predict_proba(self, X):
+        positive = self._output(np.ascontiguousarray(X, dtype=np.float32))
+        return np.stack([1 - positive, positive], axis=1)
+
+    def contributions(self, X):
+        return self.tables.contributions(X)
+
+    def leaf_paths(self):
+        return self.tables.leaf_paths()
+
+class OnnxModel(RuntimeModel):
+    """Model run by ONNX Runtime"""
+
+    def __init__(self, path, tables):
+        import onnxruntime
+
+        super().__init__(path, tables)
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = RUNTIME_THREADS
+        options.inter_op_num_threads = 1
+        self.session = onnxruntime.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self._input = self.session.get_inputs()[0].name
+
+    def _output(self, X):
+        return self.session.run(None, {self._input: X})[0].ravel()
+
+class TreeliteModel(RuntimeModel):
+    """Model compiled to a shared library by Treelite/tl2cgen"""
+
+    def __init__(self, path, tables):
+        import tl2cgen
+
+        super().__init__(path, tables)
+        # The loader reuses an already loaded library with the same file name,
+        # so load a private copy to pick up a retrained model on reload
+        fd, private_path = tempfile.mkstemp(suffix=RUNTIME_FILES['treelite'], prefix='tl2cgen_')
+        os.close(fd)
+        shutil.copyfile(path, private_path)
+        try:
+            self.predictor = tl2cgen.Predictor(private_path, nthread=RUNTIME_THREADS)
+        finally:
+            os.remove(private_path)  # Stays mapped while loaded
+        self._tl2cgen = tl2cgen
+
+    def _output(self, X):
+        return self.predictor.predict(self._tl2cgen.DMatrix(X, dtype='float32')).ravel()
+
+RUNTIME_MODELS = {'onnx': OnnxModel, 'treelite': TreeliteModel}
+
+def load_runtime_model(model_dir, name, backend):
+    """
+    Load an exported model for MODEL_BACKEND=onnx or treelite
+
+    Raises:
+        FileNotFoundError: If the export or the tree tables are missing
+    """
+    path = runtime_path(model_dir, name, backend)
+    for required in (path, tables_path(model_dir, name)):
+        if not os.path.exists(required):
+            raise FileNotFoundError(f"{required} not found - run runtimes.py to export it")
+    return RUNTIME_MODELS[backend](path, TreeEnsemble.load(tables_path(model_dir, name)))
+
+def export(model_dir='.', formats=tuple(RUNTIME_FILES), quantize=False):
+    """
+    Export both models in model_dir to the given formats
+
+    The tree tables are exported too, since the runtimes need them.
+
+    Returns:
+        {(model name, format): seconds}
+    """
+    from model_registry import load_model
+
+    timings = {}
+    compiled = export_models(model_dir)
+    for name in MODEL_NAMES:
+        for fmt in formats:
+            start = time.perf_counter()
+            if fmt == 'onnx':
+                export_onnx(compiled[name], runtime_path(model_dir, name, fmt))
+            else:
+                export_treelite(load_model(model_dir, name).get_booster(), runtime_path(model_dir, name, fmt),
+                                quantize)
+            timings[(name, fmt)] = time.perf_counter() - start
+    return timings
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the models to ONNX and/or Treelite")
+    parser.add_argument('--model-dir', default=os.path.dirname(os.path.abspath(__file__)))
+    parser.add_argument('--format', choices=sorted(RUNTIME_FILES), nargs='+', default=sorted(RUNTIME_FILES))
+    parser.add_argument('--quantize', action='store_true', help="Quantize the Treelite thresholds")
+    args = parser.parse_args()
+
+    for (name, fmt), seconds in export(args.model_dir, args.format, args.quantize).items():
+        path = runtime_path(args.model_dir, name, fmt)
+        print(f"{os.path.basename(path):<26} {os.path.getsize(path) / 1024:>8.0f} KB  {seconds:6.2f}s")
+    print("Serve with MODEL_BACKEND=" + " or MODEL_BACKEND=".join(args.format)
+          + "; compare with benchmarks/bench_backends.py")
+
+if __name__ == "__main__":
+    main()
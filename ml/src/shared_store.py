@@ -0,0 +1,167 @@
+"""
+Key-value store in shared memory, for state every worker has to see
+
+SharedStore keeps byte values under short string keys in fixed-size slots
+allocated with metrics.shared_array. Like the metrics and the telemetry
+store, it is created when app.py is imported, so with preload_app
+(gunicorn.conf.py) the master allocates it before the workers fork and a
+value written by one worker is read by all of them: ids of deferred
+explanations, insight tokens and, without Redis, the shared response cache.
+Pages are only committed once slots are used.
+
+Slots are grouped in sets of SHARED_STORE_WAYS; a key can only live in the
+set its hash selects, and a full set evicts its least recently used entry.
+Entries expire after their px milliseconds. The interface is the part of
+redis-py that response_cache.SharedBackend uses (get, set, delete,
+scan_iter, info), so the store can stand in for a Redis client.
+"""
+
+import hashlib
+import multiprocessing
+import time
+
+import numpy as np
+
+from metrics import shared_array
+
+SHARED_STORE_WAYS = 8
+KEY_BYTES = 64
+
+# Positions in the shared counter array
+_CLOCK, _HITS, _MISSES, _EVICTIONS, _EXPIRATIONS, _TOO_LARGE = range(6)
+
+def key_hash(name):
+    """Stable non-zero 63-bit hash of an encoded key"""
+    return int.from_bytes(hashlib.blake2b(name, digest_size=8).digest(), 'little') >> 1 | 1
+
+class SharedStore:
+    """
+    Fixed-capacity byte store shared by forked processes
+
+    Args:
+        capacity: Number of entries (rounded up to whole sets)
+        value_bytes: Largest value that can be stored
+        ways: Slots per set
+    """
+
+    def __init__(self, capacity, value_bytes, ways=SHARED_STORE_WAYS):
+        if capacity < 1 or value_bytes < 1:
+            raise ValueError(f"Shared store capacity and value size must be positive, got {capacity} and {value_bytes}")
+        self.ways = ways
+        self.n_sets = -(-capacity // ways)
+        self.capacity = self.n_sets * ways
+        self.value_bytes = value_bytes
+        self._hashes = shared_array((self.n_sets, ways), np.int64)  # 0 marks a free slot
+        self._expires = shared_array((self.n_sets, ways))  # Unix seconds, 0 for never
+        self._used = shared_array((self.n_sets, ways), np.int64)  # Clock of the last access
+        self._names = shared_array((self.n_sets, ways), f'S{KEY_BYTES}')
+        self._lengths = shared_array((self.n_sets, ways), np.int32)
+        self._values = shared_array((self.n_sets, ways, value_bytes), np.uint8)
+        self._counters = shared_array((6,), np.int64)
+        self._lock = multiprocessing.Lock()
+
+    def _locate(self, name):
+        """(encoded name, hash, set) of a key"""
+        encoded = name.encode() if isinstance(name, str) else bytes(name)
+        if len(encoded) > KEY_BYTES:
+            raise ValueError(f"Shared store keys are limited to {KEY_BYTES} bytes, got {len(encoded)}")
+        h = key_hash(encoded)
+        return encoded, h, h % self.n_sets
+
+    def _find(self, encoded, h, s, now):
+        """Way of a live key in set s, or -1; expired entries found on the way are freed"""
+        for way in np.flatnonzero(self._hashes[s] == h):
+            if self._names[s, way] != encoded:
+                continue
+            expires = self._expires[s, way]
+            if expires and expires <= now:
+                self._hashes[s, way] = 0
+                self._counters[_EXPIRATIONS] += 1
+                return -1
+            return int(way)
+        return -1
+
+    def _tick(self):
+        self._counters[_CLOCK] += 1
+        return self._counters[_CLOCK]
+
+    def get(self, name):
+        """Value of a key as bytes, or None if it is unknown or expired"""
+        encoded, h, s = self._locate(name)
+        with self._lock:
+            way = self._find(encoded, h, s, time.time())
+            if way < 0:
+                self._counters[_MISSES] += 1
+                return None
+            self._used[s, way] = self._tick()
+            self._counters[_HITS] += 1
+            return self._values[s, way, :self._lengths[s, way]].tobytes()
+
+    def set(self, name, value, px=None):
+        """
+        Store bytes (or text) under a key, expiring after px milliseconds
+
+        Returns:
+            False if the value is larger than value_bytes, True otherwise
+        """
+        value = value if isinstance(value, bytes) else str(value).encode()
+        if len(value) > self.value_bytes:
+            with self._lock:
+                self._counters[_TOO_LARGE] += 1
+            return False
+        encoded, h, s = self._locate(name)
+        now = time.time()
+        with self._lock:
+            way = self._find(encoded, h, s, now)
+            if way < 0:
+                free = np.flatnonzero(self._hashes[s] == 0)
+                if len(free):
+                    way = int(free[0])
+                else:
+                    way = int(np.argmin(self._used[s]))
+                    self._counters[_EVICTIONS] += 1
+            self._names[s, way] = encoded
+            self._values[s, way, :len(value)] = np.frombuffer(value, dtype=np.uint8)
+            self._lengths[s, way] = len(value)
+            self._expires[s, way] = now + px / 1000 if px else 0
+            self._used[s, way] = self._tick()
+            self._hashes[s, way] = h
+        return True
+
+    def delete(self, *names):
+        """Remove keys; returns how many existed"""
+        deleted = 0
+        now = time.time()
+        with self._lock:
+            for name in names:
+                encoded, h, s = self._locate(name)
+                way = self._find(encoded, h, s, now)
+                if way >= 0:
+                    self._hashes[s, way] = 0
+                    deleted += 1
+        return deleted
+
+    def scan_iter(self, match='*'):
+        """Keys starting with the text before the '*' of match (only trailing wildcards)"""
+        prefix = match.rstrip('*').encode()
+        now = time.time()
+        with self._lock:
+            live = (self._hashes != 0) & ((self._expires == 0) | (self._expires > now))
+            names = self._names[live].tolist()
+        return iter([name.decode() for name in names if name.startswith(prefix)])
+
+    def __len__(self):
+        with self._lock:
+            return int(np.count_nonzero(self._hashes))
+
+    def info(self, section=None):
+        """Eviction and expiry counters under their Redis INFO names"""
+        return {"evicted_keys": int(self._counters[_EVICTIONS]), "expired_keys": int(self._counters[_EXPIRATIONS])}
+
+    def stats(self):
+        """Counters for /health"""
+        hits, misses = int(self._counters[_HITS]), int(self._counters[_MISSES])
+        return {"capacity": self.capacity, "size": len(self), "value_bytes": self.value_bytes,
+                "hits": hits, "misses": misses, "hit_rate": round(hits / (hits + misses), 4) if hits + misses else 0.0,
+                "evictions": int(self._counters[_EVICTIONS]), "expirations": int(self._counters[_EXPIRATIONS]),
+                "too_large": int(self._counters[_TOO_LARGE])}
@@ -0,0 +1,85 @@
+"""
+Local stand-in for the OpenAI chat completions API
+
+Answers POST /v1/chat/completions with a canned response after a configurable
+delay, so the asynchronous insights path can be exercised without an API key:
+
+    python stub_llm_server.py --port 8089 --delay 2
+    USE_OPENAI=true OPENAI_BASE_URL=http://localhost:8089/v1 python app.py
+
+GET /stats returns how many completions were served.
+"""
+
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class StubLLMHandler(BaseHTTPRequestHandler):
+    """Request handler; delay and counters live on the server object"""
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            return self._send_json(404, {"error": "not found"})
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length) or b'{}')
+        time.sleep(self.server.delay)
+        with self.server.lock:
+            self.server.completions += 1
+            count = self.server.completions
+        if self.server.fail_every and count % self.server.fail_every == 0:
+            return self._send_json(500, {"error": "stub failure"})
+        prompt = request.get("messages", [{}])[-1].get("content", "")
+        text = (f"1. Stub insight #{count} for a {len(prompt)}-character prompt.\n"
+                "2. Keep panels clean.\n"
+                "3. Check inverter temperatures.")
+        self._send_json(200, {
+            "id": f"stub-{count}",
+            "object": "chat.completion",
+            "model": request.get("model", "stub"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}]
+        })
+
+    def do_GET(self):
+        if self.path == '/stats':
+            return self._send_json(200, {"completions": self.server.completions})
+        self._send_json(404, {"error": "not found"})
+
+    def log_message(self, format, *args):
+        pass  # Keep test output quiet
+
+def make_server(port=8089, delay=0.5, fail_every=0):
+    """
+    Build (but do not start) a stub server
+
+    Args:
+        port: Port to listen on (0 picks a free port)
+        delay: Seconds to wait before answering each completion
+        fail_every: Return HTTP 500 for every Nth completion (0 never fails)
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', port), StubLLMHandler)
+    server.delay = delay
+    server.fail_every = fail_every
+    server.completions = 0
+    server.lock = threading.Lock()
+    return server
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stub OpenAI-compatible LLM server")
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--delay', type=float, default=0.5, help="Seconds per completion")
+    parser.add_argument('--fail-every', type=int, default=0, help="Fail every Nth completion")
+    args = parser.parse_args()
+
+    server = make_server(args.port, args.delay, args.fail_every)
+    print(f"Stub LLM listening on http://127.0.0.1:{server.server_address[1]}/v1 (delay {args.delay}s)")
+    server.serve_forever()
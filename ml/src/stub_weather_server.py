@@ -0,0 +1,99 @@
+"""
+Local stand-in for the open-meteo forecast API
+
+Answers GET /v1/forecast?latitude=&longitude=&current=... with "current"
+conditions derived from the coordinates after a configurable delay, so the
+weather cache and request coalescing can be exercised without network access:
+
+    python stub_weather_server.py --port 8090 --delay 0.5
+    WEATHER_PROVIDER=open-meteo WEATHER_API_URL=http://localhost:8090/v1 python app.py
+
+GET /stats returns how many forecasts were served.
+"""
+
+import argparse
+import json
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+def current_weather(lat, lon):
+    """Deterministic, plausible current conditions for a location"""
+    wave = math.sin(math.radians(lat * 7 + lon * 3))
+    return {
+        "temperature_2m": round(32 - abs(lat - 20) * 0.6 + 4 * wave, 1),
+        "relative_humidity_2m": round(55 + 30 * wave),
+        "cloud_cover": round(40 + 40 * wave),
+        "precipitation": round(max(wave, 0) * 2, 1),
+        "wind_speed_10m": round(12 + 8 * math.cos(math.radians(lon * 5)), 1),
+        "shortwave_radiation": round(650 - 250 * wave)
+    }
+
+class StubWeatherHandler(BaseHTTPRequestHandler):
+    """Request handler; delay and counters live on the server object"""
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/stats':
+            return self._send_json(200, {"forecasts": self.server.forecasts})
+        if not url.path.rstrip('/').endswith('/forecast'):
+            return self._send_json(404, {"error": "not found"})
+        query = parse_qs(url.query)
+        try:
+            lat, lon = float(query['latitude'][0]), float(query['longitude'][0])
+        except (KeyError, ValueError):
+            return self._send_json(400, {"error": True, "reason": "latitude and longitude are required"})
+        time.sleep(self.server.delay)
+        with self.server.lock:
+            self.server.forecasts += 1
+            count = self.server.forecasts
+        if self.server.fail_every and count % self.server.fail_every == 0:
+            return self._send_json(500, {"error": True, "reason": "stub failure"})
+        weather = current_weather(lat, lon)
+        variables = query.get('current', [','.join(weather)])[0].split(',')
+        self._send_json(200, {
+            "latitude": lat,
+            "longitude": lon,
+            "current": {"time": time.strftime('%Y-%m-%dT%H:%M', time.gmtime()), "interval": 900,
+                        **{name: weather[name] for name in variables if name in weather}}
+        })
+
+    def log_message(self, format, *args):
+        pass  # Keep test output quiet
+
+def make_server(port=8090, delay=0.5, fail_every=0):
+    """
+    Build (but do not start) a stub server
+
+    Args:
+        port: Port to listen on (0 picks a free port)
+        delay: Seconds to wait before answering each forecast
+        fail_every: Return HTTP 500 for every Nth forecast (0 never fails)
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', port), StubWeatherHandler)
+    server.delay = delay
+    server.fail_every = fail_every
+    server.forecasts = 0
+    server.lock = threading.Lock()
+    return server
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stub open-meteo forecast server")
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--delay', type=float, default=0.5, help="Seconds per forecast")
+    parser.add_argument('--fail-every', type=int, default=0, help="Fail every Nth forecast")
+    args = parser.parse_args()
+
+    server = make_server(args.port, args.delay, args.fail_every)
+    print(f"Stub weather API listening on http://127.0.0.1:{server.server_address[1]}/v1 (delay {args.delay}s)")
+    server.serve_forever()
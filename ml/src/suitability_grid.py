@@ -0,0 +1,253 @@
+"""
+Precomputed lookup grid for the site suitability classifier
+
+In /predict the suitability model only sees features synthesized from five
+weather inputs (temperature, humidity, irradiance, cloudcover, precip), so its
+answer can be tabulated offline over a quantized grid of those inputs. At
+serving time (SUITABILITY_MODE=grid) a prediction becomes an array index;
+inputs outside the grid (or missing) are scored with the model and counted.
+
+Build the grid and print its accuracy against the full model (from ml/src):
+
+    python suitability_grid.py
+    python suitability_grid.py --steps 1 2 10 5 2.5 --samples 50000
+"""
+
+import argparse
+import hashlib
+import os
+import time
+
+import numpy as np
+
+from features import BASE_FIELDS
+
+GRID_FILE = "suitability_grid.npz"
+
+# (start, stop, step) per input, in features.BASE_FIELDS order
+DEFAULT_AXES = {
+    'temperature': (-10.0, 50.0, 1.0),
+    'humidity': (0.0, 100.0, 2.5),
+    'irradiance': (0.0, 1200.0, 25.0),
+    'cloudcover': (0.0, 100.0, 10.0),
+    'precip': (0.0, 50.0, 5.0)
+}
+
+def model_digest(model):
+    """
+    Hash of a model's booster, used to tie a grid to the model it was built from
+
+    Accepts an XGBoost sklearn wrapper, a Booster, or a tree_engine.TreeEnsemble
+    (which carries the digest of the booster it was compiled from).
+    """
+    if getattr(model, 'digest', None):
+        return model.digest
+    booster = model.get_booster() if hasattr(model, 'get_booster') else model
+    return hashlib.sha256(bytes(booster.save_raw())).hexdigest()[:12]
+
+class SuitabilityGrid:
+    """
+    Bit-packed suitability labels over a regular grid of weather inputs
+
+    Args:
+        start, step: Per-axis origin and spacing (BASE_FIELDS order)
+        shape: Number of grid points per axis
+        bits: np.packbits of the flattened 0/1 labels
+        digest: model_digest of the suitability model the grid was built from
+    """
+
+    def __init__(self, start, step, shape, bits, digest=None):
+        self.start = np.asarray(start, dtype=np.float64)
+        self.step = np.asarray(step, dtype=np.float64)
+        self.shape = tuple(int(n) for n in shape)
+        self.bits = np.asarray(bits, dtype=np.uint8)
+        self.digest = digest
+        self.lookups = 0
+        self.out_of_range = 0  # Rows scored with the model because they lie outside the grid
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    def points(self, flat_index):
+        """Weather inputs at the given flat grid indexes, shape (n, len(BASE_FIELDS))"""
+        coords = np.unravel_index(flat_index, self.shape)
+        return np.stack([self.start[i] + self.step[i] * c for i, c in enumerate(coords)], axis=1)
+
+    def _coords(self, base):
+        """Nearest grid point per row, and whether the row lies within half a step of the grid"""
+        base = np.atleast_2d(base)
+        scaled = np.rint((base - self.start) / self.step)
+        inside = np.all((scaled >= 0) & (scaled <= np.asarray(self.shape) - 1), axis=1)  # False for NaN
+        coords = np.where(inside[:, None], scaled, 0).astype(np.intp)
+        return coords, inside
+
+    def in_range(self, base):
+        """Boolean mask of the rows the grid covers"""
+        return self._coords(base)[1]
+
+    def lookup(self, base):
+        """
+        Suitability labels (0/1) for base weather vectors
+
+        Args:
+            base: Array of shape (n, len(BASE_FIELDS)), e.g. EncodedBatch.base
+
+        Returns:
+            (uint8 array of labels, boolean mask of the rows inside the grid);
+            rows outside the grid get label 0 and should be scored with the
+            model instead (see predict)
+        """
+        coords, inside = self._coords(base)
+        flat = np.ravel_multi_index(coords.T, self.shape)
+        labels = (self.bits[flat >> 3] >> (7 - (flat & 7))) & 1
+        labels[~inside] = 0
+        return labels, inside
+
+    def predict(self, base, model, encoder):
+        """
+        Grid labels for rows inside the grid, model predictions for the rest
+
+        Args:
+            base: Array of shape (n, len(BASE_FIELDS))
+            model: The suitability classifier the grid was built from
+            encoder: features.FeatureEncoder with the model's site_feature_columns
+
+        Returns:
+            uint8 array of labels
+        """
+        base = np.atleast_2d(base)
+        labels, inside = self.lookup(base)
+        outside = np.flatnonzero(~inside)
+        self.lookups += len(base)
+        if len(outside):
+            self.out_of_range += len(outside)
+            labels[outside] = model.predict(encoder.site_features(base[outside]))
+        return labels
+
+    def stats(self):
+        """Lookup counters for /health"""
+        return {"lookups": self.lookups, "out_of_range": self.out_of_range}
+
+    def save(self, path, **metadata):
+        np.savez_compressed(path, start=self.start, step=self.step, shape=np.asarray(self.shape),
+                            bits=self.bits, digest=np.asarray(self.digest or ''), **metadata)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['start'], data['step'], data['shape'], data['bits'], str(data['digest']) or None)
+
+def build_grid(model, encoder, axes=DEFAULT_AXES, chunk_size=500_000):
+    """
+    Evaluate the suitability model over every grid point
+
+    Args:
+        model: Fitted suitability classifier
+        encoder: features.FeatureEncoder with the model's site_feature_columns
+        axes: {field: (start, stop, step)} for every field in BASE_FIELDS
+        chunk_size: Grid points evaluated per model call
+
+    Returns:
+        SuitabilityGrid
+    """
+    start = [axes[field][0] for field in BASE_FIELDS]
+    step = [axes[field][2] for field in BASE_FIELDS]
+    shape = [int(round((axes[field][1] - axes[field][0]) / axes[field][2])) + 1 for field in BASE_FIELDS]
+    grid = SuitabilityGrid(start, step, shape, np.zeros(0, dtype=np.uint8), model_digest(model))
+
+    labels = np.empty(grid.size, dtype=np.uint8)
+    for offset in range(0, grid.size, chunk_size):
+        flat = np.arange(offset, min(offset + chunk_size, grid.size))
+        labels[flat] = model.predict(encoder.site_features(grid.points(flat)))
+    grid.bits = np.packbits(labels)
+    return grid
+
+def accuracy_report(grid, model, encoder, base):
+    """
+    Compare grid predictions with the full model on arbitrary (off-grid) inputs
+
+    Returns:
+        Dictionary with the number of samples, how many lie outside the grid,
+        the agreement rate of predict() (model fallback outside the grid) and
+        that of the grid alone on the inputs it covers
+    """
+    expected = model.predict(encoder.site_features(base))
+    labels, inside = grid.lookup(base)
+    return {"samples": len(base), "out_of_range": int(np.sum(~inside)),
+            "agreement": float(np.mean(expected == grid.predict(base, model, encoder))),
+            "grid_agreement": float(np.mean(expected[inside] == labels[inside])) if inside.any() else None}
+
+def sample_inputs(axes, n, seed=42, margin=0.0):
+    """
+    Uniform random inputs inside the grid bounds
+
+    Args:
+        margin: Widen every axis by this fraction of its span on each side,
+            so some inputs fall outside the grid
+    """
+    rng = np.random.default_rng(seed)
+    columns = []
+    for f in BASE_FIELDS:
+        low, high = axes[f][0], axes[f][1]
+        pad = (high - low) * margin
+        columns.append(rng.uniform(low - pad, high + pad, n))
+    return np.stack(columns, axis=1)
+
+def dataset_inputs(path):
+    """Weather inputs from the combined training dataset, if it exists"""
+    if not os.path.exists(path):
+        return None
+    import pandas as pd
+    df = pd.read_csv(path, usecols=BASE_FIELDS)
+    return df[BASE_FIELDS].to_numpy(dtype=np.float64)
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the suitability lookup grid")
+    parser.add_argument('--steps', type=float, nargs=len(BASE_FIELDS), metavar='STEP',
+                        help=f"Grid spacing for {', '.join(BASE_FIELDS)}")
+    parser.add_argument('--out', help=f"Output file (default: {GRID_FILE} next to the models)")
+    parser.add_argument('--samples', type=int, default=20000, help="Random inputs for the accuracy report")
+    parser.add_argument('--dataset', default='solar_panel_combined_dataset.csv')
+    args = parser.parse_args()
+
+    from model_registry import registry
+    bundle = registry.current()
+    out = args.out or os.path.join(registry.model_dir, GRID_FILE)
+
+    axes = dict(DEFAULT_AXES)
+    if args.steps:
+        axes = {f: (axes[f][0], axes[f][1], s) for f, s in zip(BASE_FIELDS, args.steps)}
+
+    start = time.perf_counter()
+    grid = build_grid(bundle.model_site, bundle.encoder, axes)
+    print(f"Grid {' x '.join(map(str, grid.shape))} = {grid.size:,} points "
+          f"built in {time.perf_counter() - start:.1f}s ({grid.bits.nbytes / 1e6:.2f} MB packed)")
+    suitable = np.unpackbits(grid.bits, count=grid.size).mean()
+    print(f"Grid points labelled suitable: {suitable:.2%}")
+
+    reports = {"uniform": accuracy_report(grid, bundle.model_site, bundle.encoder, sample_inputs(axes, args.samples)),
+               "widened": accuracy_report(grid, bundle.model_site, bundle.encoder,
+                                          sample_inputs(axes, args.samples, margin=0.25))}
+    real = dataset_inputs(args.dataset)
+    if real is not None:
+        reports["dataset"] = accuracy_report(grid, bundle.model_site, bundle.encoder, real)
+    for name, report in reports.items():
+        grid_only = f"{report['grid_agreement']:.4%}" if report['grid_agreement'] is not None else "n/a"
+        print(f"Agreement with full model ({name}, {report['samples']:,} inputs, "
+              f"{report['out_of_range']:,} outside the grid): {report['agreement']:.4%} (grid only: {grid_only})")
+
+    bench = sample_inputs(axes, 10000, seed=7)
+    start = time.perf_counter()
+    grid.lookup(bench)
+    lookup_us = (time.perf_counter() - start) / len(bench) * 1e6
+    start = time.perf_counter()
+    bundle.model_site.predict(bundle.encoder.site_features(bench))
+    model_us = (time.perf_counter() - start) / len(bench) * 1e6
+    print(f"Per-row cost: lookup {lookup_us:.3f} us vs model {model_us:.3f} us")
+
+    grid.save(out, **{f"agreement_{k}": v["agreement"] for k, v in reports.items()})
+    print(f"Saved {out}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,378 @@
+"""
+Solar and wind site suitability heat maps over a lat/lon grid
+
+Every cell of a map gets the weather of its nearest stations (WeatherStations,
+blended over MAP_K stations so the map is smooth), turned into the model
+inputs of the layer:
+
+    solar   the suitability classifier's synthesized site features (see
+            features.SITE_FEATURE_SPEC), with irradiance estimated from the
+            latitude and cloud cover
+    wind    the wind site survey columns (WIND_FEATURE_SPEC) for the
+            classifier trained by train_ml.py --wind
+
+All cells of a map are scored by one predict_proba call on a single matrix.
+Scores are the probability of a suitable site, sent as PNG (a colour ramp,
+transparent where no station is within MAP_MAX_DISTANCE_KM) or as compact
+binary: one uint8 per cell, 0-254 for the probability times 254 and 255 for
+no data, rows from north to south.
+
+Maps come as Web Mercator tiles (/suitability/tiles/<layer>/<z>/<x>/<y>.png,
+ready for a Leaflet tile layer) or for a bounding box at a given resolution
+(/suitability/map). Rendered maps are cached by their key and the model
+version, and the cache is cleared when new models are loaded.
+
+To render a tile and compare with scoring every cell on its own (from ml/src):
+
+    python suitability_map.py --layer wind --zoom 5
+"""
+
+import argparse
+import os
+import struct
+import time
+import zlib
+
+import numpy as np
+
+from cache import LRUCache
+from features import BASE_FIELDS
+from geo_index import WEATHER_STATIONS, WeatherStations
+from metrics import Counter, Histogram
+
+# Configuration
+MAP_K = int(os.environ.get('MAP_K', 4))  # Stations blended per cell
+MAP_MAX_DISTANCE_KM = float(os.environ.get('MAP_MAX_DISTANCE_KM', 400))  # Farther cells have no data
+MAP_TILE_CELLS = int(os.environ.get('MAP_TILE_CELLS', 64))  # Cells per tile side, a divisor of TILE_PX
+MAP_MAX_CELLS = int(os.environ.get('MAP_MAX_CELLS', 250_000))  # Largest /suitability/map grid
+MAP_CACHE_SIZE = int(os.environ.get('MAP_CACHE_SIZE', 4096))  # Cached tiles and maps
+
+MAP_LAYERS = ('solar', 'wind')
+MAP_FORMATS = {'png': 'image/png', 'bin': 'application/octet-stream'}
+MAP_FIELDS = ['temperature', 'humidity', 'cloudcover', 'precip', 'wind_speed', 'pressure']
+TILE_PX = 256
+MAX_ZOOM = 18
+NO_DATA = 255
+WIND_MODEL_MISSING = "Wind suitability model not trained - run: python train_ml.py --wind"
+
+# Wind survey columns as (map field, scale, constant): value = field * scale + constant.
+# Station wind speeds are km/h, the survey's m/s. Terrain and gusts are not
+# known per cell and take the survey medians.
+WIND_FEATURE_SPEC = {
+    'Slope': (None, 0, 15),
+    'Elevation': (None, 0, 1500),
+    'TurbulenceIntensity': (None, 0, 20)
+}
+for _period in ('Quarter1', 'Quarter2', 'Quarter3', 'Quarter4', 'Yearly'):
+    WIND_FEATURE_SPEC.update({
+        f'{_period}-AirTemperature': ('temperature', 1, 0),
+        f'{_period}-RelativeHumidity': ('humidity', 1, 0),
+        f'{_period}-Precipitation': ('precip', 4 if _period == 'Yearly' else 1, 0),
+        f'{_period}-WindSpeed': ('wind_speed', 1 / 3.6, 0),
+        f'{_period}-WindGustSpeed': (None, 0, 50),
+        f'{_period}-AirPressure': ('pressure', 1, 0)
+    })
+
+# Colour ramp from unsuitable (red) through yellow to suitable (green); NO_DATA is transparent
+_STOPS = np.array([[215, 48, 39], [252, 141, 89], [254, 224, 139], [145, 207, 96], [26, 152, 80]], dtype=np.float64)
+PALETTE = np.zeros((256, 4), dtype=np.uint8)
+PALETTE[:NO_DATA, :3] = np.stack([np.interp(np.linspace(0, 1, NO_DATA), np.linspace(0, 1, len(_STOPS)), _STOPS[:, c])
+                                  for c in range(3)], axis=1).round()
+PALETTE[:NO_DATA, 3] = 170
+
+# Created at import, before the workers fork (see metrics.py)
+MAP_REQUESTS = Counter('solarsense_map_requests_total', "Suitability tiles and maps by layer and cache result",
+                       {'layer': MAP_LAYERS, 'result': ('hit', 'miss')})
+MAP_RENDER_SECONDS = Histogram('solarsense_map_render_seconds', "Time to score and encode a suitability map",
+                               {'layer': MAP_LAYERS})
+
+def estimated_irradiance(lat, cloudcover):
+    """
+    Typical midday global irradiance in W/m²
+
+    1000 W/m² at the equator, scaled by the cosine of the latitude and
+    reduced for cloud cover as in Kasten & Czeplak (1980).
+    """
+    return 1000 * np.cos(np.radians(lat)) * (1 - 0.75 * (np.asarray(cloudcover) / 100) ** 3.4)
+
+def spec_matrix(spec, columns, inputs, n):
+    """
+    Model matrix in columns order from a (field, scale, constant) spec
+
+    Args:
+        spec: {column: (field or None, scale, constant)}
+        columns: Model feature names
+        inputs: {field: array of n values}
+        n: Number of rows
+
+    Raises:
+        ValueError: If a model column has no entry in spec
+    """
+    missing = [column for column in columns if column not in spec]
+    if missing:
+        raise ValueError(f"No map input for model columns {missing}")
+    X = np.empty((n, len(columns)), dtype=np.float32)
+    for i, column in enumerate(columns):
+        field, scale, constant = spec[column]
+        X[:, i] = inputs[field] * scale + constant if field is not None else constant
+    return X
+
+def tile_centers(z, x, y, cells):
+    """
+    Latitude and longitude grids (cells x cells) of a Web Mercator tile's cell centres
+
+    Raises:
+        ValueError: If the tile does not exist
+    """
+    n = 2 ** z
+    if not (0 <= z <= MAX_ZOOM and 0 <= x < n and 0 <= y < n):
+        raise ValueError(f"No tile {z}/{x}/{y} (zoom 0-{MAX_ZOOM}, x and y below 2^zoom)")
+    offsets = (np.arange(cells) + 0.5) / cells
+    lon = (x + offsets) / n * 360 - 180
+    lat = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * (y + offsets) / n))))
+    return np.meshgrid(lat, lon, indexing='ij')
+
+def area_centers(bbox, resolution, max_cells=MAP_MAX_CELLS):
+    """
+    Latitude and longitude grids of the cell centres of a bounding box, north row first
+
+    Args:
+        bbox: (west, south, east, north) in degrees
+        resolution: Cell size in degrees
+
+    Raises:
+        ValueError: For an invalid box or resolution, or more than max_cells cells
+    """
+    west, south, east, north = bbox
+    if not (-180 <= west < east <= 180 and -90 <= south < north <= 90):
+        raise ValueError(f"Invalid bbox {bbox} (west,south,east,north in degrees)")
+    if not resolution > 0:
+        raise ValueError(f"Resolution must be positive, got {resolution}")
+    rows, cols = int(np.ceil((north - south) / resolution)), int(np.ceil((east - west) / resolution))
+    if rows * cols > max_cells:
+        raise ValueError(f"{rows}x{cols} cells is over the limit of {max_cells:,} - use a coarser resolution")
+    lat = north - (np.arange(rows) + 0.5) * resolution
+    lon = west + (np.arange(cols) + 0.5) * resolution
+    return np.meshgrid(lat, lon, indexing='ij')
+
+def quantize(scores):
+    """uint8 codes of probabilities: 0-254, NO_DATA where the score is NaN"""
+    codes = np.full(scores.shape, NO_DATA, dtype=np.uint8)
+    valid = ~np.isnan(scores)
+    codes[valid] = np.rint(scores[valid] * (NO_DATA - 1)).astype(np.uint8)
+    return codes
+
+def encode_png(rgba):
+    """PNG file of an (height, width, 4) uint8 RGBA image"""
+    height, width = rgba.shape[:2]
+    # Filter type 0 (none) in front of every row
+    raw = np.hstack([np.zeros((height, 1), dtype=np.uint8), rgba.reshape(height, width * 4)]).tobytes()
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw, 6)) + chunk(b'IEND', b''))
+
+class SuitabilityMap:
+    """
+    Scores, encodes and caches suitability maps
+
+    Args:
+        stations: WeatherStations over MAP_FIELDS
+        tile_cells: Cells per tile side (a divisor of TILE_PX)
+        max_distance_km: Cells farther than this from every station have no data
+        max_cells: Largest grid /suitability/map renders
+        cache_size: Number of cached tiles and maps
+    """
+
+    def __init__(self, stations, tile_cells=MAP_TILE_CELLS, max_distance_km=MAP_MAX_DISTANCE_KM,
+                 max_cells=MAP_MAX_CELLS, cache_size=MAP_CACHE_SIZE):
+        if tile_cells <= 0 or TILE_PX % tile_cells:
+            raise ValueError(f"MAP_TILE_CELLS must divide {TILE_PX}, got {tile_cells}")
+        self.stations = stations
+        self.tile_cells = tile_cells
+        self.max_distance_km = max_distance_km
+        self.max_cells = max_cells
+        self.cache = LRUCache(cache_size)
+        self.rendered = 0
+        self.cells_scored = 0
+        self.render_seconds = 0.0
+
+    @classmethod
+    def load(cls, path=WEATHER_STATIONS, k=MAP_K, **kwargs):
+        return cls(WeatherStations.load(path, fields=MAP_FIELDS, k=k), **kwargs)
+
+    def score(self, bundle, layer, lat, lon):
+        """
+        Probability of a suitable site at every point
+
+        Args:
+            bundle: ModelBundle to score with
+            layer: 'solar' or 'wind'
+            lat, lon: Arrays of the same shape
+
+        Returns:
+            float64 array shaped like lat, NaN where no station is close enough
+
+        Raises:
+            ValueError: For an unknown layer or a missing wind model
+        """
+        if layer not in MAP_LAYERS:
+            raise ValueError(f"Unknown layer '{layer}' (use {' or '.join(MAP_LAYERS)})")
+        if layer == 'wind' and bundle.model_wind is None:
+            raise ValueError(WIND_MODEL_MISSING)
+        shape = np.shape(lat)
+        lat, lon = np.ravel(lat), np.ravel(lon)
+        values, _, distance = self.stations.lookup(lat, lon)
+        covered = np.flatnonzero(distance <= self.max_distance_km)
+        scores = np.full(len(lat), np.nan)
+        if len(covered):
+            inputs = dict(zip(self.stations.fields, values[covered].T))
+            if layer == 'solar':
+                inputs['irradiance'] = estimated_irradiance(lat[covered], inputs['cloudcover'])
+                base = np.stack([inputs[field] for field in BASE_FIELDS], axis=1)
+                model, X = bundle.model_site, bundle.encoder.site_features(base)
+            else:
+                columns = getattr(bundle.model_wind, 'feature_names', None)
+                if columns is None:
+                    columns = bundle.model_wind.get_booster().feature_names
+                model, X = bundle.model_wind, spec_matrix(WIND_FEATURE_SPEC, columns, inputs, len(covered))
+            scores[covered] = model.predict_proba(X)[:, 1]
+        self.cells_scored += len(lat)
+        return scores.reshape(shape)
+
+    def _render(self, key, layer, render):
+        """Cached render() result; returns (body, headers, cached)"""
+        if layer not in MAP_LAYERS:
+            raise ValueError(f"Unknown layer '{layer}' (use {' or '.join(MAP_LAYERS)})")
+        cached = self.cache.get(key)
+        if cached is not None:
+            MAP_REQUESTS.inc(layer=layer, result='hit')
+            return cached + (True,)
+        start = time.perf_counter()
+        body, headers = render()
+        seconds = time.perf_counter() - start
+        self.rendered += 1
+        self.render_seconds += seconds
+        MAP_RENDER_SECONDS.observe(seconds, layer=layer)
+        MAP_REQUESTS.inc(layer=layer, result='miss')
+        self.cache.set(key, (body, headers))
+        return body, headers, False
+
+    @staticmethod
+    def _encode(codes, fmt, scale=1):
+        """Body of a map in fmt; PNG pixels are scale x scale cells"""
+        if fmt == 'bin':
+            return codes.tobytes()
+        if scale > 1:
+            codes = np.repeat(np.repeat(codes, scale, axis=0), scale, axis=1)
+        return encode_png(PALETTE[codes])
+
+    def tile(self, bundle, layer, z, x, y, fmt='png'):
+        """
+        A Web Mercator tile: TILE_PX square PNG, or tile_cells square binary
+
+        Returns:
+            (body, headers, cached)
+
+        Raises:
+            ValueError: For an unknown layer or format, a missing tile or a missing wind model
+        """
+        if fmt not in MAP_FORMATS:
+            raise ValueError(f"Unknown format '{fmt}' (use {' or '.join(MAP_FORMATS)})")
+        lat, lon = tile_centers(z, x, y, self.tile_cells)
+
+        def render():
+            codes = quantize(self.score(bundle, layer, lat, lon))
+            headers = {"Content-Type": MAP_FORMATS[fmt], "X-Map-Shape": f"{self.tile_cells},{self.tile_cells}"}
+            return self._encode(codes, fmt, TILE_PX // self.tile_cells), headers
+
+        return self._render(('tile', bundle.version, layer, z, x, y, fmt), layer, render)
+
+    def area(self, bundle, layer, bbox, resolution, fmt='png'):
+        """
+        A bounding box map with one cell (PNG pixel) per resolution degrees
+
+        Returns:
+            (body, headers, cached)
+
+        Raises:
+            ValueError: For an unknown layer or format, an invalid or too large
+                grid, or a missing wind model
+        """
+        if fmt not in MAP_FORMATS:
+            raise ValueError(f"Unknown format '{fmt}' (use {' or '.join(MAP_FORMATS)})")
+        bbox = tuple(round(float(v), 6) for v in bbox)
+        resolution = round(float(resolution), 6)
+        lat, lon = area_centers(bbox, resolution, self.max_cells)
+
+        def render():
+            codes = quantize(self.score(bundle, layer, lat, lon))
+            headers = {"Content-Type": MAP_FORMATS[fmt], "X-Map-Shape": f"{codes.shape[0]},{codes.shape[1]}",
+                       "X-Map-Bounds": ','.join(f"{v:g}" for v in bbox), "X-Map-Resolution": f"{resolution:g}"}
+            return self._encode(codes, fmt), headers
+
+        return self._render(('area', bundle.version, layer, bbox, resolution, fmt), layer, render)
+
+    def clear(self, bundle=None):
+        """Drop every cached map (used as a registry.on_reload callback)"""
+        self.cache.clear()
+
+    def stats(self):
+        """Counters for /health"""
+        return {
+            "stations": len(self.stations.index),
+            "rendered": self.rendered,
+            "cells_scored": self.cells_scored,
+            "render_mean_ms": round(self.render_seconds / self.rendered * 1000, 2) if self.rendered else 0.0,
+            "cache": self.cache.stats()
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description="Render a suitability tile and time it against per-cell scoring")
+    parser.add_argument('--layer', choices=MAP_LAYERS, default='solar')
+    parser.add_argument('--zoom', type=int, default=5)
+    parser.add_argument('--lat', type=float, default=22.0, help="Tile containing this point")
+    parser.add_argument('--lon', type=float, default=79.0)
+    parser.add_argument('--cells', type=int, default=MAP_TILE_CELLS)
+    parser.add_argument('--out', help="Write the PNG tile here")
+    args = parser.parse_args()
+
+    from model_registry import registry
+    bundle = registry.current()
+    if args.layer == 'wind' and bundle.model_wind is None:
+        print(WIND_MODEL_MISSING)
+        raise SystemExit(1)
+    maps = SuitabilityMap.load(tile_cells=args.cells)
+    n = 2 ** args.zoom
+    x = int((args.lon + 180) / 360 * n)
+    y = int((1 - np.arcsinh(np.tan(np.radians(args.lat))) / np.pi) / 2 * n)
+
+    start = time.perf_counter()
+    body, headers, _ = maps.tile(bundle, args.layer, args.zoom, x, y)
+    seconds = time.perf_counter() - start
+    cells = args.cells ** 2
+    print(f"Tile {args.zoom}/{x}/{y} ({args.layer}): {cells:,} cells in {seconds * 1000:.1f} ms "
+          f"({cells / seconds:,.0f} cells/s), {len(body):,} byte PNG")
+    start = time.perf_counter()
+    maps.tile(bundle, args.layer, args.zoom, x, y)
+    print(f"Cached: {(time.perf_counter() - start) * 1e6:.0f} us")
+
+    lat, lon = tile_centers(args.zoom, x, y, args.cells)
+    sample = np.random.default_rng(42).choice(cells, min(cells, 200), replace=False)
+    start = time.perf_counter()
+    single = [maps.score(bundle, args.layer, lat.flat[i:i + 1], lon.flat[i:i + 1])[0] for i in sample]
+    per_cell = (time.perf_counter() - start) / len(sample)
+    print(f"One cell at a time: {1 / per_cell:,.0f} cells/s ({per_cell * cells:.2f}s for the tile)")
+    grid = maps.score(bundle, args.layer, lat, lon).ravel()[sample]
+    if not np.allclose(grid, single, equal_nan=True):
+        print("Check FAILED: grid and per-cell scores differ")
+        raise SystemExit(1)
+    if args.out:
+        with open(args.out, 'wb') as f:
+            f.write(body)
+        print(f"Saved {args.out}")
+
+if __name__ == "__main__":
+    main()
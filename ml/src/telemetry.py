@@ -0,0 +1,412 @@
+"""
+Rolling per-panel state for streamed telemetry
+
+Panels report the sensor_data.csv fields (voltage, current, panel_temp,
+dust_index and, when the panel measures it, efficiency). TelemetryStore keeps
+the last TELEMETRY_WINDOW readings of every panel in preallocated NumPy ring
+buffers, one row per panel, and next to them the running moments of every
+tracked value over the window (count, Σt, Σt², Σv, Σtv, Σv²). A new reading
+adds its moments and, once the window is full, subtracts those of the reading
+it overwrites, so each reading costs O(1) whatever the window length. Means,
+standard deviations and least-squares trends per day (and from them a
+projected efficiency and risk score) are read straight off the moments.
+
+Readings are applied a chunk at a time: the chunk is split into rounds with
+at most one reading per panel, and every round is a handful of vectorized
+gathers and scatters over its panels.
+
+Memory is fixed per panel and allocated up front for TELEMETRY_MAX_PANELS
+panels (pages are only committed once a panel uses them). Per panel:
+
+    window * 4 bytes      reading times
+    window * 16 bytes     efficiency, power, dust_index, panel_temp (float32)
+    192 bytes             moments, 6 float64 per tracked value
+    64 bytes              panel id (up to 32 bytes), ring position, counts, times
+    32-64 bytes           id lookup table (int64 key and slot pairs, a power
+                          of two at least twice max_panels)
+
+which is about 2,220 bytes with the default window of 96, or 222 MB for 100,000
+panels (TelemetryStore.bytes_per_panel() gives the exact figure). Like the
+metrics (see metrics.py) everything lives in shared memory allocated before
+the workers fork, so every worker ingests into and reads the same state.
+
+To time ingestion and check the rolling statistics against NumPy (from ml/src):
+
+    python telemetry.py --panels 10000 --readings 1000000
+"""
+
+import argparse
+import hashlib
+import math
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+from metrics import Counter, shared_array
+
+# Configuration
+TELEMETRY_WINDOW = int(os.environ.get('TELEMETRY_WINDOW', 96))  # Readings kept per panel
+TELEMETRY_MAX_PANELS = int(os.environ.get('TELEMETRY_MAX_PANELS', 100_000))
+TELEMETRY_CHUNK = int(os.environ.get('TELEMETRY_CHUNK', 10_000))  # Streamed readings applied at a time
+RISK_HORIZON_DAYS = float(os.environ.get('RISK_HORIZON_DAYS', 7))  # How far the efficiency trend is projected
+
+# Reading fields and the values tracked from them (power = voltage * current)
+INPUT_FIELDS = ['voltage', 'current', 'panel_temp', 'dust_index', 'efficiency']
+TRACKED = ['efficiency', 'power', 'dust_index', 'panel_temp']
+MOMENTS = ('n', 't', 'tt', 'v', 'tv', 'vv')
+PANEL_ID_BYTES = 32
+SECONDS_PER_DAY = 86400.0
+# Trends need the readings in the window to span more than about a second
+MIN_TIME_VARIANCE = (1 / SECONDS_PER_DAY) ** 2
+
+# Created at import, before the workers fork (see metrics.py)
+TELEMETRY_READINGS = Counter('solarsense_telemetry_readings_total', "Streamed telemetry readings",
+                             {'outcome': ('accepted', 'rejected')})
+
+def panel_key(panel_id):
+    """Stable non-zero 63-bit hash of an encoded panel id"""
+    return int.from_bytes(hashlib.blake2b(panel_id, digest_size=8).digest(), 'little') >> 1 | 1
+
+def parse_timestamps(values, now):
+    """
+    Unix seconds of reading timestamps: numbers are taken as Unix seconds,
+    strings parsed as ISO 8601 (UTC unless they carry an offset), None is now
+
+    Returns:
+        float64 array, NaN where a string could not be parsed
+    """
+    seconds = np.full(len(values), float(now))
+    text = [i for i, value in enumerate(values) if isinstance(value, str)]
+    for i, value in enumerate(values):
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            seconds[i] = value
+    if text:
+        import pandas as pd
+
+        parsed = pd.to_datetime([values[i] for i in text], errors='coerce', utc=True, format='ISO8601')
+        seconds[text] = np.where(parsed.isna(), np.nan, parsed.asi8 / 1e9)
+    return seconds
+
+def parse_readings(readings, now=None):
+    """
+    Columns of a chunk of readings
+
+    Args:
+        readings: Reading dictionaries; Exception entries (e.g. from a line
+            that was not valid JSON) are reported as that reading's error
+        now: Unix time for readings without a timestamp
+
+    Returns:
+        (index of every valid reading, encoded panel ids, Unix seconds,
+        float64 values (n, len(TRACKED)) with NaN for missing ones,
+        [(index, error message)])
+    """
+    now = time.time() if now is None else now
+    index, ids, stamps, rows, errors = [], [], [], [], []
+    for i, data in enumerate(readings):
+        if isinstance(data, Exception):
+            errors.append((i, str(data)))
+            continue
+        if not isinstance(data, dict) or data.get('panel_id') is None:
+            errors.append((i, "panel_id is required"))
+            continue
+        panel_id = str(data['panel_id']).encode()
+        if len(panel_id) > PANEL_ID_BYTES:
+            errors.append((i, f"panel_id is longer than {PANEL_ID_BYTES} bytes"))
+            continue
+        try:
+            row = [float(data[field]) if data.get(field) is not None else math.nan for field in INPUT_FIELDS]
+        except (TypeError, ValueError):
+            errors.append((i, f"{', '.join(INPUT_FIELDS)} must be numbers"))
+            continue
+        index.append(i)
+        ids.append(panel_id)
+        stamps.append(data.get('timestamp'))
+        rows.append(row)
+
+    inputs = np.array(rows, dtype=np.float64).reshape(len(rows), len(INPUT_FIELDS))
+    voltage, current, panel_temp, dust_index, efficiency = inputs.T
+    values = np.stack([efficiency, voltage * current, dust_index, panel_temp], axis=1)
+    seconds = parse_timestamps(stamps, now)
+    bad = np.isnan(seconds)
+    if bad.any():
+        errors.extend((index[i], "timestamp must be Unix seconds or ISO 8601") for i in np.flatnonzero(bad))
+        keep = np.flatnonzero(~bad)
+        index, ids = [index[i] for i in keep], [ids[i] for i in keep]
+        seconds, values = seconds[keep], values[keep]
+    return index, ids, seconds, values, sorted(errors)
+
+def window_moments(t, values):
+    """Moments (n, Σt, Σt², Σv, Σtv, Σv²) per tracked value, shape (rows, len(TRACKED), 6); NaN adds nothing"""
+    valid = ~np.isnan(values)
+    v = np.where(valid, values, 0.0)
+    n = valid.astype(np.float64)
+    t = t.astype(np.float64)[:, None]
+    return np.stack([n, n * t, n * t * t, v, v * t, v * v], axis=2)
+
+def to_json(value, digits=4):
+    """Rounded float, or None for NaN"""
+    return None if np.isnan(value) else round(float(value), digits)
+
+class TelemetryStore:
+    """
+    Fixed-size rolling windows and statistics for up to max_panels panels
+
+    Args:
+        window: Readings kept per panel
+        max_panels: Panels the store has room for; readings of further
+            panels are rejected
+    """
+
+    def __init__(self, window=TELEMETRY_WINDOW, max_panels=TELEMETRY_MAX_PANELS):
+        if window < 2 or max_panels < 1:
+            raise ValueError(f"Telemetry window must be at least 2 and max_panels at least 1, "
+                             f"got {window} and {max_panels}")
+        self.window = window
+        self.max_panels = max_panels
+        self._times = shared_array((max_panels, window), np.float32)  # Days since the panel's first reading
+        self._values = shared_array((max_panels, window, len(TRACKED)), np.float32)
+        self._moments = shared_array((max_panels, len(TRACKED), len(MOMENTS)))
+        self._ids = shared_array((max_panels,), f'S{PANEL_ID_BYTES}')
+        self._head = shared_array((max_panels,), np.int32)  # Next position in the ring
+        self._count = shared_array((max_panels,), np.int32)  # Readings in the window
+        self._total = shared_array((max_panels,), np.int64)  # Readings ever
+        self._origin = shared_array((max_panels,), np.float64)  # Unix seconds of the first reading
+        self._last_seen = shared_array((max_panels,), np.float64)
+        # Open addressing table from panel_key to slot, at most half full
+        size = 1 << (2 * max_panels - 1).bit_length()
+        self._table_keys = shared_array((size,), np.int64)
+        self._table_slots = shared_array((size,), np.int64)
+        self._n_panels = shared_array((1,), np.int64)
+        self._lock = multiprocessing.Lock()
+        self._local = {}  # Slots this process has looked up, they never move
+        self._rejected = shared_array((1,), np.int64)
+
+    @property
+    def n_panels(self):
+        return int(self._n_panels[0])
+
+    def bytes_per_panel(self):
+        """Memory the store reserves per panel, in bytes"""
+        arrays = (self._times, self._values, self._moments, self._ids, self._head, self._count,
+                  self._total, self._origin, self._last_seen, self._table_keys, self._table_slots)
+        return sum(a.nbytes for a in arrays) / self.max_panels
+
+    def _find(self, panel_id, create=False):
+        """Slot of an encoded panel id, or -1 if it is unknown (or the store is full when create)"""
+        slot = self._local.get(panel_id)
+        if slot is not None:
+            return slot
+        key = panel_key(panel_id)
+        mask = len(self._table_keys) - 1
+        i = key & mask
+        while True:
+            found = self._table_keys[i]
+            if found == 0:
+                if not create or self._n_panels[0] >= self.max_panels:
+                    return -1
+                slot = int(self._n_panels[0])
+                self._ids[slot] = panel_id
+                self._table_slots[i] = slot
+                self._table_keys[i] = key  # Written last, readers see a complete entry
+                self._n_panels[0] = slot + 1
+                break
+            if found == key and self._ids[self._table_slots[i]] == panel_id:
+                slot = int(self._table_slots[i])
+                break
+            i = (i + 1) & mask
+        self._local[panel_id] = slot
+        return slot
+
+    def ingest(self, readings, now=None):
+        """
+        Add a chunk of readings to the panels' windows
+
+        Args:
+            readings: Reading dictionaries (see parse_readings)
+            now: Unix time for readings without a timestamp
+
+        Returns:
+            (number accepted, [(index, error message)] of the rejected readings)
+        """
+        index, ids, seconds, values, errors = parse_readings(readings, now)
+        with self._lock:
+            slots = np.array([self._find(panel_id, create=True) for panel_id in ids], dtype=np.int64)
+            full = slots < 0
+            if full.any():
+                errors = sorted(errors + [(index[i], f"Telemetry store is full ({self.max_panels:,} panels)")
+                                          for i in np.flatnonzero(full)])
+                keep = ~full
+                slots, seconds, values = slots[keep], seconds[keep], values[keep]
+
+            # A panel's first reading sets the origin of its times
+            first_slots, first = np.unique(slots, return_index=True)
+            new = self._total[first_slots] == 0
+            self._origin[first_slots[new]] = seconds[first[new]]
+            t = ((seconds - self._origin[slots]) / SECONDS_PER_DAY).astype(np.float32)
+
+            # Round r holds every panel's r-th reading of the chunk, in order
+            order = np.argsort(slots, kind='stable')
+            sorted_slots = slots[order]
+            starts = np.flatnonzero(np.r_[True, sorted_slots[1:] != sorted_slots[:-1]])
+            rank = np.empty(len(slots), dtype=np.int64)
+            rank[order] = np.arange(len(slots)) - np.repeat(starts, np.diff(np.r_[starts, len(slots)]))
+            for r in range(int(rank.max()) + 1 if len(slots) else 0):
+                rows = np.flatnonzero(rank == r)
+                self._apply(slots[rows], t[rows], values[rows], seconds[rows])
+            self._rejected[0] += len(errors)
+        TELEMETRY_READINGS.inc(len(slots), outcome='accepted')
+        TELEMETRY_READINGS.inc(len(errors), outcome='rejected')
+        return len(slots), errors
+
+    def _apply(self, slots, t, values, seconds):
+        """One reading for each of distinct slots"""
+        head = self._head[slots]
+        full = self._count[slots] == self.window
+        # Moments of the values as stored, so the ones subtracted later cancel exactly
+        values = values.astype(np.float32)
+        moments = window_moments(t, values.astype(np.float64))
+        if full.any():
+            # Take the overwritten readings out of the window
+            old = window_moments(self._times[slots, head], self._values[slots, head].astype(np.float64))
+            moments -= old * full[:, None, None]
+        self._moments[slots] += moments
+        self._times[slots, head] = t
+        self._values[slots, head] = values
+        self._head[slots] = (head + 1) % self.window
+        self._count[slots] = np.minimum(self._count[slots] + 1, self.window)
+        self._total[slots] += 1
+        self._last_seen[slots] = np.maximum(self._last_seen[slots], seconds)
+
+    def statistics(self, slots):
+        """
+        Rolling statistics of panels, vectorized
+
+        Returns:
+            Dictionary of arrays: mean, std, trend (per day) and latest,
+            each (panels, len(TRACKED)); projected_efficiency and risk_score
+            per panel (NaN without efficiency readings)
+        """
+        slots = np.asarray(slots, dtype=np.int64)
+        with self._lock:
+            moments = self._moments[slots].copy()
+            latest = self._values[slots, (self._head[slots] - 1) % self.window].astype(np.float64)
+            counts = self._count[slots].copy()
+        n, st, stt, sv, stv, svv = np.moveaxis(moments, 2, 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = sv / n
+            std = np.sqrt(np.maximum(svv / n - mean ** 2, 0))
+            time_variance = stt / n - (st / n) ** 2
+            trend = np.where((n >= 2) & (time_variance > MIN_TIME_VARIANCE),
+                             (stv / n - st / n * mean) / time_variance, np.nan)
+        latest[counts == 0] = np.nan
+        efficiency = TRACKED.index('efficiency')
+        projected = np.clip(mean[:, efficiency] + np.nan_to_num(trend[:, efficiency]) * RISK_HORIZON_DAYS, 0, 1)
+        return {"mean": mean, "std": std, "trend": trend, "latest": latest, "projected_efficiency": projected,
+                "risk_score": (1 - projected) * 100}
+
+    def report(self, slots):
+        """JSON-ready statistics of panels"""
+        stats = self.statistics(slots)
+        reports = []
+        for row, slot in enumerate(slots):
+            report = {
+                "panel_id": self._ids[slot].decode(),
+                "readings": int(self._total[slot]),
+                "window": int(self._count[slot]),
+                "last_seen": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(self._last_seen[slot]))
+            }
+            for i, name in enumerate(TRACKED):
+                report[name] = {"mean": to_json(stats["mean"][row, i]), "std": to_json(stats["std"][row, i]),
+                                "trend_per_day": to_json(stats["trend"][row, i], 6),
+                                "latest": to_json(stats["latest"][row, i])}
+            report["projected_efficiency"] = to_json(stats["projected_efficiency"][row])
+            report["risk_score"] = to_json(stats["risk_score"][row], 2)
+            reports.append(report)
+        return reports
+
+    def panel(self, panel_id):
+        """Report of one panel, or None if it has sent no readings"""
+        slot = self._find(str(panel_id).encode())
+        return self.report([slot])[0] if slot >= 0 else None
+
+    def riskiest(self, limit=100):
+        """Reports of the limit panels with the highest risk score (panels without efficiency last)"""
+        slots = np.arange(self.n_panels)
+        risk = self.statistics(slots)["risk_score"]
+        order = np.argsort(-np.nan_to_num(risk, nan=-np.inf), kind='stable')[:limit]
+        return self.report(slots[order])
+
+    def stats(self):
+        """Counters for /health"""
+        return {
+            "panels": self.n_panels,
+            "max_panels": self.max_panels,
+            "window": self.window,
+            "bytes_per_panel": int(self.bytes_per_panel()),
+            "readings": int(self._total[:self.n_panels].sum()),
+            "rejected": int(self._rejected[0])
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description="Time telemetry ingestion and check the rolling statistics")
+    parser.add_argument('--panels', type=int, default=10_000)
+    parser.add_argument('--readings', type=int, default=1_000_000)
+    parser.add_argument('--window', type=int, default=TELEMETRY_WINDOW)
+    parser.add_argument('--chunk', type=int, default=TELEMETRY_CHUNK)
+    args = parser.parse_args()
+
+    store = TelemetryStore(args.window, args.panels)
+    print(f"{store.bytes_per_panel():,.0f} bytes per panel, "
+          f"{store.bytes_per_panel() * 100_000 / 1e6:,.0f} MB for 100,000 panels")
+
+    # Every panel reports every 5 minutes; efficiency drifts down as dust builds up
+    rng = np.random.default_rng(42)
+    steps = args.readings // args.panels
+    panel = np.tile(np.arange(args.panels), steps)
+    step = np.repeat(np.arange(steps), args.panels)
+    drift = rng.uniform(0, 0.01, args.panels)[panel]
+    dust = np.clip(step / steps + rng.normal(0, 0.05, len(panel)), 0, 1)
+    columns = {
+        'panel_id': panel.tolist(),
+        'timestamp': (1.7e9 + step * 300.0).tolist(),
+        'voltage': rng.normal(35, 3, len(panel)).tolist(),
+        'current': rng.normal(8, 1, len(panel)).tolist(),
+        'panel_temp': rng.normal(45, 5, len(panel)).tolist(),
+        'dust_index': dust.tolist(),
+        'efficiency': (0.9 - drift * step * 300 / SECONDS_PER_DAY + rng.normal(0, 0.01, len(panel))).tolist()
+    }
+    readings = [dict(zip(columns, row)) for row in zip(*columns.values())]
+
+    start = time.perf_counter()
+    for offset in range(0, len(readings), args.chunk):
+        store.ingest(readings[offset:offset + args.chunk])
+    seconds = time.perf_counter() - start
+    print(f"{len(readings):,} readings of {args.panels:,} panels in {seconds:.2f}s: "
+          f"{len(readings) / seconds:,.0f} readings/s")
+
+    start = time.perf_counter()
+    store.riskiest(10)
+    print(f"Fleet risk ranking in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    # Rolling statistics against NumPy on the last window of a few panels
+    worst = 0.0
+    for p in rng.choice(args.panels, min(args.panels, 20), replace=False):
+        rows = np.flatnonzero(panel == p)[-args.window:]
+        t = (np.array(columns['timestamp'])[rows] - columns['timestamp'][p]) / SECONDS_PER_DAY
+        efficiency = np.array(columns['efficiency'])[rows]
+        report = store.panel(p)
+        expected = [efficiency.mean(), np.polyfit(t, efficiency, 1)[0] if len(rows) > 1 else None,
+                    np.array(columns['dust_index'])[rows].mean()]
+        actual = [report['efficiency']['mean'], report['efficiency']['trend_per_day'], report['dust_index']['mean']]
+        worst = max(worst, max(abs(a - e) for a, e in zip(actual, expected) if e is not None))
+    print(f"Max difference against NumPy: {worst:.2e}")
+    if worst > 1e-3:
+        print("Check FAILED")
+        raise SystemExit(1)
+    print("Check passed")
+
+if __name__ == "__main__":
+    main()
@@ -1,84 +1,248 @@
+import argparse
+import json
+import os
+import time
 import pandas as pd
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import r2_score, mean_absolute_error, accuracy_score
 import xgboost as xgb
 import joblib 
-
-# 1. Load Data
-try:
-    df = pd.read_csv('solar_panel_combined_dataset.csv')
-    print("Dataset loaded successfully.")
-except FileNotFoundError:
-    print("Error: 'solar_panel_combined_dataset.csv' not found.")
-    print("Make sure you are in the 'ml/src' folder and the file exists.")
-    exit()
-
-# 2. Clean Data & Handle Target Variable
-# Create 'Label' (Target for Suitability) - Handle potential casing issues
-if 'Label (Yes/No)' in df.columns:
-    df['Label'] = df['Label (Yes/No)'].map({'Yes': 1, 'No': 0, 'yes': 1, 'no': 0})
-else:
-    # If the column name is different, try to find it or default to 0
-    print("Warning: 'Label (Yes/No)' column not found. Checking for similar names...")
-    possible_cols = [c for c in df.columns if 'label' in c.lower()]
-    if possible_cols:
-        print(f"Using '{possible_cols[0]}' as label.")
-        df['Label'] = df[possible_cols[0]].map({'Yes': 1, 'No': 0, 'yes': 1, 'no': 0})
-    else:
+from dataio import find_dataset, read_columns, read_table
+from features import ENCODER_FILE, TableEncoder
+from training import (DEFAULT_PARAMS, LABEL_SOURCE, encode_labels, label_column, label_columns, peak_rss_mb,
+                      print_report, train_out_of_core)
+from tree_engine import compile_booster, tables_path
+from tuning import TUNING_REPORT, load_params, print_tuning_report, tune
+
+# Prefer a Parquet/Arrow copy of the dataset when one exists (see dataio.py)
+DATA_PATH = find_dataset(os.environ.get('DATA_PATH', 'solar_panel_combined_dataset.csv'))
+# Wind site survey used by the wind layer of the suitability map (see suitability_map.py)
+WIND_DATA_PATH = os.environ.get('WIND_DATA_PATH', os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data', 'raw', 'Wind_Sites_Dataset_India.csv'))
+
+def load_training_data(encoder_path=None):
+    """
+    Load the whole dataset and encode it with a TableEncoder
+
+    Args:
+        encoder_path: Existing feature_encoder.json to keep the feature layout
+            stable; by default a new encoder is fitted on the dataset
+
+    Returns:
+        (X, y_eff, y_site, encoder), or None if the data cannot be used
+    """
+    # 1. Load Data
+    try:
+        # Only load the columns used for features and targets
+        columns = [c for c in read_columns(DATA_PATH) if c not in ('panel_id', 'timestamp')]
+        df = read_table(DATA_PATH, columns=columns)
+        print(f"Dataset loaded successfully from {DATA_PATH}.")
+    except FileNotFoundError:
+        print(f"Error: '{DATA_PATH}' not found.")
+        print("Make sure you are in the 'ml/src' folder and the file exists.")
+        return None
+
+    # 2. Clean Data & Handle Target Variable
+    # Create 'Label' (Target for Suitability) - the label column is found the
+    # same way for out-of-core training (training.label_column)
+    label = label_column(df.columns)
+    if label is None:
         print("Error: No Label column found.")
-        exit()
-
-# Drop ID and original text label columns if they exist
-cols_to_drop = ['panel_id', 'Label (Yes/No)']
-df.drop([c for c in cols_to_drop if c in df.columns], axis=1, inplace=True)
-
-# 3. Handle Categorical Features (One-Hot Encoding)
-# This converts any remaining text columns into numbers
-df = pd.get_dummies(df, drop_first=True)
-
-# Ensure no missing values (fill with 0 just in case)
-df = df.fillna(0)
-
-print(f"Processed dataframe shape: {df.shape}")
-
-# 4. Define Features (X) and Targets (y)
-# We need to make sure 'efficiency' and 'Label' are not in X
-drop_targets = ['efficiency', 'Label']
-X = df.drop([c for c in drop_targets if c in df.columns], axis=1)
-
-y_eff = df['efficiency']
-y_site = df['Label']
-
-# 5. Train Efficiency Model (Regressor)
-print("\nTraining Efficiency Model...")
-X_train_eff, X_test_eff, y_train_eff, y_test_eff = train_test_split(X, y_eff, test_size=0.2, random_state=42)
-
-model_eff = xgb.XGBRegressor(n_estimators=300, learning_rate=0.1, max_depth=5, random_state=42, objective='reg:squarederror')
-model_eff.fit(X_train_eff, y_train_eff)
-
-y_pred_eff = model_eff.predict(X_test_eff)
-r2_eff = r2_score(y_test_eff, y_pred_eff)
-mae_eff = mean_absolute_error(y_test_eff, y_pred_eff)
-print(f"Efficiency Model - R²: {r2_eff:.4f} (Target >0.94), MAE: {mae_eff:.4f}")
-
-# 6. Train Suitability Model (Classifier)
-print("\nTraining Suitability Model...")
-X_train_site, X_test_site, y_train_site, y_test_site = train_test_split(X, y_site, test_size=0.2, random_state=42)
-
-model_site = xgb.XGBClassifier(n_estimators=100, learning_rate=0.1, max_depth=4, random_state=42)
-model_site.fit(X_train_site, y_train_site)
-
-y_pred_site = model_site.predict(X_test_site)
-acc_site = accuracy_score(y_test_site, y_pred_site)
-print(f"Suitability Model Accuracy: {acc_site:.4f}")
-
-# 7. Save Models
-joblib.dump(model_eff, "efficiency_model.pkl")
-joblib.dump(X.columns.tolist(), "feature_columns.pkl")
-
-joblib.dump(model_site, "suitability_model.pkl")
-joblib.dump(X.columns.tolist(), "site_feature_columns.pkl")
-
-print("="*100)
-print("SUCCESS: All .pkl models generated!")
-print("="*100)
\ No newline at end of file
+        return None
+    if label != LABEL_SOURCE:
+        print(f"Warning: '{LABEL_SOURCE}' column not found. Using '{label}' as label.")
+    df['Label'] = encode_labels(df[label])
+
+    # Drop ID and original text label columns if they exist
+    cols_to_drop = ['panel_id', LABEL_SOURCE]
+    df.drop([c for c in cols_to_drop if c in df.columns], axis=1, inplace=True)
+
+    # 3. Handle Categorical Features (One-Hot Encoding)
+    # The fitted encoder turns text columns into one-hot columns and fills
+    # missing values with 0; it is saved so serving uses the same layout
+    # We need to make sure 'efficiency' and 'Label' are not in X
+    drop_targets = ['efficiency', 'Label'] + [c for c in label_columns(df.columns) if c != 'Label']
+    try:
+        if encoder_path:
+            encoder = TableEncoder.load(encoder_path)
+            encoder.check_columns(df.columns, exclude=drop_targets)
+        else:
+            encoder = TableEncoder.fit([df], exclude=drop_targets)
+        # 4. Define Features (X) and Targets (y)
+        # The DataFrame wraps the float32 matrix without copying and keeps the feature names
+        X = pd.DataFrame(encoder.transform(df), columns=encoder.feature_columns)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return None
+
+    print(f"Processed feature matrix shape: {X.shape}")
+
+    return X, df['efficiency'], df['Label'], encoder
+
+def train_in_memory(encoder_path=None, params=None):
+    """
+    Fit both models on the whole dataset and save the artifacts
+
+    Args:
+        encoder_path: See load_training_data
+        params: {model name: XGBoost parameters} overriding DEFAULT_PARAMS
+    """
+    data = load_training_data(encoder_path)
+    if data is None:
+        return False
+    X, y_eff, y_site, encoder = data
+    params = {**DEFAULT_PARAMS, **(params or {})}
+
+    # 5. Train Efficiency Model (Regressor)
+    print("\nTraining Efficiency Model...")
+    X_train_eff, X_test_eff, y_train_eff, y_test_eff = train_test_split(X, y_eff, test_size=0.2, random_state=42)
+
+    model_eff = xgb.XGBRegressor(**{'random_state': 42, **params['efficiency']})
+    model_eff.fit(X_train_eff, y_train_eff)
+
+    y_pred_eff = model_eff.predict(X_test_eff)
+    r2_eff = r2_score(y_test_eff, y_pred_eff)
+    mae_eff = mean_absolute_error(y_test_eff, y_pred_eff)
+    print(f"Efficiency Model - R²: {r2_eff:.4f} (Target >0.94), MAE: {mae_eff:.4f}")
+
+    # 6. Train Suitability Model (Classifier)
+    print("\nTraining Suitability Model...")
+    X_train_site, X_test_site, y_train_site, y_test_site = train_test_split(X, y_site, test_size=0.2, random_state=42)
+
+    model_site = xgb.XGBClassifier(**{'random_state': 42, **params['suitability']})
+    model_site.fit(X_train_site, y_train_site)
+
+    y_pred_site = model_site.predict(X_test_site)
+    acc_site = accuracy_score(y_test_site, y_pred_site)
+    print(f"Suitability Model Accuracy: {acc_site:.4f}")
+
+    # 7. Save Models
+    joblib.dump(model_eff, "efficiency_model.pkl")
+    joblib.dump(X.columns.tolist(), "feature_columns.pkl")
+
+    joblib.dump(model_site, "suitability_model.pkl")
+    joblib.dump(X.columns.tolist(), "site_feature_columns.pkl")
+
+    # Category tables and column order shared with serving
+    encoder.save(ENCODER_FILE)
+
+    # Native UBJSON copies load faster and are preferred by model_registry.py
+    model_eff.save_model("efficiency_model.ubj")
+    model_site.save_model("suitability_model.ubj")
+
+    # Pure-NumPy tree tables for MODEL_BACKEND=compiled (see tree_engine.py)
+    compile_booster(model_eff.get_booster()).save(tables_path('.', "efficiency_model"))
+    compile_booster(model_site.get_booster()).save(tables_path('.', "suitability_model"))
+
+    print("="*100)
+    print("SUCCESS: All .pkl models generated!")
+    print("="*100)
+    return True
+
+def train_wind_model(params=None):
+    """
+    Fit the wind site suitability classifier on WIND_DATA_PATH and save it
+
+    The model uses the survey's own columns (terrain plus quarterly and
+    yearly weather) and the suitability model's hyperparameters.
+
+    Args:
+        params: XGBoost parameters overriding DEFAULT_PARAMS['suitability']
+    """
+    try:
+        df = read_table(WIND_DATA_PATH)
+        print(f"Wind dataset loaded successfully from {WIND_DATA_PATH}.")
+    except FileNotFoundError:
+        print(f"Error: '{WIND_DATA_PATH}' not found.")
+        return False
+    if 'Label' not in df.columns:
+        print("Error: No Label column found in the wind dataset.")
+        return False
+    y = df['Label'].astype(object).map({'Yes': 1, 'No': 0, 'yes': 1, 'no': 0})
+    X = df.drop(columns=['Label']).astype('float32')
+
+    print("\nTraining Wind Suitability Model...")
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+    model = xgb.XGBClassifier(**{'random_state': 42, **DEFAULT_PARAMS['suitability'], **(params or {})})
+    model.fit(X_train, y_train)
+    print(f"Wind Suitability Model Accuracy: {accuracy_score(y_test, model.predict(X_test)):.4f}")
+
+    joblib.dump(model, "wind_suitability_model.pkl")
+    model.save_model("wind_suitability_model.ubj")
+    compile_booster(model.get_booster()).save(tables_path('.', "wind_suitability_model"))
+    print("Saved wind_suitability_model.pkl/.ubj/.npz")
+    return True
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the efficiency and suitability models")
+    parser.add_argument('--out-of-core', action='store_true',
+                        help="Stream the dataset in chunks and train both models in parallel processes")
+    parser.add_argument('--matrix', choices=['quantile', 'external'], default='quantile',
+                        help="QuantileDMatrix in memory, or ExtMemQuantileDMatrix cached on disk")
+    parser.add_argument('--chunksize', type=int, default=100_000, help="Rows per chunk with --out-of-core")
+    parser.add_argument('--threads', type=int, default=os.cpu_count(), help="Total thread budget")
+    parser.add_argument('--processes', type=int, choices=[1, 2], default=2,
+                        help="Train the two models concurrently (2) or one after the other (1)")
+    parser.add_argument('--report', help="Also write the timing/memory report (with --tune: the tuning report) to this JSON file")
+    parser.add_argument('--encoder', help=f"Reuse this {ENCODER_FILE} instead of fitting a new one "
+                                          "(fails if the dataset's columns or categories changed)")
+    parser.add_argument('--tune', action='store_true',
+                        help="Search hyperparameters and write a Pareto report instead of training")
+    parser.add_argument('--trials', type=int, default=24, help="Trials per model with --tune")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="Parallel trials with --tune")
+    parser.add_argument('--tolerance', type=float, default=0.002,
+                        help="With --tune, select the fastest model scoring within this of the best")
+    parser.add_argument('--params', help="Train with the parameters selected in a tuning report (or any JSON "
+                                         "file of {model: params})")
+    parser.add_argument('--wind', action='store_true',
+                        help="Train only the wind suitability model (from WIND_DATA_PATH)")
+    args = parser.parse_args()
+
+    if args.wind:
+        train_wind_model(load_params(args.params).get('suitability') if args.params else None)
+        return
+
+    if args.tune:
+        data = load_training_data(args.encoder)
+        if data is None:
+            return
+        report = tune(*data[:3], trials=args.trials, workers=args.workers, tolerance=args.tolerance)
+        print_tuning_report(report)
+        path = args.report or TUNING_REPORT
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport saved to {path}. Train the selected models with: python train_ml.py --params {path}")
+        return
+
+    params = load_params(args.params) if args.params else None
+    if not args.out_of_core:
+        start = time.perf_counter()
+        if train_in_memory(args.encoder, params):
+            print(f"Wall time: {time.perf_counter() - start:.1f}s, peak RSS: {peak_rss_mb():.0f} MB")
+        return
+
+    if not os.path.exists(DATA_PATH):
+        print(f"Error: '{DATA_PATH}' not found.")
+        return
+    print(f"Training out of core from {DATA_PATH} ({args.matrix} matrix)...")
+    try:
+        report = train_out_of_core(DATA_PATH, matrix=args.matrix, chunksize=args.chunksize,
+                                   threads=args.threads, processes=args.processes,
+                                   encoder=TableEncoder.load(args.encoder) if args.encoder else None,
+                                   params=params)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return
+    for model in report['models']:
+        print(f"{model['model'].capitalize()} Model - " + ", ".join(
+            f"{k}: {v:.4f}" for k, v in model['metrics'].items() if isinstance(v, float)))
+    print_report(report)
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+    print("="*100)
+    print("SUCCESS: All models generated!")
+    print("="*100)
+
+if __name__ == "__main__":
+    main()
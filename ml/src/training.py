@@ -0,0 +1,325 @@
+"""
+Out-of-core, multi-process training of the efficiency and suitability models
+
+The combined dataset is never loaded whole. A first pass over its chunks
+fits the TableEncoder (numeric columns and the categories of text columns,
+see features.py); every model then reads the chunks again through an
+xgboost.DataIter that encodes them straight into float32 matrices. The iterator
+feeds a QuantileDMatrix (quantized data in memory, roughly one byte per
+value) or an ExtMemQuantileDMatrix (pages cached on disk).
+
+Both models train at the same time in separate processes, each with its
+own thread budget, and every stage is timed and its memory use reported.
+Used by train_ml.py --out-of-core.
+"""
+
+import itertools
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from dataio import iter_table, read_columns
+from features import ENCODER_FILE, TableEncoder
+from tree_engine import compile_booster, tables_path
+
+ID_COLUMNS = ('panel_id', 'timestamp')
+LABEL_SOURCE = 'Label (Yes/No)'
+LABEL_MAP = {'Yes': 1, 'No': 0, 'yes': 1, 'no': 0}
+TARGETS = ('efficiency', 'Label')
+
+# Hyperparameters of both models, as XGBRegressor / XGBClassifier arguments.
+# train_ml.py --params replaces them with values picked from a tuning report.
+DEFAULT_PARAMS = {
+    'efficiency': {'n_estimators': 300, 'learning_rate': 0.1, 'max_depth': 5, 'objective': 'reg:squarederror'},
+    'suitability': {'n_estimators': 100, 'learning_rate': 0.1, 'max_depth': 4, 'objective': 'binary:logistic'}
+}
+MODEL_TARGETS = {'efficiency': 'efficiency', 'suitability': 'Label'}
+
+def label_columns(columns):
+    """Every column named like a label; none of them is used as a feature"""
+    return [c for c in columns if 'label' in c.lower()]
+
+def label_column(columns):
+    """
+    Column holding the Yes/No suitability label
+
+    LABEL_SOURCE if present, otherwise the first column named like a label
+    (casing and naming differ between dataset versions), or None.
+    """
+    columns = list(columns)
+    if LABEL_SOURCE in columns:
+        return LABEL_SOURCE
+    candidates = label_columns(columns)
+    return candidates[0] if candidates else None
+
+def encode_labels(values):
+    """Yes/No label values as 1/0 (NaN for anything else)"""
+    return values.astype(object).map(LABEL_MAP)
+
+def native_params(params, seed=42):
+    """
+    Split sklearn-style parameters into xgboost.train params and the round count
+
+    Returns:
+        (params dict, num_boost_round)
+    """
+    params = dict(params)
+    rounds = params.pop('n_estimators', 100)
+    if 'learning_rate' in params:
+        params['eta'] = params.pop('learning_rate')
+    params['seed'] = params.pop('random_state', seed)
+    return params, rounds
+
+def peak_rss_mb():
+    """Peak resident memory of this process so far, in MB"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def scan_encoder(path, chunksize=100_000):
+    """
+    Fit a TableEncoder over a dataset file in chunks
+
+    The first chunk decides which columns are numeric; the rest of the file
+    is then read for its text columns only.
+    """
+    columns = [c for c in read_columns(path) if c not in ID_COLUMNS]
+    first = next(iter_table(path, chunksize, columns))
+    exclude = tuple(label_columns(columns)) + TARGETS
+    text = [c for c in columns if c not in exclude and not pd.api.types.is_numeric_dtype(first[c])]
+    # Rereading the first chunk's rows for their categories is harmless
+    rest = iter_table(path, chunksize, text) if text else iter(())
+    return TableEncoder.fit(itertools.chain([first], rest), exclude=exclude)
+
+def encode_targets(chunk):
+    """Training targets of one chunk as float32 arrays"""
+    targets = {'efficiency': chunk['efficiency'].to_numpy(dtype=np.float32)}
+    label = label_column(chunk.columns)
+    if label is not None:
+        targets['Label'] = encode_labels(chunk[label]).to_numpy(dtype=np.float32)
+    return targets
+
+def split_mask(start, n, test_size=0.2, seed=42):
+    """Test-set membership for rows [start, start + n), fixed per chunk position"""
+    return np.random.default_rng([seed, start]).random(n) < test_size
+
+class ChunkIterator:
+    """
+    Encoded (X, y) batches of one split of a dataset file
+
+    Args:
+        path: Dataset file or directory
+        encoder: Fitted TableEncoder
+        target: Target name in TARGETS
+        subset: "train" or "test"
+        chunksize, test_size, seed: Chunking and split parameters; must match
+            between the train and test iterators
+    """
+
+    def __init__(self, path, encoder, target, subset, chunksize=100_000, test_size=0.2, seed=42):
+        self.path = path
+        self.encoder = encoder
+        columns = read_columns(path)
+        self.columns = encoder.input_columns + [c for c in ('efficiency', label_column(columns)) if c in columns]
+        self.target = target
+        self.subset = subset
+        self.chunksize = chunksize
+        self.test_size = test_size
+        self.seed = seed
+
+    def __iter__(self):
+        start = 0
+        for chunk in iter_table(self.path, self.chunksize, self.columns):
+            is_test = split_mask(start, len(chunk), self.test_size, self.seed)
+            start += len(chunk)
+            keep = is_test if self.subset == 'test' else ~is_test
+            if not keep.any():
+                continue
+            chunk = chunk[keep]
+            yield self.encoder.transform(chunk), encode_targets(chunk)[self.target]
+
+def make_data_iter(batches, feature_names, cache_prefix=None):
+    """Wrap a ChunkIterator in an xgboost.DataIter"""
+    import xgboost as xgb
+
+    class _DataIter(xgb.DataIter):
+        def __init__(self):
+            self._it = None
+            super().__init__(cache_prefix=cache_prefix)
+
+        def next(self, input_data):
+            if self._it is None:
+                self._it = iter(batches)
+            batch = next(self._it, None)
+            if batch is None:
+                return False
+            input_data(data=batch[0], label=batch[1], feature_names=feature_names)
+            return True
+
+        def reset(self):
+            self._it = None
+
+    return _DataIter()
+
+def evaluate(booster, batches, objective):
+    """Streaming test metrics: R² and MAE for regression, accuracy for classification"""
+    n = sse = sae = total = total_sq = correct = 0.0
+    for X, y in batches:
+        pred = booster.inplace_predict(X)
+        y = y.astype(np.float64)
+        n += len(y)
+        if objective.startswith('binary'):
+            correct += np.sum((pred > 0.5) == (y > 0.5))
+        else:
+            sse += np.sum((y - pred) ** 2)
+            sae += np.sum(np.abs(y - pred))
+            total += y.sum()
+            total_sq += np.sum(y ** 2)
+    if not n:
+        return {}
+    if objective.startswith('binary'):
+        return {"accuracy": correct / n, "test_rows": int(n)}
+    sst = total_sq - total ** 2 / n
+    return {"r2": 1 - sse / sst if sst else 0.0, "mae": sae / n, "test_rows": int(n)}
+
+def fit_model(name, path, encoder, output_dir, nthread, matrix='quantile', chunksize=100_000, max_bin=256,
+              model_params=None):
+    """
+    Build the training matrix, train, evaluate and save one model
+
+    Runs in a worker process.
+
+    Returns:
+        Report dictionary with per-stage seconds, metrics and peak RSS
+    """
+    import xgboost as xgb
+
+    target = MODEL_TARGETS[name]
+    xgb_params, rounds = native_params(model_params or DEFAULT_PARAMS[name])
+    timings = {}
+    cache_dir = tempfile.mkdtemp(prefix=f"xgb_{name}_") if matrix == 'external' else None
+
+    start = time.perf_counter()
+    train = ChunkIterator(path, encoder, target, 'train', chunksize)
+    if matrix == 'external':
+        data_iter = make_data_iter(train, encoder.feature_columns, os.path.join(cache_dir, 'cache'))
+        dtrain = xgb.ExtMemQuantileDMatrix(data_iter, max_bin=max_bin, nthread=nthread)
+    else:
+        data_iter = make_data_iter(train, encoder.feature_columns)
+        dtrain = xgb.QuantileDMatrix(data_iter, max_bin=max_bin, nthread=nthread)
+    timings['build_matrix'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    params = dict(xgb_params, tree_method='hist', max_bin=max_bin, nthread=nthread)
+    booster = xgb.train(params, dtrain, num_boost_round=rounds)
+    timings['train'] = time.perf_counter() - start
+    del dtrain, data_iter
+
+    start = time.perf_counter()
+    booster.set_param({'nthread': nthread})
+    metrics = evaluate(booster, ChunkIterator(path, encoder, target, 'test', chunksize), xgb_params['objective'])
+    timings['evaluate'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    ubj_path = os.path.join(output_dir, f"{name}_model.ubj")
+    booster.save_model(ubj_path)
+    # Keep the pickled sklearn wrapper the app falls back to
+    model = xgb.XGBClassifier() if name == 'suitability' else xgb.XGBRegressor()
+    model.load_model(ubj_path)
+    joblib.dump(model, os.path.join(output_dir, f"{name}_model.pkl"))
+    compile_booster(booster).save(tables_path(output_dir, f"{name}_model"))
+    timings['save'] = time.perf_counter() - start
+
+    if cache_dir:
+        import shutil
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    return {"model": name, "nthread": nthread, "stages": timings, "metrics": metrics,
+            "peak_rss_mb": round(peak_rss_mb(), 1)}
+
+def thread_budgets(threads, processes):
+    """Split a thread budget between the two models (efficiency gets the larger share)"""
+    if processes == 1:
+        return {name: threads for name in DEFAULT_PARAMS}
+    eff = max(1, (threads + 1) // 2)
+    return {'efficiency': eff, 'suitability': max(1, threads - eff)}
+
+def train_out_of_core(path, output_dir='.', matrix='quantile', chunksize=100_000, threads=None, processes=2,
+                      max_bin=256, encoder=None, params=None):
+    """
+    Train both models from a dataset file without loading it into memory
+
+    Args:
+        path: Combined dataset (file or partition directory)
+        output_dir: Where the model artifacts are written
+        matrix: "quantile" (QuantileDMatrix) or "external" (ExtMemQuantileDMatrix)
+        chunksize: Rows read per chunk
+        threads: Total thread budget (default: all CPUs)
+        processes: 2 trains the models concurrently, 1 one after the other
+        encoder: Existing TableEncoder to keep the feature layout stable; by
+            default one is fitted on the dataset
+        params: {model name: sklearn-style parameters} overriding DEFAULT_PARAMS
+
+    Raises:
+        ValueError: If the dataset has no label column or does not match the given encoder
+
+    Returns:
+        Report dictionary: wall time, encoder scan time and one entry per model
+    """
+    wall = time.perf_counter()
+    threads = threads or os.cpu_count()
+
+    columns = read_columns(path)
+    label = label_column(columns)
+    if label is None:
+        raise ValueError("No label column found")
+    if label != LABEL_SOURCE:
+        print(f"Warning: '{LABEL_SOURCE}' column not found. Using '{label}' as label.")
+
+    start = time.perf_counter()
+    if encoder is None:
+        encoder = scan_encoder(path, chunksize)
+    else:
+        encoder.check_columns(columns, exclude=ID_COLUMNS + tuple(label_columns(columns)) + TARGETS)
+    scan_seconds = time.perf_counter() - start
+
+    budgets = thread_budgets(threads, processes)
+    # Spawned workers start without the parent's reader threads or heap
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=processes, mp_context=context) as pool:
+        futures = [pool.submit(fit_model, name, path, encoder, output_dir, budgets[name], matrix, chunksize, max_bin,
+                               (params or {}).get(name))
+                   for name in DEFAULT_PARAMS]
+        models = [future.result() for future in futures]
+
+    # The column layout is saved once both models exist
+    encoder.save(os.path.join(output_dir, ENCODER_FILE))
+    joblib.dump(encoder.feature_columns, os.path.join(output_dir, "feature_columns.pkl"))
+    joblib.dump(encoder.feature_columns, os.path.join(output_dir, "site_feature_columns.pkl"))
+
+    return {
+        "wall_seconds": time.perf_counter() - wall,
+        "encoder_scan_seconds": scan_seconds,
+        "features": len(encoder.feature_columns),
+        "matrix": matrix,
+        "threads": threads,
+        "processes": processes,
+        "parent_peak_rss_mb": round(peak_rss_mb(), 1),
+        "models": models
+    }
+
+def print_report(report):
+    """Human-readable training report"""
+    print(f"\nWall time: {report['wall_seconds']:.1f}s  (encoder scan {report['encoder_scan_seconds']:.1f}s, "
+          f"{report['features']} features, {report['matrix']} matrix, {report['threads']} threads, "
+          f"{report['processes']} process(es))")
+    print(f"Parent peak RSS: {report['parent_peak_rss_mb']:.0f} MB")
+    for model in report['models']:
+        stages = "  ".join(f"{stage} {seconds:.1f}s" for stage, seconds in model['stages'].items())
+        metrics = "  ".join(f"{k} {v:.4f}" if isinstance(v, float) else f"{k} {v:,}" for k, v in model['metrics'].items())
+        print(f"  {model['model']:<12} nthread {model['nthread']:<3} peak RSS {model['peak_rss_mb']:>7.0f} MB  "
+              f"{stages}\n  {'':<12} {metrics}")
@@ -0,0 +1,480 @@
+"""
+Pure-NumPy inference for the efficiency and suitability boosters
+
+export_models() flattens each trained booster into array-backed tree tables
+(split feature, threshold, child index, default direction, leaf value, cover) and
+saves them next to the other artifacts as efficiency_model.npz and
+suitability_model.npz. TreeEnsemble evaluates a whole batch against every
+tree at once, one tree level per step, so a prediction is a handful of NumPy
+gathers instead of a call into XGBoost. With MODEL_BACKEND=compiled the
+model registry serves these tables and needs neither xgboost nor the
+pickled sklearn wrappers.
+
+train_ml.py exports the tables after training. To export existing models and
+check them against model_eff.predict / model_site.predict (from ml/src):
+
+    python tree_engine.py
+    python tree_engine.py --check-only --rows 50000
+
+tests/test_tree_engine.py runs the same check against freshly trained models.
+"""
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+MODEL_NAMES = ("efficiency_model", "suitability_model")
+# Column lists saved by train_ml.py, for boosters trained without feature names
+COLUMN_FILES = {"efficiency_model": "feature_columns.pkl", "suitability_model": "site_feature_columns.pkl"}
+SUPPORTED_OBJECTIVES = ("reg:squarederror", "binary:logistic")
+
+# Rows evaluated per step: the (rows x trees) working arrays of a small block
+# stay in cache, which beats fewer, larger NumPy calls
+BLOCK_ROWS = 64
+
+# Largest differences from XGBoost accepted by check_parity (float32 rounding)
+PARITY_TOLERANCE = {'max_abs_diff': 1e-5, 'max_contribution_diff': 1e-4}
+
+def tables_path(model_dir, name):
+    """Compiled tree tables of a model artifact name (e.g. "efficiency_model")"""
+    return os.path.join(model_dir, f"{name}.npz")
+
+class TreeEnsemble:
+    """
+    Gradient-boosted trees as flat node arrays
+
+    Nodes of all trees are concatenated, each tree in breadth-first order so
+    the two children of a node are adjacent: a row at node i moves to
+    child[i] + (x >= threshold[i]). Leaves have a NaN threshold (every
+    comparison is false) and are their own child, so walking max_depth levels
+    from the roots leaves every row on a leaf whatever the depth of its tree.
+
+    Args:
+        feature: Split feature index per node (0 for leaves)
+        threshold: Split threshold per node (float32); rows go left when x < threshold
+        child: Index of the left child per node; the right child follows it
+        default_left: Direction of missing (NaN) values per node (True for leaves)
+        value: Leaf value per node (0 for internal nodes)
+        cover: Training cover (sum of hessians) per node, for contributions()
+        roots: Root node index per tree
+        base_score: XGBoost base_score (a probability for binary:logistic)
+        objective: "reg:squarederror" or "binary:logistic"
+        feature_names: Column order the model was trained with
+        digest: suitability_grid.model_digest of the booster the tables came from
+    """
+
+    def __init__(self, feature, threshold, child, default_left, value, cover, roots, base_score,
+                 objective, feature_names, digest=None):
+        # Index arrays are kept as intp so gathers don't convert them on every call
+        self.feature = np.asarray(feature, dtype=np.intp)
+        self.threshold = np.asarray(threshold, dtype=np.float32)
+        self.child = np.asarray(child, dtype=np.intp)
+        self.default_left = np.asarray(default_left, dtype=bool)
+        self.value = np.asarray(value, dtype=np.float32)
+        self.cover = np.asarray(cover, dtype=np.float32)
+        self.roots = np.asarray(roots, dtype=np.intp)
+        self.base_score = float(base_score)
+        self.objective = str(objective)
+        self.feature_names = [str(name) for name in feature_names]
+        self.digest = digest
+        if self.objective not in SUPPORTED_OBJECTIVES:
+            raise ValueError(f"Unsupported objective '{self.objective}'")
+        self.depth = self._depth()
+        base = np.float32(self.base_score)
+        if self.objective == 'binary:logistic':
+            base = -np.log(np.float32(1) / base - np.float32(1))
+        self.base_margin = np.float32(base)
+        self._leaf_paths = None
+
+    def _depth(self):
+        """Number of levels below the deepest root"""
+        depth = 0
+        level = self.roots
+        while True:
+            inner = level[self.child[level] != level]
+            if not len(inner):
+                return depth
+            level = np.concatenate([self.child[inner], self.child[inner] + 1])
+            depth += 1
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    @property
+    def n_features_in_(self):
+        return len(self.feature_names)
+
+    @property
+    def nbytes(self):
+        """Memory held by the node arrays"""
+        return sum(a.nbytes for a in (self.feature, self.threshold, self.child, self.default_left,
+                                      self.value, self.cover, self.roots))
+
+    def _rows(self, X):
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.n_features_in_:
+            raise ValueError(f"Expected {self.n_features_in_} features, got shape {X.shape}")
+        return X
+
+    def _walk(self, block):
+        """
+        Yield (node, next node, split value offset) per tree level
+
+        The arrays are flat and tree-major (entry t * n_rows + r is tree t for
+        row r); the offset of the split feature's value indexes block.ravel().
+        """
+        n_rows, n_features = block.shape
+        flat = block.ravel()
+        row_offsets = np.tile(np.arange(n_rows, dtype=np.intp) * n_features, self.n_trees)
+        has_missing = np.isnan(flat).any()
+        node = np.repeat(self.roots, n_rows)
+        for _ in range(self.depth):
+            offset = row_offsets + self.feature.take(node)
+            x = flat.take(offset)
+            go_right = x >= self.threshold.take(node)
+            if has_missing:
+                go_right = np.where(np.isnan(x), ~self.default_left.take(node), go_right)
+            next_node = self.child.take(node) + go_right
+            yield node, next_node, offset
+            node = next_node
+
+    def _leaves(self, block):
+        node = np.repeat(self.roots, len(block))
+        for _, node, _ in self._walk(block):
+            pass
+        return node.reshape(self.n_trees, len(block))
+
+    def leaves(self, X):
+        """Leaf node index of every row in every tree, shape (n_rows, n_trees)"""
+        return self._leaves(self._rows(X)).T
+
+    def predict_margin(self, X):
+        """Raw scores (before the logistic link), float32"""
+        X = self._rows(X)
+        out = np.empty(len(X), dtype=np.float32)
+        for start in range(0, len(X), BLOCK_ROWS):
+            block = X[start:start + BLOCK_ROWS]
+            # Add the trees in order, in float32, starting from the base margin (as XGBoost does)
+            scores = np.empty((self.n_trees + 1, len(block)), dtype=np.float32)
+            scores[0] = self.base_margin
+            scores[1:] = self.value.take(self._leaves(block))
+            out[start:start + BLOCK_ROWS] = np.cumsum(scores, axis=0)[-1]
+        return out
+
+    def predict(self, X):
+        """Regression values, or 0/1 labels for binary:logistic (as XGBRegressor/XGBClassifier.predict)"""
+        if self.objective == 'binary:logistic':
+            return (self.predict_proba(X)[:, 1] > 0.5).astype(np.int64)
+        return self.predict_margin(X)
+
+    def predict_proba(self, X):
+        """Class probabilities, shape (n_rows, 2)"""
+        if self.objective != 'binary:logistic':
+            raise AttributeError("predict_proba is only available for binary:logistic models")
+        margin = self.predict_margin(X)
+        positive = np.float32(1) / (np.float32(1) + np.exp(-margin))
+        return np.stack([1 - positive, positive], axis=1)
+
+    def contributions(self, X):
+        """
+        TreeSHAP values of the raw score (n_rows x n_features), without the bias term
+
+        The same path-dependent SHAP values as XGBoost's pred_contribs=True.
+        Every leaf's share is looked up in a table indexed by which of the
+        conditions on its path a row satisfies (see LeafPaths).
+        """
+        X = self._rows(X)
+        paths = self.leaf_paths()
+        out = np.empty(X.shape, dtype=np.float32)
+        n_features = X.shape[1]
+        limit = np.finfo(np.float32).max
+        leaf_index = np.arange(len(paths.value))[:, None]
+        # Each leaf touches paths.width features, so fewer rows fit in a block
+        block_rows = max(1, BLOCK_ROWS // 4)
+        for start in range(0, len(X), block_rows):
+            # Clip infinities so the unbounded (+/-inf) path limits still hold
+            block = np.clip(X[start:start + block_rows], -limit, limit)
+            x = block[:, paths.feature]  # (rows, leaves, width)
+            on = ((x >= paths.low) & (x < paths.high)) | (np.isnan(x) & paths.missing)
+            mask = (on.astype(np.intp) << paths.bits).sum(axis=2)
+            shares = paths.table[leaf_index, mask[:, :, None], paths.bits]
+            offsets = np.arange(len(block))[:, None, None] * n_features + paths.feature
+            out[start:start + len(block)] = np.bincount(offsets.ravel(), shares.ravel(),
+                                                        minlength=block.size).reshape(block.shape)
+        return out
+
+    def leaf_paths(self):
+        """LeafPaths of this ensemble, built on first use (only explanations need them)"""
+        if self._leaf_paths is None:
+            # Concurrent first calls build identical tables; either may win
+            self._leaf_paths = LeafPaths(self)
+        return self._leaf_paths
+
+    def save(self, path):
+        np.savez(path, feature=self.feature, threshold=self.threshold, child=self.child,
+                 default_left=self.default_left, value=self.value, cover=self.cover, roots=self.roots,
+                 base_score=np.asarray(self.base_score), objective=np.asarray(self.objective),
+                 feature_names=np.asarray(self.feature_names), digest=np.asarray(self.digest or ''))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['feature'], data['threshold'], data['child'], data['default_left'], data['value'],
+                       data['cover'], data['roots'], data['base_score'], str(data['objective']),
+                       data['feature_names'].tolist(), str(data['digest']) or None)
+
+class LeafPaths:
+    """
+    Per-leaf SHAP tables of a TreeEnsemble
+
+    Within one tree, path-dependent TreeSHAP only depends on the features on
+    the path to each leaf. A row either satisfies all conditions on a
+    feature along that path (the feature's value range, or the default
+    direction for missing values) or not, so a leaf's contribution to each of
+    its (at most depth) features is one of 2**width precomputed entries.
+
+    Attributes (leaves x width, padded with always-satisfied slots on feature 0):
+        feature: Feature of each path slot
+        low, high: Range of values satisfying the slot's conditions (low <= x < high)
+        missing: Whether a missing value satisfies them
+        table: Contribution per leaf, satisfied-slot bitmask and slot
+    """
+
+    def __init__(self, ensemble):
+        leaves = []  # (leaf value, {feature: [low, high, missing, zero fraction]})
+        for root in ensemble.roots:
+            stack = [(int(root), {})]
+            while stack:
+                node, conditions = stack.pop()
+                left = int(ensemble.child[node])
+                if left == node:
+                    leaves.append((float(ensemble.value[node]), conditions))
+                    continue
+                feature, threshold = int(ensemble.feature[node]), float(ensemble.threshold[node])
+                default_left = bool(ensemble.default_left[node])
+                for child, go_left in ((left, True), (left + 1, False)):
+                    low, high, missing, zero = conditions.get(feature, (-np.inf, np.inf, True, 1.0))
+                    if go_left:
+                        high = min(high, threshold)
+                    else:
+                        low = max(low, threshold)
+                    fraction = float(ensemble.cover[child]) / float(ensemble.cover[node])
+                    stack.append((child, {**conditions, feature: (low, high, missing and default_left == go_left,
+                                                                  zero * fraction)}))
+
+        self.width = width = max([len(c) for _, c in leaves] + [1])
+        n = len(leaves)
+        self.value = np.array([v for v, _ in leaves])
+        self.feature = np.zeros((n, width), dtype=np.intp)
+        self.low = np.full((n, width), -np.inf, dtype=np.float32)
+        self.high = np.full((n, width), np.inf, dtype=np.float32)
+        self.missing = np.ones((n, width), dtype=bool)
+        zero = np.ones((n, width))
+        sizes = np.array([len(c) for _, c in leaves])
+        for i, (_, conditions) in enumerate(leaves):
+            for slot, (feature, (low, high, missing, fraction)) in enumerate(sorted(conditions.items())):
+                self.feature[i, slot] = feature
+                self.low[i, slot], self.high[i, slot] = low, high
+                self.missing[i, slot] = missing
+                zero[i, slot] = fraction
+        self.bits = np.arange(width)
+
+        # Shapley weights |S|! (k - |S| - 1)! / k!
+        factorial = [float(np.prod(np.arange(1, m + 1))) for m in range(width + 1)]
+        self.table = np.zeros((n, 2 ** width, width), dtype=np.float32)
+        for k in range(1, width + 1):
+            rows = np.flatnonzero(sizes == k)
+            if not len(rows):
+                continue
+            z, v = zero[rows, :k], self.value[rows]
+            table = np.zeros((len(rows), 2 ** k, k))
+            for mask in range(2 ** k):
+                for i in range(k):
+                    others = [j for j in range(k) if j != i]
+                    total = np.zeros(len(rows))
+                    # Subsets S of the other satisfied slots; unsatisfied slots contribute only outside S
+                    satisfied = [j for j in others if mask >> j & 1]
+                    for subset in range(2 ** len(satisfied)):
+                        chosen = {satisfied[b] for b in range(len(satisfied)) if subset >> b & 1}
+                        weight = factorial[len(chosen)] * factorial[k - len(chosen) - 1] / factorial[k]
+                        total += weight * np.prod(z[:, [j for j in others if j not in chosen]], axis=1)
+                    table[:, mask, i] = v * ((mask >> i & 1) - z[:, i]) * total
+            # Padding slots are always satisfied, so only the low k bits select the entry
+            self.table[rows, :, :k] = table[:, np.arange(2 ** width) % (2 ** k)]
+
+def _flatten_tree(tree, offset):
+    """
+    Node arrays of one tree from XGBoost's JSON model, renumbered breadth-first
+
+    Returns:
+        (feature, threshold, child, default_left, value, cover) lists, node ids starting at offset
+    """
+    left, right = tree['left_children'], tree['right_children']
+    conditions = tree['split_conditions']
+
+    order = [0]
+    for node in order:
+        if left[node] != -1:
+            order += [left[node], right[node]]
+    position = {node: offset + i for i, node in enumerate(order)}
+
+    nodes = ([], [], [], [], [], [])
+    for node in order:
+        leaf = left[node] == -1
+        for column, value in zip(nodes, (
+                0 if leaf else tree['split_indices'][node],
+                np.nan if leaf else conditions[node],
+                position[node] if leaf else position[left[node]],
+                True if leaf else bool(tree['default_left'][node]),
+                conditions[node] if leaf else 0.0,
+                tree['sum_hessian'][node])):
+            column.append(value)
+    return nodes
+
+def compile_booster(booster, feature_names=None):
+    """
+    Flatten an xgboost.Booster into a TreeEnsemble
+
+    Args:
+        booster: Trained xgboost.Booster
+        feature_names: Column order, if the booster does not store it
+
+    Raises:
+        ValueError: For models the engine cannot evaluate (other objectives,
+            multi-output models, categorical splits)
+    """
+    from suitability_grid import model_digest
+
+    model = json.loads(bytes(booster.save_raw('json')))['learner']
+    objective = model['objective']['name']
+    param = model['learner_model_param']
+    if int(param.get('num_class', 0)) > 1 or int(param.get('num_target', 1)) > 1:
+        raise ValueError("Multi-output models are not supported")
+    base_score = float(param['base_score'].strip('[]'))
+
+    columns = ([], [], [], [], [], [])
+    roots = []
+    for tree in model['gradient_booster']['model']['trees']:
+        if tree.get('categories_nodes'):
+            raise ValueError("Categorical splits are not supported")
+        roots.append(len(columns[0]))
+        for column, values in zip(columns, _flatten_tree(tree, roots[-1])):
+            column.extend(values)
+
+    feature_names = booster.feature_names or feature_names
+    if feature_names is None or len(feature_names) != int(param['num_feature']):
+        raise ValueError("Feature names are missing or do not match the booster")
+    return TreeEnsemble(*columns, roots=roots, base_score=base_score, objective=objective,
+                        feature_names=feature_names, digest=model_digest(booster))
+
+def export_models(model_dir='.'):
+    """
+    Compile both models in model_dir and save their tree tables
+
+    Returns:
+        {artifact name: TreeEnsemble}
+    """
+    import joblib
+    from model_registry import load_model
+
+    compiled = {}
+    for name in MODEL_NAMES:
+        columns = joblib.load(os.path.join(model_dir, COLUMN_FILES[name]))
+        ensemble = compile_booster(load_model(model_dir, name).get_booster(), columns)
+        ensemble.save(tables_path(model_dir, name))
+        compiled[name] = ensemble
+    return compiled
+
+def check_parity(model, ensemble, X, explain_rows=500):
+    """
+    Compare a TreeEnsemble with the XGBoost model it was compiled from
+
+    Returns:
+        Dictionary with the largest absolute prediction and SHAP contribution
+        differences, the number of differing labels (classifiers) and both
+        models' timings
+    """
+    import xgboost as xgb
+
+    start = time.perf_counter()
+    expected = model.predict(X)
+    xgb_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    actual = ensemble.predict(X)
+    numpy_seconds = time.perf_counter() - start
+
+    report = {"rows": len(X), "xgboost_seconds": xgb_seconds, "numpy_seconds": numpy_seconds}
+    if ensemble.objective == 'binary:logistic':
+        report["label_mismatches"] = int(np.sum(expected != actual))
+        report["max_abs_diff"] = float(np.max(np.abs(model.predict_proba(X)[:, 1] - ensemble.predict_proba(X)[:, 1])))
+    else:
+        report["max_abs_diff"] = float(np.max(np.abs(expected - actual)))
+
+    sample = X[:explain_rows]
+    # Boosters trained by train_ml.py validate feature names; the legacy pickles have none
+    matrix = xgb.DMatrix(sample, feature_names=ensemble.feature_names)
+    contribs = model.get_booster().predict(matrix, pred_contribs=True)[:, :-1]
+    report["max_contribution_diff"] = float(np.max(np.abs(contribs - ensemble.contributions(sample))))
+    return report
+
+def parity_passed(report):
+    """Whether a check_parity report is within PARITY_TOLERANCE"""
+    return (report['max_abs_diff'] <= PARITY_TOLERANCE['max_abs_diff']
+            and report['max_contribution_diff'] <= PARITY_TOLERANCE['max_contribution_diff']
+            and report.get('label_mismatches', 0) == 0)
+
+def _parity_rows(encoder, dataset, rows, seed=42):
+    """Encoded dataset rows plus copies with missing values, to cover every branch direction"""
+    from dataio import iter_table
+
+    X = encoder.transform(next(iter_table(dataset, rows, encoder.input_columns)))
+    holes = X[:min(len(X), 2000)].copy()
+    holes[np.random.default_rng(seed).random(holes.shape) < 0.2] = np.nan
+    return np.concatenate([X, holes])
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile the boosters to NumPy tree tables and check parity")
+    parser.add_argument('--model-dir', default=os.path.dirname(os.path.abspath(__file__)))
+    parser.add_argument('--dataset', default='solar_panel_combined_dataset.csv')
+    parser.add_argument('--rows', type=int, default=20000, help="Dataset rows used for the parity check")
+    parser.add_argument('--check-only', action='store_true', help="Check existing tables without exporting")
+    args = parser.parse_args()
+
+    from dataio import find_dataset
+    from features import ENCODER_FILE, TableEncoder
+    from model_registry import load_model
+    from suitability_grid import model_digest
+
+    if args.check_only:
+        compiled = {name: TreeEnsemble.load(tables_path(args.model_dir, name)) for name in MODEL_NAMES}
+    else:
+        start = time.perf_counter()
+        compiled = export_models(args.model_dir)
+        print(f"Exported {', '.join(f'{name}.npz' for name in MODEL_NAMES)} in {time.perf_counter() - start:.2f}s")
+
+    encoder = TableEncoder.load(os.path.join(args.model_dir, ENCODER_FILE))
+    X = _parity_rows(encoder, find_dataset(args.dataset), args.rows)
+    failed = False
+    for name, ensemble in compiled.items():
+        model = load_model(args.model_dir, name)
+        if ensemble.digest != model_digest(model):
+            print(f"{name}: tables were compiled from a different model - run without --check-only")
+            failed = True
+            continue
+        report = check_parity(model, ensemble, X)
+        print(f"{name}: {ensemble.n_trees} trees, depth {ensemble.depth}, {ensemble.nbytes / 1024:.0f} KB; "
+              f"{report['rows']:,} rows, max |diff| {report['max_abs_diff']:.2e}"
+              + (f", label mismatches {report['label_mismatches']}" if 'label_mismatches' in report else "")
+              + f", SHAP max |diff| {report['max_contribution_diff']:.2e}"
+              + f"; xgboost {report['xgboost_seconds'] * 1e3:.1f} ms, numpy {report['numpy_seconds'] * 1e3:.1f} ms")
+        failed |= not parity_passed(report)
+    print("Parity check " + ("FAILED" if failed else "passed"))
+    if failed:
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
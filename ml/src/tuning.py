@@ -0,0 +1,235 @@
+"""
+Hyperparameter search for the efficiency and suitability models
+
+Each model gets a random sample of SEARCH_SPACE plus its current parameters
+(DEFAULT_PARAMS) as a baseline. Trials run in a process pool and stop
+adding trees once the validation score stops improving. Every candidate is
+then scored on the held-out test split and timed the way app.py calls it,
+both for single rows and for batches. Latency is measured one model at a
+time in this process, so parallel trials don't skew it. The report marks the
+Pareto front of score (R² or accuracy) against p50/p99 latency and selects
+the candidate with the cheapest batch predictions within a tolerance of the
+best score.
+
+Used by train_ml.py:
+
+    python train_ml.py --tune --trials 24 --workers 4
+    python train_ml.py --params tuning_report.json
+"""
+
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from sklearn.metrics import accuracy_score, r2_score
+from sklearn.model_selection import train_test_split
+
+from training import DEFAULT_PARAMS
+
+TUNING_REPORT = "tuning_report.json"
+
+SEARCH_SPACE = {
+    'max_depth': [3, 4, 5, 6, 8],
+    'learning_rate': [0.05, 0.1, 0.2, 0.3],
+    'min_child_weight': [1, 5],
+    'subsample': [0.8, 1.0],
+    'colsample_bytree': [0.8, 1.0]
+}
+MAX_ROUNDS = 1000
+EARLY_STOPPING_ROUNDS = 30
+SCORES = {'efficiency': 'r2', 'suitability': 'accuracy'}
+
+# Latency probes: single-row calls as in /predict and fixed-size batches as in /predict/batch
+LATENCY_SINGLE_CALLS = 300
+LATENCY_BATCH_SIZE = 256
+LATENCY_BATCH_CALLS = 50
+
+def sample_trials(n, seed=42):
+    """n distinct parameter sets from SEARCH_SPACE (without n_estimators)"""
+    grid = [dict(zip(SEARCH_SPACE, values)) for values in itertools.product(*SEARCH_SPACE.values())]
+    return random.Random(seed).sample(grid, min(n, len(grid)))
+
+def load_params(path):
+    """
+    Model parameters from a tuning report ("selected") or a {model: params} file
+
+    Returns:
+        {model name: XGBoost parameters}
+    """
+    with open(path) as f:
+        data = json.load(f)
+    params = data.get("selected", data)
+    unknown = set(params) - set(DEFAULT_PARAMS)
+    if unknown:
+        raise ValueError(f"{path}: unknown models {sorted(unknown)}")
+    return {name: dict(p) for name, p in params.items()}
+
+_SPLITS = None
+
+def _init_worker(splits):
+    """Receive the data once per worker instead of once per trial"""
+    global _SPLITS
+    _SPLITS = splits
+
+def run_trial(name, trial_id, params, nthread, early_stopping=True):
+    """
+    Fit one candidate on the train split, stopping on the validation split
+
+    Returns:
+        Trial dictionary with the final parameters (n_estimators set to the
+        number of trees kept), test score, fit time and the model as UBJSON bytes
+    """
+    import xgboost as xgb
+
+    X_train, X_valid, X_test, y_train, y_valid, y_test = _SPLITS[name]
+    cls = xgb.XGBClassifier if name == 'suitability' else xgb.XGBRegressor
+    fit_params = {**DEFAULT_PARAMS[name], **params}
+    if early_stopping:
+        fit_params.update(n_estimators=MAX_ROUNDS, early_stopping_rounds=EARLY_STOPPING_ROUNDS)
+    model = cls(**fit_params, random_state=42, n_jobs=nthread)
+
+    start = time.perf_counter()
+    model.fit(X_train, y_train, eval_set=[(X_valid, y_valid)], verbose=False)
+    fit_seconds = time.perf_counter() - start
+
+    trees = model.best_iteration + 1 if early_stopping else fit_params['n_estimators']
+    # Keep only the trees up to the best iteration, which is what gets deployed
+    booster = model.get_booster()[:trees]
+    prediction = booster.inplace_predict(np.ascontiguousarray(X_test, dtype=np.float32))
+    if name == 'efficiency':
+        score = r2_score(y_test, prediction)
+    else:
+        score = accuracy_score(y_test, (prediction > 0.5).astype(int))
+
+    final_params = {**DEFAULT_PARAMS[name], **params, 'n_estimators': int(trees)}
+    return {
+        "model": name,
+        "trial": trial_id,
+        "baseline": not early_stopping,
+        "params": final_params,
+        "trees": int(trees),
+        "score": float(score),
+        "fit_seconds": fit_seconds,
+        "model_bytes": bytes(booster.save_raw()),
+    }
+
+def percentile_us(seconds, q):
+    return float(np.percentile(seconds, q) * 1e6)
+
+def measure_latency(trial, X):
+    """Single-row and batch predict() latency of a trial's model, in microseconds"""
+    import xgboost as xgb
+
+    model = xgb.XGBClassifier() if trial["model"] == 'suitability' else xgb.XGBRegressor()
+    model.load_model(bytearray(trial["model_bytes"]))
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    rows = [X[i % len(X)][None, :] for i in range(LATENCY_SINGLE_CALLS)]
+    batches = [X[(i * LATENCY_BATCH_SIZE) % len(X):][:LATENCY_BATCH_SIZE] for i in range(LATENCY_BATCH_CALLS)]
+
+    for row in rows[:20]:
+        model.predict(row)  # Warm up
+    single = []
+    for row in rows:
+        start = time.perf_counter()
+        model.predict(row)
+        single.append(time.perf_counter() - start)
+    batch = []
+    for chunk in batches:
+        start = time.perf_counter()
+        model.predict(chunk)
+        batch.append((time.perf_counter() - start) / len(chunk))
+    return {
+        "single_p50_us": percentile_us(single, 50),
+        "single_p99_us": percentile_us(single, 99),
+        "batch_row_p50_us": percentile_us(batch, 50),
+        "batch_row_p99_us": percentile_us(batch, 99)
+    }
+
+# Objectives of the Pareto front: (key, +1 to maximize / -1 to minimize)
+OBJECTIVES = [("score", 1), ("single_p50_us", -1), ("single_p99_us", -1), ("batch_row_p50_us", -1)]
+
+def pareto_front(trials):
+    """Trials no other trial beats on every objective in OBJECTIVES"""
+    def dominates(a, b):
+        better_or_equal = all(sign * a[key] >= sign * b[key] for key, sign in OBJECTIVES)
+        strictly = any(sign * a[key] > sign * b[key] for key, sign in OBJECTIVES)
+        return better_or_equal and strictly
+    return [t for t in trials if not any(dominates(other, t) for other in trials if other is not t)]
+
+def tune(X, y_eff, y_site, trials=24, workers=None, tolerance=0.002, seed=42):
+    """
+    Search both models' hyperparameters
+
+    Args:
+        X, y_eff, y_site: Encoded features and targets (train_ml.load_training_data)
+        trials: Sampled parameter sets per model (the baseline is added on top)
+        workers: Worker processes (default: all CPUs); each trial gets
+            cpu_count // workers threads
+        tolerance: Score margin for the selected (cheapest near-best) candidate
+
+    Returns:
+        Report dictionary: per-model trials with Pareto flags and "selected"
+        parameters in the format train_ml.py --params reads
+    """
+    workers = workers or os.cpu_count()
+    nthread = max(1, os.cpu_count() // workers)
+
+    # Same test split as train_ml.py; the validation split comes out of its training part
+    splits = {}
+    for name, y in (('efficiency', y_eff), ('suitability', y_site)):
+        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+        X_train, X_valid, y_train, y_valid = train_test_split(X_train, y_train, test_size=0.2, random_state=seed)
+        splits[name] = (X_train, X_valid, X_test, y_train, y_valid, y_test)
+
+    jobs = []
+    for name in DEFAULT_PARAMS:
+        jobs.append((name, 0, {}, nthread, False))
+        jobs += [(name, i + 1, params, nthread, True) for i, params in enumerate(sample_trials(trials, seed))]
+
+    start = time.perf_counter()
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                             initargs=(splits,)) as pool:
+        results = list(pool.map(run_trial, *zip(*jobs)))
+    search_seconds = time.perf_counter() - start
+
+    report = {"search_seconds": search_seconds, "workers": workers, "threads_per_trial": nthread,
+              "tolerance": tolerance, "models": {}, "selected": {}}
+    for name in DEFAULT_PARAMS:
+        model_trials = [t for t in results if t["model"] == name]
+        X_probe = splits[name][2]
+        for trial in model_trials:
+            trial.update(measure_latency(trial, X_probe))
+            del trial["model_bytes"]
+        front = pareto_front(model_trials)
+        for trial in model_trials:
+            trial["pareto"] = trial in front
+        best = max(t["score"] for t in model_trials)
+        # Single-row latency is dominated by per-call overhead; the batch cost per row tracks model size
+        selected = min((t for t in front if t["score"] >= best - tolerance), key=lambda t: t["batch_row_p50_us"])
+        report["models"][name] = {"score": SCORES[name], "selected_trial": selected["trial"],
+                                  "trials": sorted(model_trials, key=lambda t: -t["score"])}
+        report["selected"][name] = selected["params"]
+    return report
+
+def print_tuning_report(report):
+    """One table per model; * marks the Pareto front, > the selected trial"""
+    print(f"\nSearch: {report['search_seconds']:.1f}s with {report['workers']} workers "
+          f"x {report['threads_per_trial']} threads")
+    for name, result in report["models"].items():
+        print(f"\n{name} ({result['score']}; latency in us per row)")
+        print(f"  {'trial':>6} {'depth':>5} {'lr':>5} {'mcw':>4} {'sub':>4} {'col':>4} {'trees':>6} "
+              f"{result['score']:>9} {'1-row p50':>10} {'1-row p99':>10} {'batch p50':>10} {'batch p99':>10}")
+        for t in result["trials"]:
+            p = t["params"]
+            mark = ('>' if t["trial"] == result["selected_trial"] else ' ') + ('*' if t["pareto"] else ' ')
+            label = "base" if t["baseline"] else str(t["trial"])
+            print(f"{mark}{label:>6} {p['max_depth']:>5} {p['learning_rate']:>5} {p.get('min_child_weight', 1):>4} "
+                  f"{p.get('subsample', 1.0):>4} {p.get('colsample_bytree', 1.0):>4} {t['trees']:>6} "
+                  f"{t['score']:>9.4f} {t['single_p50_us']:>10.1f} {t['single_p99_us']:>10.1f} "
+                  f"{t['batch_row_p50_us']:>10.2f} {t['batch_row_p99_us']:>10.2f}")
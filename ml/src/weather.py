@@ -0,0 +1,294 @@
+"""
+Server-side weather lookup for /weather and for readings that send lat/lon
+
+WeatherService answers lookups through a pluggable provider:
+
+    stations     nearest station(s) of the local weather table (geo_index.py), no network;
+                 the table has no irradiance, so it is a clear-sky estimate for the
+                 time of the lookup, reduced for the station's cloud cover
+    open-meteo   current conditions from the open-meteo forecast API (WEATHER_API_URL
+                 can point at stub_weather_server.py instead)
+
+Answers are cached per grid cell (coordinates rounded to WEATHER_CELL_DEG)
+and time bucket (WEATHER_TIME_BUCKET seconds), with a TTL and LRU eviction,
+and the provider is always asked for the cell centre, so every point of a
+cell gets the same answer. Concurrent lookups of a cell that is not cached
+share a single upstream fetch. Lookup counts and upstream latency are
+exported on /metrics and summarised in /health.
+"""
+
+import json
+import math
+import os
+import threading
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+import numpy as np
+
+from cache import LRUCache
+from geo_index import WEATHER_FIELDS, WEATHER_STATIONS, WeatherStations
+from metrics import Counter, Histogram
+
+# Configuration
+WEATHER_PROVIDER = os.environ.get('WEATHER_PROVIDER', 'stations')  # 'stations', 'open-meteo' or 'none'
+WEATHER_API_URL = os.environ.get('WEATHER_API_URL', 'https://api.open-meteo.com/v1')
+WEATHER_TIMEOUT = float(os.environ.get('WEATHER_TIMEOUT', 5))  # Seconds per upstream call
+WEATHER_CELL_DEG = float(os.environ.get('WEATHER_CELL_DEG', 0.05))  # ~5 km
+WEATHER_TIME_BUCKET = float(os.environ.get('WEATHER_TIME_BUCKET', 900))  # Seconds
+WEATHER_CACHE_SIZE = int(os.environ.get('WEATHER_CACHE_SIZE', 10000))
+WEATHER_CACHE_TTL = float(os.environ.get('WEATHER_CACHE_TTL', 900))  # Seconds
+WEATHER_K = int(os.environ.get('WEATHER_K', 1))  # Stations averaged by the stations provider
+
+# Reading fields a lookup fills in, in response order
+LOOKUP_FIELDS = WEATHER_FIELDS + ['irradiance']
+
+# Created at import, before the workers fork (see metrics.py)
+WEATHER_LOOKUPS = Counter('solarsense_weather_lookups_total', "Weather lookups by how they were answered",
+                          {'result': ('hit', 'miss', 'coalesced', 'error')})
+WEATHER_UPSTREAM_SECONDS = Histogram('solarsense_weather_upstream_seconds', "Weather provider call time",
+                                     {'provider': ('stations', 'open-meteo')})
+
+def clear_sky_irradiance(lat, lon, when=None, cloudcover=0.0):
+    """
+    Global horizontal irradiance in W/m² from the position of the sun
+
+    Haurwitz clear-sky model at the solar elevation of lat/lon at when (Unix
+    seconds, default now), reduced for cloud cover as in Kasten & Czeplak
+    (1980). 0 while the sun is below the horizon.
+    """
+    t = time.gmtime(when)
+    hours = t.tm_hour + t.tm_min / 60 + t.tm_sec / 3600
+    declination = math.radians(23.45) * math.sin(math.radians(360 / 365 * (284 + t.tm_yday)))
+    hour_angle = math.radians(15 * (hours + lon / 15 - 12))
+    lat = math.radians(lat)
+    cos_zenith = (math.sin(lat) * math.sin(declination)
+                  + math.cos(lat) * math.cos(declination) * math.cos(hour_angle))
+    if cos_zenith <= 0:
+        return 0.0
+    clear_sky = 1098 * cos_zenith * math.exp(-0.057 / cos_zenith)
+    return round(clear_sky * (1 - 0.75 * (cloudcover / 100) ** 3.4), 1)
+
+class WeatherUnavailable(Exception):
+    """The provider could not answer a lookup"""
+
+class StationProvider:
+    """
+    Weather of the nearest stations in a local table
+
+    Args:
+        stations: WeatherStations to answer from
+    """
+    name = 'stations'
+
+    def __init__(self, stations):
+        self.stations = stations
+
+    @classmethod
+    def load(cls, path=WEATHER_STATIONS, k=WEATHER_K):
+        return cls(WeatherStations.load(path, k=k))
+
+    def fetch(self, lat, lon):
+        """Weather fields plus the nearest station and its distance"""
+        values, nearest, distance = self.stations.lookup([lat], [lon])
+        weather = dict(zip(self.stations.fields, values[0].tolist()))
+        if 'irradiance' not in weather:
+            weather['irradiance'] = clear_sky_irradiance(lat, lon, cloudcover=weather.get('cloudcover', 0.0))
+            weather['irradiance_source'] = 'clear-sky estimate'
+        weather['station'] = str(self.stations.names[nearest[0]])
+        weather['distance_km'] = round(float(distance[0]), 1)
+        return weather
+
+class OpenMeteoProvider:
+    """
+    Current conditions from the open-meteo forecast API
+
+    Args:
+        base_url: API root, e.g. https://api.open-meteo.com/v1 or a local stub
+        timeout: Seconds to wait for a response
+    """
+    name = 'open-meteo'
+    # Reading field for each open-meteo "current" variable; irradiance is the
+    # global horizontal (shortwave) radiation in W/m²
+    VARIABLES = {
+        'temperature_2m': 'temperature',
+        'relative_humidity_2m': 'humidity',
+        'cloud_cover': 'cloudcover',
+        'precipitation': 'precip',
+        'wind_speed_10m': 'wind_speed',
+        'shortwave_radiation': 'irradiance'
+    }
+
+    def __init__(self, base_url=WEATHER_API_URL, timeout=WEATHER_TIMEOUT):
+        self.url = base_url.rstrip('/') + '/forecast'
+        self.timeout = timeout
+
+    def fetch(self, lat, lon):
+        query = urllib.parse.urlencode({'latitude': f"{lat:.4f}", 'longitude': f"{lon:.4f}",
+                                        'current': ','.join(self.VARIABLES)})
+        with urllib.request.urlopen(f"{self.url}?{query}", timeout=self.timeout) as response:
+            current = json.load(response)['current']
+        return {field: current[variable] for variable, field in self.VARIABLES.items()
+                if current.get(variable) is not None}
+
+PROVIDERS = {'stations': StationProvider.load, 'open-meteo': OpenMeteoProvider}
+
+class WeatherService:
+    """
+    Cached, coalescing weather lookups through a provider
+
+    Args:
+        provider: Object with a name and fetch(lat, lon) -> dict of weather fields
+        cell_deg: Grid cell size of the cache key in degrees
+        time_bucket: Seconds per time bucket of the cache key
+        cache_size: Number of cached cells
+        cache_ttl: Seconds a cached answer stays valid
+    """
+
+    def __init__(self, provider, cell_deg=WEATHER_CELL_DEG, time_bucket=WEATHER_TIME_BUCKET,
+                 cache_size=WEATHER_CACHE_SIZE, cache_ttl=WEATHER_CACHE_TTL):
+        self.provider = provider
+        self.cell_deg = cell_deg
+        self.time_bucket = time_bucket
+        self.cache = LRUCache(cache_size, ttl=cache_ttl)
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.coalesced = 0
+        self.upstream_calls = 0
+        self.upstream_errors = 0
+        self.upstream_seconds = 0.0
+
+    def cell(self, lat, lon):
+        """Cache key and the centre the provider is asked for"""
+        row, col = int(np.floor(lat / self.cell_deg)), int(np.floor(lon / self.cell_deg))
+        bucket = int(time.time() // self.time_bucket) if self.time_bucket > 0 else 0
+        center = (round((row + 0.5) * self.cell_deg, 6), round((col + 0.5) * self.cell_deg, 6))
+        return (row, col, bucket), center
+
+    def lookup(self, lat, lon):
+        """
+        Weather at a location
+
+        Returns:
+            (weather dict, source dict with provider, cell centre and whether it was cached)
+
+        Raises:
+            ValueError: If lat/lon are not valid coordinates
+            WeatherUnavailable: If the provider failed
+        """
+        try:
+            lat, lon = float(lat), float(lon)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid location: lat={lat!r}, lon={lon!r}")
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            raise ValueError(f"Invalid location: lat={lat!r}, lon={lon!r}")
+
+        key, center = self.cell(lat, lon)
+        self.lookups += 1
+        source = {"provider": self.provider.name, "cell": list(center)}
+        weather = self.cache.get(key)
+        if weather is not None:
+            self.hits += 1
+            WEATHER_LOOKUPS.inc(result='hit')
+            return weather, {**source, "cached": True}
+
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._in_flight[key] = future
+        if not leader:
+            # Another request is fetching this cell; wait for its answer
+            self.coalesced += 1
+            WEATHER_LOOKUPS.inc(result='coalesced')
+            try:
+                return future.result(timeout=WEATHER_TIMEOUT * 2), {**source, "cached": True}
+            except FutureTimeoutError:
+                raise WeatherUnavailable(f"Timed out waiting for the {self.provider.name} lookup")
+
+        start = time.perf_counter()
+        try:
+            weather = self.provider.fetch(*center)
+            self.cache.set(key, weather)
+            future.set_result(weather)
+            WEATHER_LOOKUPS.inc(result='miss')
+            return weather, {**source, "cached": False}
+        except Exception as e:
+            self.upstream_errors += 1
+            WEATHER_LOOKUPS.inc(result='error')
+            error = WeatherUnavailable(f"{self.provider.name} lookup failed: {e}")
+            future.set_exception(error)
+            raise error
+        finally:
+            seconds = time.perf_counter() - start
+            self.upstream_calls += 1
+            self.upstream_seconds += seconds
+            WEATHER_UPSTREAM_SECONDS.observe(seconds, provider=self.provider.name)
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+    def fill(self, readings):
+        """
+        Fill in the weather of readings that send lat/lon
+
+        Readings with lat and lon get every weather field (LOOKUP_FIELDS) they
+        do not provide themselves; readings that already carry all of them are
+        not looked up.
+        A reading whose location is invalid or whose lookup failed is replaced
+        by a ValueError, which encode_batch reports as that row's error.
+
+        Returns:
+            (readings, sources): new readings, and per reading the source of
+            its weather (see lookup, plus provider details such as the
+            station) or None
+        """
+        readings = list(readings)
+        sources = [None] * len(readings)
+        for i, data in enumerate(readings):
+            if not isinstance(data, dict) or data.get('lat') is None or data.get('lon') is None:
+                continue
+            if all(data.get(field) is not None for field in LOOKUP_FIELDS):
+                continue
+            try:
+                weather, source = self.lookup(data['lat'], data['lon'])
+            except (ValueError, WeatherUnavailable) as e:
+                readings[i] = ValueError(str(e))
+                continue
+            filled = {field: value for field, value in weather.items() if field in LOOKUP_FIELDS}
+            filled.update((key, value) for key, value in data.items() if value is not None)
+            readings[i] = filled
+            sources[i] = {**source, **{key: value for key, value in weather.items() if key not in LOOKUP_FIELDS}}
+        return readings, sources
+
+    def stats(self):
+        """Counters for /health"""
+        return {
+            "provider": self.provider.name,
+            "lookups": self.lookups,
+            "hit_rate": round(self.hits / self.lookups, 4) if self.lookups else 0.0,
+            "coalesced": self.coalesced,
+            "upstream_calls": self.upstream_calls,
+            "upstream_errors": self.upstream_errors,
+            "upstream_mean_ms": round(self.upstream_seconds / self.upstream_calls * 1000, 2)
+                                if self.upstream_calls else 0.0,
+            "cache": self.cache.stats()
+        }
+
+def load_weather_service(provider=WEATHER_PROVIDER):
+    """
+    WeatherService for a provider name, or None for 'none'
+
+    Raises:
+        ValueError: For an unknown provider
+        OSError: If the station table cannot be read
+    """
+    if provider == 'none':
+        return None
+    if provider not in PROVIDERS:
+        raise ValueError(f"Unknown WEATHER_PROVIDER '{provider}' (use {', '.join(PROVIDERS)} or none)")
+    return WeatherService(PROVIDERS[provider]())
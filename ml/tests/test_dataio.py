@@ -0,0 +1,34 @@
+"""
+Round trips of typed columns through the Parquet and Arrow writers
+"""
+
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from dataio import TableWriter, read_table, write_table
+
+PANEL_IDS = {
+    'large': [1, 3_000_000_000, 2**40],  # Beyond int32
+    'text': ['PV-001', 'PV-002', 'inverter-7']
+}
+
+def write_chunked(df, path):
+    with TableWriter(path) as sink:
+        sink.write(df.iloc[:2])
+        sink.write(df.iloc[2:])
+
+@pytest.mark.parametrize('ext', ['.parquet', '.feather'])
+@pytest.mark.parametrize('write', [write_table, write_chunked], ids=['write_table', 'TableWriter'])
+@pytest.mark.parametrize('ids', PANEL_IDS.values(), ids=PANEL_IDS.keys())
+def test_panel_ids_round_trip(tmp_path, ext, write, ids):
+    df = pd.DataFrame({'panel_id': ids, 'weather_code': [113, 116, 2**31], 'efficiency': [0.9, 0.8, 0.7]})
+    path = str(tmp_path / f"data{ext}")
+    write(df, path)
+    loaded = read_table(path)
+    assert loaded['panel_id'].tolist() == ids
+    assert loaded['weather_code'].tolist() == [113, 116, 2**31]
@@ -0,0 +1,38 @@
+"""
+Deferred explanations (/explain/<prediction_id>) work from any worker process
+"""
+
+import os
+import sys
+import types
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from app import app, keep_for_explanation
+from model_registry import registry
+from shared_store import SharedStore
+from test_shared_store import in_child
+
+READING = {'temperature': 31, 'humidity': 64, 'irradiance': 720, 'dust_index': 0.4}
+
+def test_explain_prediction_made_by_another_process():
+    ids = SharedStore(1, 32)
+
+    def predict():
+        response = app.test_client().post('/predict?explain=false', json=READING)
+        return response.status_code == 200 and ids.set('id', response.get_json()['prediction_id'])
+
+    assert in_child(predict) == 0
+    client = app.test_client()
+    response = client.get(f"/explain/{ids.get('id').decode()}")
+    assert response.status_code == 200, response.get_json()
+    expected = client.post('/predict', json=READING).get_json()
+    assert response.get_json()['explanation'] == expected['explanation']
+
+def test_explain_after_model_change():
+    bundle = registry.current()
+    row, _ = bundle.encoder.encode(READING)
+    keep_for_explanation('stale', types.SimpleNamespace(version='0' * 12), row, 0.8)
+    response = app.test_client().get('/explain/stale')
+    assert response.status_code == 409
+    assert app.test_client().get('/explain/unknown').status_code == 404
@@ -0,0 +1,38 @@
+"""
+Validation of required reading fields, through the encoder and the endpoints
+"""
+
+import math
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from app import app
+from model_registry import registry
+
+READING = {'temperature': 25, 'humidity': 50, 'irradiance': 800, 'dust_index': 0.2}
+MISSING = {'null': None, 'nan': math.nan, 'nan text': 'NaN', 'infinite': math.inf}
+
+@pytest.fixture
+def client():
+    return app.test_client()
+
+@pytest.mark.parametrize('value', MISSING.values(), ids=MISSING.keys())
+def test_encoder_treats_non_finite_required_fields_as_missing(value):
+    with pytest.raises(ValueError, match=r"Missing required fields: \['temperature'\]"):
+        registry.current().encoder.encode({**READING, 'temperature': value})
+
+def test_predict_rejects_null_required_field(client):
+    response = client.post('/predict', json={**READING, 'temperature': None})
+    assert response.status_code == 400
+    assert "Missing required fields: ['temperature']" in response.get_json()['error']
+
+def test_predict_batch_reports_null_required_field_per_row(client):
+    response = client.post('/predict/batch?explain=false', json=[READING, {**READING, 'irradiance': None}])
+    assert response.status_code == 200
+    results = response.get_json()['results']
+    assert 'predicted_efficiency' in results[0]
+    assert "Missing required fields: ['irradiance']" in results[1]['error']
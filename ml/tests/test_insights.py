@@ -0,0 +1,55 @@
+"""
+LLM insight tokens can be polled from any worker process
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from insights import INSIGHT_LLM_CALLS, InsightService
+from shared_store import SharedStore
+from test_shared_store import in_child
+
+EXPLANATION = {'temperature': -0.05, 'irradiance': 0.08, 'dust_index': -0.01}
+
+class FakeClient:
+    def __init__(self, text=None, error=None):
+        self.text, self.error = text, error
+
+    def complete(self, prompt):
+        if self.error:
+            raise self.error
+        return self.text
+
+def llm_calls(outcome):
+    return INSIGHT_LLM_CALLS._values[INSIGHT_LLM_CALLS._slot({'outcome': outcome}), 0]
+
+def test_token_polled_from_another_process():
+    service = InsightService(FakeClient("Clean the panels."), token_bytes=256)
+    tokens = SharedStore(1, 64)
+
+    def submit():
+        token = service.submit(EXPLANATION, 0.8)["token"]
+        return tokens.set('token', token) and service.result(token, wait=5)["status"] == "ready"
+
+    assert in_child(submit) == 0
+    assert service.result(tokens.get('token').decode()) == {"status": "ready", "text": "Clean the panels.",
+                                                            "source": "llm"}
+    assert service.result('unknown') is None
+
+def test_llm_errors_are_logged_and_counted(caplog, capsys):
+    service = InsightService(FakeClient(error=OSError("connection refused")))
+    errors = llm_calls('error')
+    token = service.submit(EXPLANATION, 0.7)["token"]
+    result = service.result(token, wait=5)
+    assert result["status"] == "failed" and result["source"] == "rules"
+    assert llm_calls('error') == errors + 1
+    assert "connection refused" in caplog.text
+    assert capsys.readouterr().out == ""
+
+def test_oversized_answer_falls_back_to_rules():
+    service = InsightService(FakeClient("x" * 1000), token_bytes=600)
+    token = service.submit(EXPLANATION, 0.9)["token"]
+    result = service.result(token, wait=5)
+    assert result["status"] == "failed" and result["source"] == "rules" and result["text"].startswith("✓")
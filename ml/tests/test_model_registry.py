@@ -0,0 +1,23 @@
+"""
+Reloads requested in one process reach the others through the shared generation
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import app  # noqa: F401 - starts the reload follower
+from model_registry import registry
+from test_shared_store import in_child
+
+def test_reload_broadcast_from_another_process():
+    before = registry.generation
+    finished = registry.reload_status["finished_at"]
+    assert in_child(lambda: registry.broadcast_reload() == before + 1) == 0
+    assert registry.generation == before + 1
+    deadline = time.time() + 10
+    while registry.reload_status["finished_at"] == finished and time.time() < deadline:
+        time.sleep(0.05)
+    assert registry.reload_status["finished_at"] != finished
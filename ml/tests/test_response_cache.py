@@ -0,0 +1,46 @@
+"""
+Cached /predict responses never repeat another request's ids
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import app as app_module
+from response_cache import ResponseCache, SharedBackend
+from shared_store import SharedStore
+from test_shared_store import in_child
+
+READING = {'temperature': 27, 'humidity': 55, 'irradiance': 650, 'dust_index': 0.3}
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(app_module, 'response_cache', ResponseCache(SharedBackend(SharedStore(64, 8192))))
+    return app_module.app.test_client()
+
+def test_cache_hit_gets_its_own_explainable_prediction_id(client):
+    first = client.post('/predict?explain=false', json=READING).get_json()
+    ids = SharedStore(1, 64)
+    assert in_child(lambda: ids.set('id', client.post('/predict?explain=false', json=READING).get_json()['prediction_id'])) == 0
+    second = ids.get('id').decode()
+    assert second != first['prediction_id']
+    response = client.get(f'/explain/{second}')
+    assert response.status_code == 200, response.get_json()
+    assert response.get_json()['explanation'] == client.get(f"/explain/{first['prediction_id']}").get_json()['explanation']
+
+def test_cached_flag_and_ids(client):
+    first = client.post('/predict', json=READING).get_json()
+    second = client.post('/predict', json=READING).get_json()
+    assert (first['cached'], second['cached']) == (False, True)
+    assert first['prediction_id'] != second['prediction_id']
+    assert second['predicted_efficiency'] == first['predicted_efficiency']
+
+def test_pending_insights_are_not_cached(client, monkeypatch):
+    monkeypatch.setattr(app_module.insight_service, 'submit',
+                        lambda explanation, efficiency: {"text": "rules", "source": "rules", "token": "t"})
+    assert client.post('/predict', json=READING).get_json()['insights_token'] == 't'
+    second = client.post('/predict', json=READING).get_json()
+    assert second['cached'] is False and second['insights_token'] == 't'
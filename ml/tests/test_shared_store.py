@@ -0,0 +1,53 @@
+"""
+Shared-memory key-value store, within one process and across a fork
+"""
+
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from shared_store import SharedStore
+
+def in_child(fn):
+    """Run fn in a forked child and return its exit code"""
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            code = 0 if fn() else 1
+        finally:
+            os._exit(code)
+    return os.waitstatus_to_exitcode(os.waitpid(pid, 0)[1])
+
+def test_get_set_delete():
+    store = SharedStore(16, 32)
+    assert store.get('a') is None
+    assert store.set('a', b'one') and store.get('a') == b'one'
+    assert store.set('a', 'two') and store.get('a') == b'two'
+    assert not store.set('b', b'x' * 33)
+    assert store.delete('a', 'b') == 1 and store.get('a') is None
+    with pytest.raises(ValueError):
+        store.get('k' * 65)
+
+def test_expiry_and_eviction():
+    store = SharedStore(4, 8, ways=4)
+    store.set('short', b'1', px=50)
+    time.sleep(0.1)
+    assert store.get('short') is None
+    for i in range(4):
+        store.set(f'key{i}', b'v')
+    store.get('key0')  # Most recently used survives
+    store.set('key4', b'v')
+    assert store.get('key0') == b'v' and store.get('key1') is None
+    assert sorted(store.scan_iter('key*')) == ['key0', 'key2', 'key3', 'key4']
+    assert store.stats()['evictions'] == 1 and store.stats()['expirations'] == 1
+
+def test_values_cross_fork():
+    store = SharedStore(64, 16)
+    store.set('parent', b'p')
+    assert in_child(lambda: store.get('parent') == b'p' and store.set('child', b'c')) == 0
+    assert store.get('child') == b'c'
@@ -0,0 +1,47 @@
+"""
+Parity of the compiled tree tables with freshly trained XGBoost models
+
+Trains both models with train_ml.py into a temporary folder, the same way a
+deployment produces its artifacts (named boosters, .ubj preferred), then
+compares the exported tables against them. Run from the ml folder:
+
+    python -m pytest tests
+"""
+
+import os
+import sys
+
+import pytest
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC)
+
+import train_ml
+from features import ENCODER_FILE, TableEncoder
+from model_registry import load_model
+from suitability_grid import model_digest
+from tree_engine import MODEL_NAMES, TreeEnsemble, _parity_rows, check_parity, parity_passed, tables_path
+
+@pytest.fixture(scope='module')
+def model_dir(tmp_path_factory):
+    path = tmp_path_factory.mktemp('models')
+    dataset = os.path.abspath(os.path.join(SRC, train_ml.DATA_PATH))
+    cwd = os.getcwd()
+    os.chdir(path)  # train_ml.py writes its artifacts to the working directory
+    try:
+        train_ml.DATA_PATH = dataset
+        assert train_ml.train_in_memory()
+    finally:
+        os.chdir(cwd)
+    return str(path)
+
+@pytest.mark.parametrize('name', MODEL_NAMES)
+def test_compiled_tables_match_xgboost(model_dir, name):
+    model = load_model(model_dir, name)
+    ensemble = TreeEnsemble.load(tables_path(model_dir, name))
+    assert ensemble.digest == model_digest(model)
+
+    encoder = TableEncoder.load(os.path.join(model_dir, ENCODER_FILE))
+    X = _parity_rows(encoder, train_ml.DATA_PATH, 2000)
+    report = check_parity(model, ensemble, X)
+    assert parity_passed(report), report
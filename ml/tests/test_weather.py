@@ -0,0 +1,34 @@
+"""
+Weather lookups with the default (stations) provider, end to end through /predict
+"""
+
+import calendar
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from app import app, weather_service
+from weather import LOOKUP_FIELDS, clear_sky_irradiance
+
+SOLSTICE_NOON_UTC = calendar.timegm((2025, 6, 21, 12, 0, 0))
+
+def test_clear_sky_irradiance_follows_the_sun():
+    assert clear_sky_irradiance(23.44, 0, SOLSTICE_NOON_UTC) > 1000  # Sun overhead
+    assert clear_sky_irradiance(23.44, 180, SOLSTICE_NOON_UTC) == 0.0  # Midnight
+    assert clear_sky_irradiance(23.44, 0, SOLSTICE_NOON_UTC, cloudcover=100) < 300
+
+def test_predict_with_location_only():
+    assert weather_service is not None and weather_service.provider.name == 'stations'
+    response = app.test_client().post('/predict?explain=false', json={'lat': 28.61, 'lon': 77.21})
+    assert response.status_code == 200, response.get_json()
+    body = response.get_json()
+    assert 0 <= body['predicted_efficiency'] <= 1
+    assert body['weather_source']['irradiance_source'] == 'clear-sky estimate'
+    assert body['weather_source']['station']
+
+def test_weather_endpoint_fills_every_lookup_field():
+    response = app.test_client().get('/weather?lat=19.07&lon=72.88')
+    assert response.status_code == 200
+    weather = response.get_json()['weather']
+    assert all(weather.get(field) is not None for field in LOOKUP_FIELDS)
@@ -0,0 +1,83 @@
+"""
+State shared between gunicorn workers: deferred explanations, cached responses and model reloads
+"""
+
+import http.client
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+WORKERS = 3
+ADMIN = {'X-Admin-Token': 'test'}
+READING = {'temperature': 25, 'humidity': 50, 'irradiance': 800}
+
+def call(port, method, path, body=None, headers=None):
+    """Request on a fresh connection, so the kernel may hand it to any worker"""
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    connection.request(method, path, body=json.dumps(body) if body is not None else None,
+                       headers={'Content-Type': 'application/json', **(headers or {})})
+    response = connection.getresponse()
+    return response.status, json.loads(response.read())
+
+def fan_out(port, method, path, n=48, body=None, headers=None):
+    """n concurrent requests, to reach every worker"""
+    with ThreadPoolExecutor(16) as pool:
+        return list(pool.map(lambda _: call(port, method, path, body, headers), range(n)))
+
+@pytest.fixture(scope='module')
+def port():
+    pytest.importorskip('gunicorn')
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    env = dict(os.environ, PORT=str(port), WEB_CONCURRENCY=str(WORKERS), ADMIN_TOKEN='test', MODEL_RELOAD_POLL='0.2',
+               RESPONSE_CACHE='shared')
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:app'],
+                              cwd=SRC, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.monotonic() + 120
+        while True:
+            try:
+                if call(port, 'GET', '/health')[0] == 200:
+                    break
+            except OSError:
+                pass
+            assert time.monotonic() < deadline and server.poll() is None, "gunicorn did not start"
+            time.sleep(0.5)
+        yield port
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=30)
+
+def test_explain_from_every_worker(port):
+    status, body = call(port, 'POST', '/predict?explain=false', READING)
+    assert status == 200
+    polls = fan_out(port, 'GET', f"/explain/{body['prediction_id']}")
+    assert [status for status, _ in polls] == [200] * len(polls)
+
+def test_cached_responses_get_explainable_ids(port):
+    reading = {**READING, 'temperature': 33}
+    first = call(port, 'POST', '/predict?explain=false', reading)[1]
+    responses = [body for _, body in fan_out(port, 'POST', '/predict?explain=false', n=12, body=reading)]
+    assert all(body['cached'] for body in responses)
+    responses.append(first)
+    assert len({body['prediction_id'] for body in responses}) == len(responses)
+    for body in responses:
+        assert call(port, 'GET', f"/explain/{body['prediction_id']}")[0] == 200
+
+def test_reload_reaches_every_worker(port):
+    status, body = call(port, 'POST', '/admin/reload?wait=true&force=true', headers=ADMIN)
+    assert status == 200
+    time.sleep(1)
+    statuses = [body for _, body in fan_out(port, 'GET', '/admin/reload', headers=ADMIN)]
+    assert all(s['generation'] == body['generation'] and s['finished_at'] for s in statuses)
+    # Each worker reloaded on its own, so several reload times prove several workers answered
+    assert len({s['finished_at'] for s in statuses}) > 1